@@ -0,0 +1,96 @@
+"""
+Benchmarks records per second through klotio.logger's JSON formatting,
+the compatible JsonFormatter against FastJsonFormatter with and without caller
+"""
+
+# pylint: disable=invalid-name
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+import pythonjsonlogger.jsonlogger
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+import klotio # pylint: disable=wrong-import-position
+
+
+class NullStream:
+    """
+    Stream that throws away what's written, so only formatting is measured
+    """
+
+    def write(self, text):
+        """
+        Does nothing
+        """
+
+    def flush(self):
+        """
+        Does nothing
+        """
+
+
+def measure(formatter, records, caller=True):
+    """
+    Returns the records per second logged through a handler with a formatter
+    """
+
+    handler = logging.StreamHandler(NullStream())
+    handler.setFormatter(formatter)
+
+    custom = logging.getLogger("bench")
+    custom.handlers = [handler]
+    custom.propagate = False
+    custom.setLevel(logging.INFO)
+
+    logging._srcfile = klotio.LOG_SRCFILE if caller else None # pylint: disable=protected-access
+
+    start = time.perf_counter()
+
+    for index in range(records):
+        custom.info("processed %s", index, extra={"chore": "dishes", "person": "kid"})
+
+    rate = records / (time.perf_counter() - start)
+
+    logging._srcfile = klotio.LOG_SRCFILE # pylint: disable=protected-access
+
+    return rate
+
+
+def run(records=50000):
+    """
+    Runs each formatter, returning records per second by formatter
+    """
+
+    return {
+        "JsonFormatter": measure(pythonjsonlogger.jsonlogger.JsonFormatter(
+            fmt=klotio.LOG_FORMAT, datefmt=klotio.LOG_DATEFMT
+        ), records),
+        "FastJsonFormatter": measure(klotio.FastJsonFormatter(), records),
+        "FastJsonFormatter(caller=False)": measure(klotio.FastJsonFormatter(caller=False), records, caller=False)
+    }
+
+
+def main():
+    """
+    Prints the results
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=50000)
+    args = parser.parse_args()
+
+    results = run(args.records)
+
+    print(f"serializer: {'orjson' if klotio.orjson is not None else 'json'}")
+
+    for formatter, rate in results.items():
+        print(f"{formatter:>32}: {rate:10.0f} records/s {rate / results['JsonFormatter']:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Benchmarks parsing integration fields files with the pure Python SafeLoader
+against libyaml's CSafeLoader, the way klotio.load_yaml picks between them
+"""
+
+# pylint: disable=invalid-name
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+import klotio # pylint: disable=wrong-import-position
+
+
+def integration(fields):
+    """
+    Creates an integration shaped like the integration_*_{form}.fields.yaml ones
+    """
+
+    return {
+        "description": "Integration for chores with lots of options",
+        "integrate": {
+            "node": {
+                "app": "chore.nandy.io",
+                "group": "fields"
+            }
+        },
+        "fields": [
+            {
+                "name": f"field_{index}",
+                "description": f"Field number {index} to pick from",
+                "required": index % 2 == 0,
+                "default": f"option_{index}_0",
+                "options": [f"option_{index}_{option}" for option in range(10)],
+                "labels": {
+                    f"option_{index}_{option}": f"Option {option} for field {index}" for option in range(10)
+                },
+                "integrate": {
+                    "url": f"http://api.klot-io/app/chore.nandy.io/field/{index}"
+                },
+                "fields": [
+                    {"name": "enabled", "style": "checkbox", "default": True},
+                    {"name": "priority", "options": [1, 2, 3, 4, 5], "default": 3}
+                ]
+            } for index in range(fields)
+        ]
+    }
+
+
+def write(directory, files, fields):
+    """
+    Writes out representative integration files, returning their paths
+    """
+
+    paths = []
+
+    for index in range(files):
+
+        path = os.path.join(directory, f"integration_app{index}_chore.fields.yaml")
+
+        with open(path, "w") as integration_file:
+            yaml.safe_dump(integration(fields), integration_file, default_flow_style=False)
+
+        paths.append(path)
+
+    return paths
+
+
+def measure(paths, loader, rounds):
+    """
+    Returns the files per second parsed with a loader
+    """
+
+    start = time.perf_counter()
+
+    for _ in range(rounds):
+        for path in paths:
+            with open(path, "r") as integration_file:
+                yaml.load(integration_file, Loader=loader)
+
+    return rounds * len(paths) / (time.perf_counter() - start)
+
+
+def run(files=10, fields=20, rounds=5):
+    """
+    Runs the benchmark for each loader available, returning files per second by loader
+    """
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        paths = write(directory, files, fields)
+
+        results["python"] = measure(paths, yaml.SafeLoader, rounds)
+
+        if hasattr(yaml, "CSafeLoader"):
+            results["libyaml"] = measure(paths, yaml.CSafeLoader, rounds)
+
+    return results
+
+
+def main():
+    """
+    Prints the results
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--fields", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args.files, args.fields, args.rounds)
+
+    print(f"klotio.load_yaml backend: {klotio.yaml_backend()}")
+
+    for loader, rate in results.items():
+        print(f"{loader:>8}: {rate:10.1f} files/s")
+
+    if "libyaml" in results:
+        print(f" speedup: {results['libyaml'] / results['python']:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
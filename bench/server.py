@@ -0,0 +1,134 @@
+"""
+Local stand-in for the node API so derive can be benchmarked offline
+"""
+
+# pylint: disable=invalid-name
+
+import json
+import hashlib
+import time
+import threading
+import http.server
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers OPTIONS /field/{depth}/{width} with width fields that each
+    integrate the next depth down, and a name at the bottom, and
+    OPTIONS /options/{count} with that many options. Bodies have an ETag
+    and matching If-None-Match gets a 304.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_OPTIONS(self): # pylint: disable=invalid-name
+        """
+        Waits out the latency and answers with the fields
+        """
+
+        time.sleep(self.server.latency)
+
+        parts = self.path.split("?")[0].strip("/").split("/")
+
+        if len(parts) == 3 and parts[0] == "field":
+
+            depth = int(parts[1])
+            width = int(parts[2])
+
+            if depth:
+                body = {"fields": [
+                    {"integrate": {"url": f"{self.server.url}/field/{depth - 1}/{width}"}} for _ in range(width)
+                ]}
+            else:
+                body = {"name": "master", "options": list(range(10))}
+
+            self.respond(200, body)
+
+        elif len(parts) == 2 and parts[0] == "options":
+
+            self.respond(200, {"name": "big", "options": [
+                {"value": index, "label": f"option {index}"} for index in range(int(parts[1]))
+            ]})
+
+        else:
+
+            self.respond(404, {"message": "not found"})
+
+    def respond(self, code, body):
+        """
+        Sends json with a length so the connection can be kept alive
+        """
+
+        encoded = json.dumps(body).encode()
+        etag = f'"{hashlib.sha1(encoded).hexdigest()}"'
+
+        if code == 200 and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        """
+        Stays quiet
+        """
+
+
+class NodeAPI(http.server.ThreadingHTTPServer):
+    """
+    Stand-in node API on a free local port, served from a background thread
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency=0.0):
+        """
+        Binds to a free port, answering every request after latency seconds
+        """
+
+        super().__init__(("127.0.0.1", 0), Handler)
+
+        self.latency = latency
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.thread = None
+
+    def __enter__(self):
+        """
+        Starts serving
+        """
+
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def __exit__(self, *args):
+        """
+        Stops serving
+        """
+
+        self.shutdown()
+        self.server_close()
+
+    def derivation(self, depth, width):
+        """
+        Returns a derivation for fields depth deep and width wide
+        """
+
+        return {"url": f"{self.url}/field/{depth}/{width}"}
+
+    def options(self, count):
+        """
+        Returns a derivation for a field with count options
+        """
+
+        return {"url": f"{self.url}/options/{count}"}
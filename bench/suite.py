@@ -0,0 +1,377 @@
+"""
+Benchmark suite for klotio's hot paths, runnable offline. Saves results as
+a JSON baseline and compares against one, flagging regressions.
+"""
+
+# pylint: disable=invalid-name
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import unittest.mock
+
+import yaml
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+# pylint: disable=wrong-import-position
+
+import klotio
+import klotio_unittest
+
+import server
+import bench_yaml
+import bench_logger
+
+BENCHMARKS = {}
+
+ENVIRONMENT = ("python", "platform", "yaml")
+
+WORKLOAD = ("forms", "integrations", "depth", "latency", "concurrency", "items")
+
+
+def benchmark(name):
+    """
+    Registers a benchmark, a function taking the args and returning seconds
+    per operation keyed by result name
+    """
+
+    def decorator(function):
+        BENCHMARKS[name] = function
+        return function
+
+    return decorator
+
+
+def measure(call, number=1, repeat=5):
+    """
+    Returns the best seconds per call over repeat rounds of number calls
+    """
+
+    best = None
+
+    for _ in range(repeat):
+
+        start = time.perf_counter()
+
+        for _ in range(number):
+            call()
+
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def session():
+    """
+    Creates a pooled session that ignores any proxies in the environment
+    """
+
+    klotio.SESSION = None
+    shared = klotio.session()
+    shared.trust_env = False
+
+    return shared
+
+
+def config(directory, forms, integrations, depth, url):
+    """
+    Writes settings and N forms by M integrations, each integrating fields depth deep
+    """
+
+    with open(os.path.join(directory, "settings.yaml"), "w") as settings_file:
+        yaml.safe_dump(bench_yaml.integration(20), settings_file)
+
+    for form in range(forms):
+        for integration in range(integrations):
+            with open(os.path.join(directory, f"integration_app{integration}_form{form}.fields.yaml"), "w") as integration_file:
+                yaml.safe_dump({
+                    "description": f"app {integration} for form {form}",
+                    "integrate": {"url": f"{url}/field/{depth}/2"}
+                }, integration_file)
+
+
+@benchmark("settings")
+def settings_benchmark(args):
+    """
+    settings() cached and forcing a reload
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        config(directory, 0, 0, 0, "")
+
+        with unittest.mock.patch("klotio.CONFIG", directory), unittest.mock.patch("klotio.FILES", klotio.Files()):
+
+            return {
+                "settings": measure(klotio.settings, number=100),
+                "settings.reload": measure(lambda: klotio.settings(reload=True), number=5)
+            }
+
+
+@benchmark("integrations")
+def integrations_benchmark(args):
+    """
+    integrations(form) over N forms x M integrations x depth D against the stand-in
+    """
+
+    results = {}
+    scale = f"{args.forms}x{args.integrations}x{args.depth}"
+
+    with server.NodeAPI() as node, tempfile.TemporaryDirectory() as directory:
+
+        config(directory, args.forms, args.integrations, args.depth, node.url)
+
+        index = klotio.Index(directory, klotio.Files())
+
+        with unittest.mock.patch("klotio.INDEX", index), unittest.mock.patch("klotio.SESSION", session()):
+
+            def run(concurrency=None):
+                for form in range(args.forms):
+                    klotio.integrations(f"form{form}", concurrency=concurrency)
+
+            results[f"integrations.{scale}"] = measure(run, repeat=3) / args.forms
+            results[f"integrations.{scale}.concurrent"] = measure(lambda: run(args.concurrency), repeat=3) / args.forms
+
+            with unittest.mock.patch("klotio.CACHE", klotio.Cache()):
+                results[f"integrations.{scale}.cached"] = measure(run, repeat=3) / args.forms
+
+    return results
+
+
+@benchmark("derive")
+def derive_benchmark(args):
+    """
+    derive and integrating a tree against the stand-in with latency
+    """
+
+    with server.NodeAPI(args.latency) as node:
+
+        with unittest.mock.patch("klotio.SESSION", session()):
+
+            derivation = node.derivation(0, 2)
+            tree = node.derivation(args.depth, 2)
+            large = node.options(args.items)
+
+            results = {
+                "derive": measure(lambda: klotio.derive(derivation), number=10),
+                "derive.large": measure(lambda: klotio.derive(large), number=10),
+                "integrate.sequential": measure(lambda: klotio.integrate({"integrate": tree}), repeat=3),
+                "integrate.concurrent": measure(lambda: klotio.integrate({"integrate": tree}, concurrency=args.concurrency), repeat=3)
+            }
+
+            with unittest.mock.patch("klotio.VALIDATORS", klotio.Validators()):
+                klotio.derive(large)
+                results["derive.large.revalidated"] = measure(lambda: klotio.derive(large), number=10)
+
+            return results
+
+
+@benchmark("mockredis")
+def mockredis_benchmark(args):
+    """
+    MockRedis set then get of many keys
+    """
+
+    redis = klotio_unittest.MockRedis("bench", 6379)
+    keys = [f"key{index}" for index in range(args.items)]
+
+    def run():
+        for key in keys:
+            redis.set(key, key, ex=60)
+        for key in keys:
+            redis.get(key)
+
+    return {
+        "mockredis.set_get": measure(run, repeat=3) / len(keys)
+    }
+
+
+@benchmark("consistent")
+def consistent_benchmark(args):
+    """
+    TestCase.consistent and assertConsistent over large payloads
+    """
+
+    case = klotio_unittest.TestCase()
+
+    models = [{"id": index, "name": f"model {index}", "fields": [{"name": "a"}, {"name": "b"}]} for index in range(args.items)]
+    response = [{**model, "extra": True} for model in models]
+    scalars = list(range(args.items * 2))
+
+    logger = klotio_unittest.MockLogger("bench")
+
+    for index in range(args.items * 10):
+        logger.info(f"event {index}", extra={"index": index, "fields": [{"name": "a"}]})
+
+    return {
+        "consistent.models": measure(lambda: case.consistent(models, response), repeat=3),
+        "consistent.scalars": measure(lambda: case.consistent(scalars[::2], scalars), repeat=3),
+        "consistent.last": measure(lambda: case.consistent([models[-1]], response), repeat=3),
+        "contains.events": measure(lambda: case.contains({"level": "info", "message": "event 10"}, logger.events), number=100),
+        "contains.list": measure(lambda: case.contains({"level": "info", "message": "event 19999"}, list(logger.events)), repeat=3)
+    }
+
+
+@benchmark("yaml")
+def yaml_benchmark(args):
+    """
+    Parsing integration files with each YAML loader
+    """
+
+    return {
+        f"yaml.{loader}": 1 / rate for loader, rate in bench_yaml.run(rounds=2).items()
+    }
+
+
+@benchmark("logger")
+def logger_benchmark(args):
+    """
+    Formatting log records with each formatter
+    """
+
+    return {
+        f"logger.{formatter}": 1 / rate for formatter, rate in bench_logger.run(args.items * 5).items()
+    }
+
+
+def workload(args):
+    """
+    Returns the arguments that size the benchmarks, so results are only
+    compared against a baseline of the same
+    """
+
+    return {key: getattr(args, key) for key in WORKLOAD}
+
+
+def run(args):
+    """
+    Runs the selected benchmarks, returning results with what they ran on
+    and the workload they ran
+    """
+
+    results = {}
+
+    for name, function in BENCHMARKS.items():
+        if not args.only or name in args.only:
+            print(f"running {name}", file=sys.stderr)
+            results.update(function(args))
+
+    return {
+        "python": ".".join(platform.python_version_tuple()[:2]),
+        "platform": platform.machine(),
+        "yaml": klotio.yaml_backend(),
+        "workload": workload(args),
+        "results": results
+    }
+
+
+def mismatches(baseline, current, keys=ENVIRONMENT):
+    """
+    Returns how what the baseline was recorded with differs from what's
+    running, for keys
+    """
+
+    return [
+        f"{key} {baseline.get(key)} vs {current.get(key)}"
+        for key in keys
+        if baseline.get(key) != current.get(key)
+    ]
+
+
+def compare(baseline, current, threshold):
+    """
+    Returns a line per result and whether any regressed beyond threshold.
+    Timings from a different python, platform or yaml backend aren't
+    comparable, so nothing's flagged against those.
+    """
+
+    lines = []
+    regressed = False
+    different = mismatches(baseline, current)
+
+    if different:
+        lines.append(f"WARNING baseline recorded on a different environment ({', '.join(different)}), not flagging regressions")
+
+    for name, seconds in current["results"].items():
+
+        before = baseline["results"].get(name)
+
+        if before is None:
+            lines.append(f"{name:>48}: {seconds * 1000:12.4f}ms (new)")
+            continue
+
+        ratio = seconds / before
+        flag = ""
+
+        if ratio > 1 + threshold and not different:
+            flag = " REGRESSED"
+            regressed = True
+
+        lines.append(f"{name:>48}: {seconds * 1000:12.4f}ms vs {before * 1000:12.4f}ms {ratio:6.2f}x{flag}")
+
+    return lines, regressed
+
+
+def main():
+    """
+    Runs, prints, and saves or compares
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--only", nargs="*", choices=list(BENCHMARKS.keys()))
+    parser.add_argument("--forms", type=int, default=3)
+    parser.add_argument("--integrations", type=int, default=3)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--save", help="write results as a baseline to this path")
+    parser.add_argument("--compare", help="compare results to the baseline at this path")
+    parser.add_argument("--threshold", type=float, default=0.25, help="slowdown ratio over baseline that's a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+
+        if not os.path.exists(args.compare):
+            parser.error(f"no baseline at {args.compare}, record one with make baseline")
+
+        with open(args.compare, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+
+        different = mismatches(baseline.get("workload", {}), workload(args), WORKLOAD)
+
+        if different:
+            parser.error(f"baseline ran a different workload ({', '.join(different)}), run it with the same arguments")
+
+    current = run(args)
+
+    if args.compare:
+
+        lines, regressed = compare(baseline, current, args.threshold)
+        print("\n".join(lines))
+
+    else:
+
+        regressed = False
+
+        for name, seconds in current["results"].items():
+            print(f"{name:>48}: {seconds * 1000:12.4f}ms")
+
+    if args.save:
+        with open(args.save, "w") as baseline_file:
+            json.dump(current, baseline_file, indent=4, sort_keys=True)
+            baseline_file.write("\n")
+
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
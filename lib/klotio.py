@@ -5,27 +5,595 @@ Module for general klot-io functionality
 # pylint: disable: invalid-name
 
 import os
+import copy
 import glob
+import re
+import json
+import time
+import random
+import bisect
+import heapq
+import atexit
+import itertools
+import functools
 import yaml
+import asyncio
+import concurrent.futures
+import queue
 import logging
+import logging.handlers
+import threading
 import requests
+import requests.adapters
+import urllib3.util.retry
+import urllib3.util.request
 import pythonjsonlogger.jsonlogger
+from klotio_cache import ( # pylint: disable=unused-import
+    selector, Cache, RedisCache, DiskCache, SingleFlight, clone, Validators,
+    derivation_key, derivation_target, DeadlineExceeded, FailFast, Breaker
+)
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def logger(name):
+CONFIG = "/opt/service/config"
+
+TIMEOUT = (
+    float(os.environ.get("HTTP_CONNECT_TIMEOUT", 3.05)),
+    float(os.environ.get("HTTP_READ_TIMEOUT", 10))
+)
+
+SESSION = None
+SESSION_TWIN = None
+SESSION_LOCK = threading.Lock()
+
+CACHE = None
+
+VALIDATORS = None
+
+BREAKER = None
+
+METRICS = None
+
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader) # pylint: disable=invalid-name
+
+LOG_FORMAT = "%(created)f %(asctime)s %(name)s %(levelname)s %(pathname)s %(funcName)s %(lineno)d %(message)s"
+LOG_DATEFMT = "%Y-%m-%d %H:%M:%S %Z"
+LOG_ENCODER = pythonjsonlogger.jsonlogger.JsonEncoder()
+LOG_SRCFILE = logging._srcfile # pylint: disable=protected-access
+
+
+class Metrics:
+    """
+    Timings, counts and errors of klotio's hot paths, kept as histograms by
+    operation and label. Set METRICS to one, or call instrument, to record.
+    """
+
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, hook=None):
+        """
+        Calls hook with operation, label, duration and any exception after each call
+        """
+
+        self.hook = hook
+
+        self.labels = {}
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def record(self, operation, label, value, duration, error=None): # pylint: disable=too-many-arguments
+        """
+        Records a call's duration and whether it errored
+        """
+
+        bucket = bisect.bisect_left(self.BUCKETS, duration)
+
+        with self.lock:
+
+            series = self.series.get((operation, value))
+
+            if series is None:
+                self.labels[operation] = label
+                series = self.series[(operation, value)] = [0, 0, 0.0, [0] * (len(self.BUCKETS) + 1)]
+
+            series[0] += 1
+            series[1] += error is not None
+            series[2] += duration
+            series[3][bucket] += 1
+
+        if self.hook is not None:
+            self.hook(operation, value, duration, error)
+
+    def as_dict(self):
+        """
+        Returns operation, then label, with count, errors, sum and cumulative buckets
+        """
+
+        exported = {}
+
+        with self.lock:
+
+            for (operation, value), (count, errors, total, buckets) in sorted(self.series.items(), key=str):
+
+                cumulative = 0
+                counts = {}
+
+                for bound, bucket in zip(self.BUCKETS + (float("inf"),), buckets):
+                    cumulative += bucket
+                    counts[bound] = cumulative
+
+                exported.setdefault(operation, {})[value] = {
+                    "count": count,
+                    "errors": errors,
+                    "sum": total,
+                    "buckets": counts
+                }
+
+        return exported
+
+    @staticmethod
+    def selector(label, value, bound=None):
+        """
+        Returns the Prometheus label selector for a value and optional bucket bound
+        """
+
+        return selector(label, value, bound)
+
+    def prometheus(self):
+        """
+        Returns the histograms and error counters in Prometheus text format
+        """
+
+        lines = []
+
+        for operation, values in self.as_dict().items():
+
+            label = self.labels[operation]
+            name = f"klotio_{operation}"
+
+            lines.append(f"# TYPE {name}_seconds histogram")
+
+            for value, series in values.items():
+                for bound, count in series["buckets"].items():
+                    upper = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_seconds_bucket{self.selector(label, value, upper)} {count}")
+                lines.append(f"{name}_seconds_sum{self.selector(label, value)} {series['sum']}")
+                lines.append(f"{name}_seconds_count{self.selector(label, value)} {series['count']}")
+
+            lines.append(f"# TYPE {name}_errors_total counter")
+
+            for value, series in values.items():
+                lines.append(f"{name}_errors_total{self.selector(label, value)} {series['errors']}")
+
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        """
+        Forgets everything recorded
+        """
+
+        with self.lock:
+            self.labels.clear()
+            self.series.clear()
+
+
+def instrument(hook=None):
+    """
+    Starts recording metrics, returning them
+    """
+
+    global METRICS # pylint: disable=global-statement
+
+    METRICS = Metrics(hook)
+
+    return METRICS
+
+
+def instrumented(operation, label=None, value=None):
+    """
+    Decorates a function to record its calls in METRICS, with a label whose
+    value comes from calling value with the same arguments. Does next to
+    nothing when METRICS isn't set.
+    """
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+
+            metrics = METRICS
+
+            if metrics is None:
+                return function(*args, **kwargs)
+
+            start = time.perf_counter()
+
+            try:
+                result = function(*args, **kwargs)
+            except Exception as exception:
+                metrics.record(operation, label, value(*args, **kwargs) if value else None, time.perf_counter() - start, exception)
+                raise
+
+            metrics.record(operation, label, value(*args, **kwargs) if value else None, time.perf_counter() - start)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class QueuedListener(logging.handlers.QueueListener):
+    """
+    Listener that waits for room to queue its stop marker, so stopping with a
+    full queue flushes it rather than raising
+    """
+
+    def enqueue_sentinel(self):
+        """
+        Blocks until the listener has made room for the stop marker
+        """
+
+        self.queue.put(self._sentinel)
+
+
+class QueuedHandler(logging.handlers.QueueHandler):
+    """
+    Hands records off to a bounded queue that a background listener formats
+    and emits, so logging never waits on a backed up stream
+    """
+
+    def __init__(self, handler, size=10000, block=False, timeout=None):
+        """
+        Starts the listener emitting to handler. When the queue is full,
+        either blocks up to timeout or drops the record and counts it.
+        """
+
+        super().__init__(queue.Queue(size))
+
+        self.block = block
+        self.timeout = timeout
+        self.dropped = 0
+
+        self.listener = QueuedListener(self.queue, handler, respect_handler_level=True)
+        self.listener.start()
+
+    def prepare(self, record):
+        """
+        Merges the message with its args now, before the caller can change
+        them, leaving the rest of formatting to the listener's handler
+        """
+
+        record = copy.copy(record)
+        record.message = record.getMessage()
+
+        if isinstance(record.msg, dict):
+            record.msg = dict(record.msg)
+        else:
+            record.msg = record.message
+            record.args = None
+
+        return record
+
+    def enqueue(self, record):
+        """
+        Queues the record, dropping it if full and not blocking or timed out
+        """
+
+        try:
+            self.queue.put(record, block=self.block, timeout=self.timeout)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """
+        Stops the listener, which flushes what's queued
+        """
+
+        if self.listener._thread is not None: # pylint: disable=protected-access
+            self.listener.stop()
+
+        super().close()
+
+
+class FastJsonFormatter(logging.Formatter):
+    """
+    High throughput formatter with the same keys as JsonFormatter. Fields
+    are worked out once, asctime is reused within the same second and
+    serializing uses orjson if it's installed.
     """
-    Creates a logget by name and sets the default logging to be structured
+
+    CALLER = ("pathname", "filename", "module", "funcName", "lineno")
+
+    def __init__(self, fmt=LOG_FORMAT, datefmt=LOG_DATEFMT, caller=True):
+        """
+        Parses the fields from fmt, leaving out where it was logged from unless caller
+        """
+
+        super().__init__(fmt, datefmt)
+
+        self.fields = [
+            field for field in re.findall(r"\((.+?)\)", self._fmt)
+            if caller or field not in self.CALLER
+        ]
+        self.asctime = "asctime" in self.fields
+        self.skip = set(self.fields) | set(pythonjsonlogger.jsonlogger.RESERVED_ATTRS)
+        self.second = (None, None)
+
+    def formatTime(self, record, datefmt=None):
+        """
+        Formats the time, only calling strftime once a second
+        """
+
+        second, formatted = self.second
+
+        if second != int(record.created):
+            second = int(record.created)
+            formatted = time.strftime(datefmt or self.default_time_format, self.converter(second))
+            self.second = (second, formatted)
+
+        return formatted if datefmt else self.default_msec_format % (formatted, record.msecs)
+
+    @staticmethod
+    def dumps(log):
+        """
+        Serializes with orjson if possible, the standard json otherwise
+        """
+
+        if orjson is not None:
+            try:
+                return orjson.dumps(log, default=LOG_ENCODER.default).decode()
+            except (TypeError, orjson.JSONEncodeError):
+                pass
+
+        return json.dumps(log, default=LOG_ENCODER.default)
+
+    def format(self, record):
+        """
+        Formats a log record and serializes to json
+        """
+
+        message = {}
+
+        if isinstance(record.msg, dict):
+            message = dict(record.msg)
+            record.message = None
+        else:
+            record.message = record.getMessage()
+
+        if self.asctime:
+            record.asctime = self.formatTime(record, self.datefmt)
+
+        if record.exc_info and not message.get("exc_info"):
+            message["exc_info"] = self.formatException(record.exc_info)
+        if not message.get("exc_info") and record.exc_text:
+            message["exc_info"] = record.exc_text
+        if record.stack_info and not message.get("stack_info"):
+            message["stack_info"] = self.formatStack(record.stack_info)
+
+        log = {field: record.__dict__.get(field) for field in self.fields}
+        log.update(message)
+
+        for key, value in record.__dict__.items():
+            if key not in self.skip and not (isinstance(key, str) and key.startswith("_")):
+                log[key] = value
+
+        return self.dumps(log)
+
+
+class RateLimitFilter(logging.Filter): # pylint: disable=too-many-instance-attributes
+    """
+    Throttles records per logger, level and message template, letting at
+    most rate through each period and sampling what's left of them. Once a
+    period's over, a timer, or the next record through or closing if that's
+    sooner, summarizes how many were suppressed.
+    """
+
+    SIZE = 10000
+
+    def __init__(self, handler, rate=0, period=1.0, sample=1.0, clock=time.monotonic, chance=random.random, timer=threading.Timer): # pylint: disable=too-many-arguments
+        """
+        Summaries go out through handler. A rate of 0 is no limit and a
+        sample of 1 keeps everything. Timers are made like threading.Timer.
+        """
+
+        super().__init__()
+
+        self.handler = handler
+        self.rate = rate
+        self.period = period
+        self.sample = sample
+        self.clock = clock
+        self.chance = chance
+        self.timer = timer
+
+        self.windows = {}
+        self.pending = []
+        self.sequence = itertools.count()
+        self.scheduled = None
+        self.lock = threading.Lock()
+
+    def prune(self, now):
+        """
+        Forgets expired windows with nothing suppressed if there's too many
+        """
+
+        if len(self.windows) > self.SIZE:
+            for key, window in list(self.windows.items()):
+                if now - window[0] >= self.period and not window[2]:
+                    del self.windows[key]
+
+    def summarize(self, record, suppressed):
+        """
+        Emits a summary of what was suppressed like the record
+        """
+
+        summary = logging.LogRecord(
+            record.name, record.levelno, record.pathname, record.lineno,
+            "%d similar messages suppressed: %s", (suppressed, record.msg), None, record.funcName
+        )
+        summary.suppressed = suppressed
+
+        self.handler.handle(summary)
+
+    def due(self, now=None):
+        """
+        Takes the suppressed counts of windows over by now, or all of them, with
+        the records to summarize them like. Call with the lock held.
+        """
+
+        due = []
+
+        while self.pending and (now is None or self.pending[0][0] <= now):
+
+            _, _, window, record = heapq.heappop(self.pending)
+
+            if window[2]:
+                due.append((record, window[2]))
+                window[2] = 0
+
+        return due
+
+    def schedule(self):
+        """
+        Starts a timer to flush when the earliest pending window's over, unless
+        there's one for then already. Call with the lock held.
+        """
+
+        if not self.pending:
+            return
+
+        end = self.pending[0][0]
+
+        if self.scheduled is not None:
+
+            if self.scheduled[0] <= end:
+                return
+
+            self.scheduled[1].cancel()
+
+        timer = self.timer(max(end - self.clock(), 0), self.flush)
+        timer.daemon = True
+        timer.start()
+
+        self.scheduled = (end, timer)
+
+    def flush(self):
+        """
+        Summarizes the windows that are over, even if nothing's logged since,
+        and waits for the next
+        """
+
+        with self.lock:
+            self.scheduled = None
+            due = self.due(self.clock())
+            self.schedule()
+
+        for record, suppressed in due:
+            self.summarize(record, suppressed)
+
+    def close(self):
+        """
+        Summarizes whatever's still suppressed, like when done logging
+        """
+
+        atexit.unregister(self.close)
+
+        with self.lock:
+
+            due = self.due()
+
+            if self.scheduled is not None:
+                self.scheduled[1].cancel()
+                self.scheduled = None
+
+        for record, suppressed in due:
+            self.summarize(record, suppressed)
+
+    def filter(self, record):
+        """
+        Whether the record is within the rate and sampled
+        """
+
+        if hasattr(record, "suppressed"):
+            return True
+
+        key = (record.name, record.levelno, record.msg if isinstance(record.msg, str) else str(record.msg))
+        now = self.clock()
+
+        with self.lock:
+
+            due = self.due(now) if self.pending else []
+            window = self.windows.get(key)
+
+            if window is None or now - window[0] >= self.period:
+                if window is not None and window[2]:
+                    due.append((record, window[2]))
+                    window[2] = 0
+                elif window is None:
+                    self.prune(now)
+                window = [now, 0, 0]
+                self.windows[key] = window
+
+            allowed = (not self.rate or window[1] < self.rate) and (self.sample >= 1 or self.chance() < self.sample)
+
+            if allowed:
+                window[1] += 1
+            else:
+                if not window[2]:
+                    heapq.heappush(self.pending, (window[0] + self.period, next(self.sequence), window, record))
+                    self.schedule()
+                window[2] += 1
+
+        for summarized, suppressed in due:
+            self.summarize(summarized, suppressed)
+
+        return allowed
+
+
+def logger(name, queued=False, size=10000, block=False, fast=False, caller=True): # pylint: disable=too-many-arguments
+    """
+    Creates a logget by name and sets the default logging to be structured.
+    If queued, records are emitted by a background thread from a queue of
+    size, dropping records when full unless block. If fast, formats with
+    FastJsonFormatter, and without caller skips finding where it was logged.
+    LOG_RATE, LOG_RATE_PERIOD and LOG_SAMPLE throttle repeated messages.
     """
 
     level = os.environ.get("LOG_LEVEL", "WARNING")
+    rate = int(os.environ.get("LOG_RATE", 0))
+    period = float(os.environ.get("LOG_RATE_PERIOD", 1))
+    sample = float(os.environ.get("LOG_SAMPLE", 1))
 
     handler = logging.StreamHandler()
-    handler.setFormatter(pythonjsonlogger.jsonlogger.JsonFormatter(
-        fmt="%(created)f %(asctime)s %(name)s %(levelname)s %(pathname)s %(funcName)s %(lineno)d %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S %Z"
-    ))
+
+    if fast:
+        handler.setFormatter(FastJsonFormatter(caller=caller))
+        logging._srcfile = LOG_SRCFILE if caller else None # pylint: disable=protected-access
+    else:
+        handler.setFormatter(pythonjsonlogger.jsonlogger.JsonFormatter(fmt=LOG_FORMAT, datefmt=LOG_DATEFMT))
+        logging._srcfile = LOG_SRCFILE # pylint: disable=protected-access
+
+    if queued:
+        handler = QueuedHandler(handler, size, block)
+
+    if rate or sample < 1:
+        limiter = RateLimitFilter(handler, rate, period, sample)
+        handler.addFilter(limiter)
+        atexit.register(limiter.close)
 
     root = logging.getLogger()
+
+    for existing in root.handlers:
+        for limiter in existing.filters:
+            if isinstance(limiter, RateLimitFilter):
+                limiter.close()
+        if isinstance(existing, QueuedHandler):
+            existing.close()
+
     root.handlers = []
     root.addHandler(handler)
     root.setLevel(level)
@@ -36,55 +604,605 @@ def logger(name):
     return custom
 
 
-def settings():
+def yaml_backend():
+    """
+    Returns which YAML loader is in use, libyaml if PyYAML was built with it
+    """
+
+    return "python" if YAML_LOADER is yaml.SafeLoader else "libyaml"
+
+
+def load_yaml(stream):
     """
-    Loads and returns settings from the default config area
+    Safely loads YAML with the fastest loader available
     """
 
-    with open("/opt/service/config/settings.yaml", "r") as settings_file:
-        return yaml.safe_load(settings_file)
+    return yaml.load(stream, Loader=YAML_LOADER)
 
 
-def derive(derivation):
+class Files:
     """
-    Derives the integrations to grab with wordplay
+    Cache of parsed YAML files, reparsed only when the file's inode, size or
+    mtime changes, so a ConfigMap symlink swap is still picked up.
     """
 
-    if "url" in derivation:
-        response = requests.options(derivation["url"])
-    elif "node" in derivation:
-        response = requests.options("http://api.klot-io/node", params=derivation["node"])
+    def __init__(self):
+        """
+        Keep track of each path's stat signature and what it parsed to
+        """
+
+        self.parsed = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def signature(path):
+        """
+        Returns what identifies this version of the file, None if it can't be stat'd
+        """
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def load(self, path, reload=False):
+        """
+        Returns a copy of the parsed file, parsing it again if it changed or reload
+        """
+
+        signature = self.signature(path)
+
+        with self.lock:
+            entry = self.parsed.get(path)
+
+        if reload or signature is None or entry is None or entry[0] != signature:
+
+            with open(path, "r") as parsed_file:
+                parsed = load_yaml(parsed_file)
+
+            if signature is not None:
+                with self.lock:
+                    self.parsed[path] = (signature, parsed)
+
+        else:
+
+            parsed = entry[1]
+
+        return copy.deepcopy(parsed)
+
+    def clear(self):
+        """
+        Forgets everything parsed
+        """
+
+        with self.lock:
+            self.parsed.clear()
+
+
+FILES = Files()
+
+
+@instrumented("settings")
+def settings(reload=False):
+    """
+    Loads and returns settings from the default config area, cached until
+    the file changes or reload
+    """
+
+    return FILES.load(f"{CONFIG}/settings.yaml", reload)
+
+
+class Index:
+    """
+    Index of the integration templates in the config directory by form.
+    A form is only globbed again once the directory itself changes and
+    each template only parsed again once its file changes.
+    """
+
+    def __init__(self, directory=CONFIG, files=None):
+        """
+        Keep track of the directory, where to parse files, and each form's paths
+        """
+
+        self.directory = directory
+        self.files = files if files is not None else FILES
+
+        self.forms = {}
+        self.lock = threading.Lock()
+
+    def paths(self, form):
+        """
+        Returns the sorted integration paths for a form
+        """
+
+        signature = Files.signature(self.directory)
+
+        with self.lock:
+            entry = self.forms.get(form)
+
+        if signature is not None and entry is not None and entry[0] == signature:
+            return entry[1]
+
+        paths = sorted(glob.glob(f"{self.directory}/integration_*_{form}.fields.yaml"))
+
+        if signature is not None:
+            with self.lock:
+                self.forms[form] = (signature, paths)
+
+        return paths
+
+    def templates(self, form):
+        """
+        Returns copies of a form's integrations, named, yet to be integrated
+        """
+
+        return [
+            {**{"name": os.path.basename(path).split("_")[1], **self.files.load(path)}}
+            for path in self.paths(form)
+        ]
+
+    def clear(self):
+        """
+        Forgets every form's paths
+        """
+
+        with self.lock:
+            self.forms.clear()
+
+
+INDEX = Index()
+
+
+def pooled(max_retries):
+    """
+    Creates a keep-alive session with a pool per host, retrying as told
+    """
+
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=int(os.environ.get("HTTP_POOL_HOSTS", 10)),
+        pool_maxsize=int(os.environ.get("HTTP_POOL_SIZE", 10)),
+        max_retries=max_retries
+    )
+
+    created = requests.Session()
+    created.headers["Accept-Encoding"] = urllib3.util.request.ACCEPT_ENCODING
+    created.mount("http://", adapter)
+    created.mount("https://", adapter)
+
+    return created
+
+
+def session(retries=True):
+    """
+    Returns the shared keep-alive session for derivations, creating it the
+    first time with retries with backoff on OPTIONS. Without retries, for
+    lookups bounded by a deadline, returns its twin that tries just once so
+    it can't retry past it. Set SESSION directly to swap in something else
+    for both.
+    """
+
+    global SESSION, SESSION_TWIN # pylint: disable=global-statement
+
+    with SESSION_LOCK:
+
+        if SESSION is None:
+            SESSION = pooled(urllib3.util.retry.Retry(
+                total=int(os.environ.get("HTTP_RETRIES", 3)),
+                backoff_factor=float(os.environ.get("HTTP_BACKOFF", 0.1)),
+                status_forcelist=(502, 503, 504),
+                method_whitelist=frozenset(["HEAD", "GET", "OPTIONS"]),
+                raise_on_status=False
+            ))
+            SESSION_TWIN = (SESSION, pooled(0))
+
+        if not retries and SESSION_TWIN is not None and SESSION_TWIN[0] is SESSION:
+            return SESSION_TWIN[1]
+
+        return SESSION
+
+
+FLIGHT = SingleFlight()
+
+
+def lookup(derivation, conditional=True, timeout=None):
+    """
+    Looks up a derivation from its url or the node api, revalidating what
+    it last parsed to if VALIDATORS is set. With a timeout, the seconds left
+    before a deadline, tries just once and no longer than that.
+    """
+
+    validators = VALIDATORS
+    key = derivation_key(derivation)
+    options = {"timeout": TIMEOUT}
+
+    if timeout is not None:
+
+        if timeout <= 0:
+            raise DeadlineExceeded("deadline exceeded")
+
+        options["timeout"] = tuple(min(limit, timeout) for limit in TIMEOUT)
+
+    if validators is not None and conditional:
+        headers = validators.headers(key)
+        if headers:
+            options["headers"] = headers
+
+    client = session(retries=timeout is None)
+
+    try:
+        if "url" in derivation:
+            response = client.options(derivation["url"], **options)
+        elif "node" in derivation:
+            response = client.options("http://api.klot-io/node", params=derivation["node"], **options)
+    except requests.exceptions.Timeout as exception:
+        limit = TIMEOUT[0] if isinstance(exception, requests.exceptions.ConnectTimeout) else TIMEOUT[1]
+        if timeout is not None and timeout < limit:
+            raise DeadlineExceeded("deadline exceeded") from exception
+        raise
+
+    if "headers" in options and response.status_code == 304:
+
+        reused = validators.reuse(key)
+
+        if reused is None:
+            return lookup(derivation, conditional=False, timeout=timeout)
+
+        return reused
 
     response.raise_for_status()
 
-    return response.json()
+    parsed = response.json()
+
+    if validators is not None:
+        return validators.store(key, response.headers, parsed)
+
+    return parsed
+
+
+def guard(derivation, timeout=None):
+    """
+    Looks up a derivation through BREAKER, if set, failing fast while its
+    target's down
+    """
+
+    if BREAKER is None:
+        return lookup(derivation, timeout=timeout)
+
+    return BREAKER.call(derivation, lambda: lookup(derivation, timeout=timeout))
+
+
+def coalesce(derivation, timeout=None):
+    """
+    Looks up a derivation, sharing any identical lookup already in flight,
+    waiting on it no longer than timeout. A shared lookup isn't bound by any
+    one caller's deadline, so it runs to the end for the others.
+    """
+
+    if FLIGHT is None:
+        return guard(derivation, timeout)
+
+    try:
+        return FLIGHT.do(derivation_key(derivation), lambda: guard(derivation), timeout)
+    except concurrent.futures.TimeoutError as exception:
+        raise DeadlineExceeded("deadline exceeded") from exception
+
 
-def integrate(integration):
+@instrumented("derive", "target", lambda derivation, timeout=None: derivation_target(derivation))
+def derive(derivation, timeout=None):
     """
-    Integrates the values for a field including sub fields
+    Derives the integrations to grab with wordplay, within timeout seconds
+    if there's a deadline
+    """
+
+    if CACHE is not None:
+        return CACHE.fetch(
+            derivation_key(derivation), lambda: coalesce(derivation, timeout), lambda: coalesce(derivation)
+        )
+
+    return coalesce(derivation, timeout)
+
+class Budget:
+    """
+    Limits on integrating, shared by every field of one integrate or
+    integrations call: a deadline, how many derivations, and how deep
+    """
+
+    def __init__(self, deadline=None, derives=None, depth=None, clock=time.monotonic):
+        """
+        Stops deriving deadline seconds from now, after derives derivations,
+        and for fields depth or more levels down. None is no limit.
+        """
+
+        self.clock = clock
+        self.expires = None if deadline is None else clock() + deadline
+        self.derives = derives
+        self.depth = depth
+
+        self.spent = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        """
+        Seconds left before the deadline, None if there isn't one
+        """
+
+        if self.expires is None:
+            return None
+
+        return max(self.expires - self.clock(), 0)
+
+    def spend(self, depth):
+        """
+        Spends a derivation for a field depth levels down, returning why not
+        if it can't be
+        """
+
+        with self.lock:
+
+            if self.closed or (self.expires is not None and self.clock() >= self.expires):
+                return "deadline exceeded"
+
+            if self.depth is not None and depth >= self.depth:
+                return f"depth limit of {self.depth} reached"
+
+            if self.derives is not None and self.spent >= self.derives:
+                return f"derive limit of {self.derives} reached"
+
+            self.spent += 1
+
+        return None
+
+    def settle(self, integration, update=None, error=None):
+        """
+        Updates an integration with what was derived or the error, unless
+        closed out already, returning whether it was
+        """
+
+        with self.lock:
+
+            if self.closed:
+                return False
+
+            if update is not None:
+                integration.update(update)
+
+            if error is not None:
+                integration.setdefault("errors", [])
+                integration["errors"].append(f"failed to integrate: {error}")
+
+            return True
+
+    def close(self, pending):
+        """
+        Stops deriving past the deadline, noting it for the pending integrations
+        still being derived, whose results will be dropped
+        """
+
+        with self.lock:
+
+            self.closed = True
+
+            for integration in pending:
+                integration.setdefault("errors", [])
+                integration["errors"].append("failed to integrate: deadline exceeded")
+
+
+def lineage(integration, ancestors=()):
+    """
+    Returns the derivation keys an integration's fields descend from
+    """
+
+    if "integrate" in integration:
+        return ancestors + (derivation_key(integration["integrate"]),)
+
+    return ancestors
+
+def refusal(integration, budget, depth, ancestors):
+    """
+    Returns why an integration can't be derived, a cycle or the budget, None if it can
+    """
+
+    key = derivation_key(integration["integrate"])
+
+    if key in ancestors:
+        return f"cycle through {key}"
+
+    return budget.spend(depth)
+
+def derived(integration, budget=None, depth=0, ancestors=()):
+    """
+    Derives a single integration in place, noting any failure in its errors,
+    or why it wasn't derived
     """
 
     if "integrate" in integration:
+
+        budget = budget or Budget()
+        refused = refusal(integration, budget, depth, ancestors)
+
+        if refused:
+            budget.settle(integration, error=refused)
+            return integration
+
         try:
-            integration.update(derive(integration["integrate"]))
+            budget.settle(integration, update=derive(integration["integrate"], budget.remaining()))
         except Exception as exception:
-            integration.setdefault("errors", [])
-            integration["errors"].append(f"failed to integrate: {exception}")
+            budget.settle(integration, error=exception)
+
+    return integration
+
+def fan_out(pool, blocks, budget=None, depth=0):
+    """
+    Derives every integrate block within blocks on the pool, following
+    the fields each derivation returns as soon as it comes back, until the
+    budget runs out
+    """
+
+    budget = budget or Budget()
+
+    futures = {}
+    fields = [(block, depth, ()) for block in blocks]
+
+    while fields or futures:
+
+        for field, level, ancestors in fields:
+            if "integrate" in field:
+                futures[pool.submit(derived, field, budget, level, ancestors)] = (field, level, ancestors)
+            else:
+                fields.extend((child, level + 1, ancestors) for child in field.get("fields", []))
+
+        fields = []
+
+        if futures:
+
+            done, _ = concurrent.futures.wait(
+                futures, timeout=budget.remaining(), return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+            if not done:
+                budget.close([futures.pop(future)[0] for future in list(futures)])
+                continue
+
+            for future in done:
+                field, level, ancestors = futures.pop(future)
+                fields.extend((child, level + 1, lineage(field, ancestors)) for child in future.result().get("fields", []))
+
+def integrating(function):
+    """
+    Wraps integrate and integrations, making the budget from deadline,
+    max_derives and max_depth unless one's passed down
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, deadline=None, max_derives=None, max_depth=None, budget=None, **kwargs):
+        return function(*args, budget=budget or Budget(deadline, max_derives, max_depth), **kwargs)
+
+    return wrapper
+
+@instrumented("integrate", "depth", lambda integration, concurrency=None, depth=0, **budget: depth)
+@integrating
+def integrate(integration, concurrency=None, depth=0, budget=None, ancestors=()):
+    """
+    Integrates the values for a field including sub fields. With concurrency,
+    up to that many derivations run at once across the whole tree. With a
+    deadline in seconds, max_derives or max_depth, fields past them are left
+    underived with an error saying so.
+    """
+
+    if concurrency:
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            fan_out(pool, [integration], budget, depth)
+        finally:
+            pool.shutdown(wait=not budget.closed)
+        return integration
+
+    derived(integration, budget, depth, ancestors)
 
     for field in integration.get("fields", []):
-        integrate(field)
+        integrate(field, depth=depth + 1, budget=budget, ancestors=lineage(integration, ancestors))
 
     return integration
 
-def integrations(form):
+@instrumented("integrations", "form", lambda form, concurrency=None, **budget: form)
+@integrating
+def integrations(form, concurrency=None, budget=None):
     """
-    Loads the integrations for a form, including looking up the values
+    Loads the integrations for a form, including looking up the values. With
+    concurrency, derivations across all the integrations share one pool. The
+    deadline, max_derives and max_depth are for all of them together.
     """
 
     integrated = []
 
-    for integration_path in sorted(glob.glob(f"/opt/service/config/integration_*_{form}.fields.yaml")):
-        with open(integration_path, "r") as integration_file:
-            integrated.append(integrate({**{"name": integration_path.split("_")[1], **yaml.safe_load(integration_file)}}))
+    for integration in INDEX.templates(form):
+        integrated.append(integration if concurrency else integrate(integration, budget=budget))
+
+    if concurrency:
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            fan_out(pool, integrated, budget)
+        finally:
+            pool.shutdown(wait=not budget.closed)
+
+    return integrated
+
+
+async def async_derive(derivation, timeout=None):
+    """
+    Derives without blocking the loop, through the same session, cache and
+    coalescing as derive, so results and exceptions match
+    """
+
+    loop = asyncio.get_running_loop()
+
+    if FLIGHT is None:
+        return await loop.run_in_executor(None, derive, derivation, timeout)
+
+    async def call():
+        return await loop.run_in_executor(None, derive, derivation)
+
+    try:
+        return await FLIGHT.async_do(derivation_key(derivation), call, timeout)
+    except asyncio.TimeoutError as exception:
+        raise DeadlineExceeded("deadline exceeded") from exception
+
+async def async_derived(integration, semaphore, budget=None, depth=0, ancestors=()):
+    """
+    Derives an integration and then all its fields concurrently, at most
+    the semaphore's worth at once, within the budget
+    """
+
+    budget = budget or Budget()
+
+    if "integrate" in integration:
+
+        refused = refusal(integration, budget, depth, ancestors)
+
+        if refused:
+            budget.settle(integration, error=refused)
+        else:
+            try:
+                async with semaphore:
+                    remaining = budget.remaining()
+                    budget.settle(integration, update=await asyncio.wait_for(
+                        async_derive(integration["integrate"], remaining), remaining
+                    ))
+            except asyncio.TimeoutError:
+                budget.settle(integration, error="deadline exceeded")
+            except Exception as exception:
+                budget.settle(integration, error=exception)
+
+    children = lineage(integration, ancestors)
+
+    await asyncio.gather(*[
+        async_derived(field, semaphore, budget, depth + 1, children) for field in integration.get("fields", [])
+    ])
+
+    return integration
+
+async def async_integrate(integration, concurrency=10, deadline=None, max_derives=None, max_depth=None):
+    """
+    Integrates the values for a field including sub fields without blocking
+    the loop, within the same limits as integrate
+    """
+
+    return await async_derived(integration, asyncio.Semaphore(concurrency), Budget(deadline, max_derives, max_depth))
+
+async def async_integrations(form, concurrency=10, deadline=None, max_derives=None, max_depth=None):
+    """
+    Loads the integrations for a form without blocking the loop, reading the
+    files in the executor and deriving across all of them concurrently,
+    within the same limits as integrations
+    """
+
+    budget = Budget(deadline, max_derives, max_depth)
+    integrated = await asyncio.get_running_loop().run_in_executor(None, INDEX.templates, form)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    await asyncio.gather(*[async_derived(integration, semaphore, budget) for integration in integrated])
 
     return integrated
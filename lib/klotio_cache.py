@@ -0,0 +1,1090 @@
+"""
+Module for caching, coalescing and guarding klot-io derivations
+"""
+
+import os
+import copy
+import json
+import time
+import sqlite3
+import asyncio
+import collections
+import concurrent.futures
+import threading
+import redis
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def selector(label, value, bound=None):
+    """
+    Returns the Prometheus label selector for a value and optional bucket bound
+    """
+
+    pairs = []
+
+    if label is not None:
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{label}="{escaped}"')
+
+    if bound is not None:
+        pairs.append(f'le="{bound}"')
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Cache: # pylint: disable=too-many-instance-attributes
+    """
+    TTL and LRU cache for derivations. Set CACHE to one to have derive use it.
+    """
+
+    def __init__(self, ttl=60, size=1024, stale=0, clock=time.monotonic, tiers=None): # pylint: disable=too-many-arguments
+        """
+        Entries are fresh for ttl seconds, then served for stale more seconds
+        while refreshing in the background. At most size entries are kept.
+        Misses check tiers, like RedisCache, in order before loading, and
+        whatever's loaded is saved to all of them.
+        """
+
+        self.ttl = ttl
+        self.size = size
+        self.stale = stale
+        self.clock = clock
+        self.tiers = list(tiers or [])
+
+        self.entries = collections.OrderedDict()
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stales = 0
+        self.evictions = 0
+
+    def store(self, key, value, age=0):
+        """
+        Stores a copy of a value already age seconds old, evicting the least
+        recently used if full
+        """
+
+        with self.lock:
+
+            self.entries[key] = (copy.deepcopy(value), self.clock() - age)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def save(self, key, value):
+        """
+        Stores a freshly loaded value here and in every tier
+        """
+
+        self.store(key, value)
+
+        for tier in self.tiers:
+            tier.set(key, value)
+
+    def recall(self, key):
+        """
+        Returns the value and age from the first tier that has key, filling in
+        the tiers before it as of that age, or None if none do
+        """
+
+        for index, tier in enumerate(self.tiers):
+
+            recalled = tier.get(key)
+
+            if recalled is not None:
+                for missed in self.tiers[:index]:
+                    missed.set(key, *recalled)
+                return recalled
+
+        return None
+
+    def sync(self):
+        """
+        Drops whatever the tiers say was invalidated elsewhere
+        """
+
+        for tier in self.tiers:
+            for key in tier.invalidated():
+                with self.lock:
+                    if key is None:
+                        self.entries.clear()
+                    else:
+                        self.entries.pop(key, None)
+
+    def refresh(self, key, load):
+        """
+        Reloads a stale entry, keeping the stale value if the load fails
+        """
+
+        try:
+            self.save(key, load())
+        except Exception: # pylint: disable=broad-except
+            pass
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def serve(self, key, refresh):
+        """
+        Returns whether there's a fresh or stale entry for key and a copy of its
+        value, refreshing stale entries in the background. Call with the lock held.
+        """
+
+        entry = self.entries.get(key)
+
+        if entry is not None:
+
+            value, stored = entry
+            age = self.clock() - stored
+
+            if age <= self.ttl:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return True, copy.deepcopy(value)
+
+            if age <= self.ttl + self.stale:
+                self.stales += 1
+                self.entries.move_to_end(key)
+                if key not in self.refreshing:
+                    self.refreshing.add(key)
+                    threading.Thread(target=self.refresh, args=(key, refresh), daemon=True).start()
+                return True, copy.deepcopy(value)
+
+        return False, None
+
+    def fetch(self, key, load, refresh=None):
+        """
+        Returns a copy of the cached value for key, trying the tiers and then
+        calling load on a miss. Stale entries are reloaded in the background
+        with refresh, if different, since load may be bound to this caller.
+        """
+
+        refresh = refresh or load
+
+        self.sync()
+
+        with self.lock:
+            found, value = self.serve(key, refresh)
+
+        if found:
+            return value
+
+        recalled = self.recall(key)
+
+        if recalled is not None:
+
+            self.store(key, *recalled)
+
+            with self.lock:
+                found, value = self.serve(key, refresh)
+
+            if found:
+                return value
+
+        with self.lock:
+            self.misses += 1
+
+        value = load()
+        self.save(key, value)
+
+        return value
+
+    def invalidate(self, key=None):
+        """
+        Drops an entry, or everything if no key, here and in every tier
+        """
+
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+        for tier in self.tiers:
+            tier.delete(key)
+
+    def stats(self):
+        """
+        Returns the counters to see if the cache is paying off
+        """
+
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stales": self.stales,
+                "evictions": self.evictions
+            }
+
+
+class RedisCache: # pylint: disable=too-many-instance-attributes
+    """
+    Redis tier for Cache, shared across processes, that broadcasts
+    invalidations over pub/sub so every process drops them together
+    """
+
+    def __init__(self, client, ttl=300, prefix="klotio:derive:", channel="klotio:derive:invalidate", clock=time.time): # pylint: disable=too-many-arguments
+        """
+        Values are kept in client under prefix for ttl seconds, and
+        invalidations published and received on channel
+        """
+
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.channel = channel
+        self.clock = clock
+
+        self.pubsub = None
+        self.polling = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.corruptions = 0
+        self.invalidations = 0
+
+        self.subscribe()
+
+    @staticmethod
+    def encode(value, stored):
+        """
+        Serializes compactly with when it was stored
+        """
+
+        if orjson is not None:
+            return orjson.dumps([stored, value])
+
+        return json.dumps([stored, value], separators=(",", ":"))
+
+    @staticmethod
+    def decode(data):
+        """
+        Deserializes to the value and when it was stored
+        """
+
+        stored, value = orjson.loads(data) if orjson is not None else json.loads(data)
+
+        return value, stored
+
+    def subscribe(self):
+        """
+        Starts listening for invalidations, trying again later if Redis is down
+        """
+
+        try:
+            self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            self.pubsub.subscribe(self.channel)
+        except redis.exceptions.RedisError:
+            self.errors += 1
+            self.pubsub = None
+
+    def get(self, key):
+        """
+        Returns the value and age for key, or None if missing, unreadable or
+        Redis is down
+        """
+
+        try:
+            data = self.client.get(f"{self.prefix}{key}")
+        except redis.exceptions.RedisError:
+            self.errors += 1
+            return None
+
+        if data is None:
+            self.misses += 1
+            return None
+
+        try:
+            value, stored = self.decode(data)
+            age = max(self.clock() - stored, 0)
+        except (ValueError, TypeError):
+            self.corruptions += 1
+            return None
+
+        self.hits += 1
+
+        return value, age
+
+    def set(self, key, value, age=0):
+        """
+        Stores value for key as of age seconds ago, expiring once that's ttl
+        """
+
+        remaining = self.ttl - age
+
+        if remaining <= 0:
+            return
+
+        try:
+            self.client.set(f"{self.prefix}{key}", self.encode(value, self.clock() - age), px=int(remaining * 1000))
+        except redis.exceptions.RedisError:
+            self.errors += 1
+
+    def delete(self, key=None):
+        """
+        Deletes key, or everything under prefix if None, telling every process
+        """
+
+        try:
+
+            if key is None:
+                keys = list(self.client.scan_iter(match=f"{self.prefix}*"))
+                if keys:
+                    self.client.delete(*keys)
+            else:
+                self.client.delete(f"{self.prefix}{key}")
+
+            self.client.publish(self.channel, "*" if key is None else key)
+
+        except redis.exceptions.RedisError:
+            self.errors += 1
+
+    def invalidated(self):
+        """
+        Returns the keys invalidated since last asked, None for everything,
+        without waiting. Skips if another thread is already asking.
+        """
+
+        keys = []
+
+        if not self.polling.acquire(blocking=False):
+            return keys
+
+        try:
+
+            if self.pubsub is None:
+                self.subscribe()
+
+            while self.pubsub is not None:
+
+                message = self.pubsub.get_message()
+
+                if message is None:
+                    break
+
+                key = message["data"]
+
+                if isinstance(key, bytes):
+                    key = key.decode()
+
+                keys.append(None if key == "*" else key)
+                self.invalidations += 1
+
+        except redis.exceptions.RedisError:
+            self.errors += 1
+            self.pubsub = None
+        finally:
+            self.polling.release()
+
+        return keys
+
+    def stats(self):
+        """
+        Returns the counters to see if the tier is paying off
+        """
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "corruptions": self.corruptions,
+            "invalidations": self.invalidations
+        }
+
+
+class DiskCache: # pylint: disable=too-many-instance-attributes
+    """
+    SQLite tier for Cache that outlives the process, so a restarted one can
+    serve what's here right away. Give the Cache a stale window as long as
+    ttl here to have it serve these while refreshing in the background.
+    """
+
+    SCHEMA = "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored REAL NOT NULL)"
+
+    def __init__(self, directory=None, ttl=86400, name="derive.sqlite", timeout=5.0, clock=time.time): # pylint: disable=too-many-arguments
+        """
+        Values are kept in name under directory, DISK_CACHE_DIRECTORY by default,
+        for ttl seconds, waiting up to timeout seconds on other processes writing
+        """
+
+        self.directory = directory or os.environ.get("DISK_CACHE_DIRECTORY", "/opt/service/cache")
+        self.path = os.path.join(self.directory, name)
+        self.ttl = ttl
+        self.timeout = timeout
+        self.clock = clock
+
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.corruptions = 0
+
+        self.prune()
+
+    @staticmethod
+    def encode(value):
+        """
+        Serializes compactly
+        """
+
+        if orjson is not None:
+            return orjson.dumps(value).decode()
+
+        return json.dumps(value, separators=(",", ":"))
+
+    @staticmethod
+    def decode(data):
+        """
+        Deserializes
+        """
+
+        return orjson.loads(data) if orjson is not None else json.loads(data)
+
+    @staticmethod
+    def inode(path):
+        """
+        Returns which file is at path, None if there isn't one
+        """
+
+        try:
+            return os.stat(path).st_ino
+        except OSError:
+            return None
+
+    def connection(self):
+        """
+        Returns this thread's connection, reconnecting if the file was replaced
+        or removed, by recreate here or in another process
+        """
+
+        inode = self.inode(self.path)
+        connected = getattr(self.local, "connected", None)
+
+        if connected is not None and connected[0] == inode and inode is not None:
+            return connected[1]
+
+        if connected is not None:
+            connected[1].close()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        self.local.connected = (None, connection)
+
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(self.SCHEMA)
+
+        self.local.connected = (self.inode(self.path), connection)
+
+        return connection
+
+    def recreate(self):
+        """
+        Replaces a corrupt file with an empty one
+        """
+
+        with self.lock:
+
+            self.corruptions += 1
+
+            connected = getattr(self.local, "connected", None)
+
+            if connected is not None:
+                connected[1].close()
+                self.local.connected = None
+
+            for path in (self.path, f"{self.path}-wal", f"{self.path}-shm"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def execute(self, statement, parameters=()):
+        """
+        Runs a statement returning its rows, None if the database is busy or
+        unreadable, recreating the file and trying again once if it's corrupt
+        """
+
+        for attempt in range(2):
+
+            try:
+                return self.connection().execute(statement, parameters).fetchall()
+            except sqlite3.OperationalError:
+                self.errors += 1
+                return None
+            except sqlite3.DatabaseError:
+                if attempt:
+                    self.errors += 1
+                    return None
+                self.recreate()
+            except OSError:
+                self.errors += 1
+                return None
+
+        return None
+
+    def get(self, key):
+        """
+        Returns the value and age for key, or None if missing, expired or unreadable
+        """
+
+        rows = self.execute("SELECT value, stored FROM entries WHERE key = ?", (key,))
+
+        if not rows:
+            self.misses += 1
+            return None
+
+        data, stored = rows[0]
+        age = max(self.clock() - stored, 0)
+
+        if age > self.ttl:
+            self.misses += 1
+            return None
+
+        try:
+            value = self.decode(data)
+        except ValueError:
+            self.corruptions += 1
+            self.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+
+        self.hits += 1
+
+        return value, age
+
+    def set(self, key, value, age=0):
+        """
+        Stores value for key as of age seconds ago
+        """
+
+        self.execute(
+            "INSERT OR REPLACE INTO entries (key, value, stored) VALUES (?, ?, ?)",
+            (key, self.encode(value), self.clock() - age)
+        )
+
+    def delete(self, key=None):
+        """
+        Deletes key, or everything if None
+        """
+
+        if key is None:
+            self.execute("DELETE FROM entries")
+        else:
+            self.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def invalidated(self): # pylint: disable=no-self-use
+        """
+        Other processes delete from the same file, so nothing to hear about
+        """
+
+        return []
+
+    def prune(self):
+        """
+        Deletes everything past ttl
+        """
+
+        self.execute("DELETE FROM entries WHERE stored < ?", (self.clock() - self.ttl,))
+
+    def stats(self):
+        """
+        Returns the counters to see if the tier is paying off
+        """
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "corruptions": self.corruptions
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces identical calls in flight so concurrent callers share one.
+    Set FLIGHT to None to have derive stop coalescing.
+    """
+
+    def __init__(self):
+        """
+        Keep track of the calls in flight by key
+        """
+
+        self.calls = {}
+        self.tasks = {}
+        self.joined = {}
+        self.running = set()
+        self.lock = threading.Lock()
+
+        self.shared = 0
+
+    def run(self, key, future, call):
+        """
+        Makes the call in flight for key, settling its future, and returns how
+        many joined it
+        """
+
+        try:
+            future.set_result(call())
+        except BaseException as exception: # pylint: disable=broad-except
+            future.set_exception(exception)
+        finally:
+            with self.lock:
+                del self.calls[key]
+                joined = self.joined.pop(key, 0)
+
+        return joined
+
+    def do(self, key, call, timeout=None): # pylint: disable=invalid-name
+        """
+        Makes the call unless one for key is already in flight, in which case
+        waits for it. Every caller gets the result, their own copy, or the exception.
+        The leader copies too if anyone joined, so followers never see its changes.
+        With a timeout, waits no longer than that, leaving the call to finish in
+        the background for everyone else waiting on it.
+        """
+
+        with self.lock:
+
+            future = self.calls.get(key)
+            leader = future is None
+
+            if leader:
+                future = concurrent.futures.Future()
+                self.calls[key] = future
+            else:
+                self.shared += 1
+                self.joined[key] = self.joined.get(key, 0) + 1
+
+        if leader and timeout is None:
+            joined = self.run(key, future, call)
+            return copy.deepcopy(future.result()) if joined else future.result()
+
+        if leader:
+            threading.Thread(target=self.run, args=(key, future, call), daemon=True).start()
+
+        return copy.deepcopy(future.result(timeout))
+
+    async def async_run(self, flight, future, call):
+        """
+        Same as run but awaiting a coroutine call, cancelling the future if
+        the call's cancelled
+        """
+
+        try:
+            future.set_result(await call())
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exception: # pylint: disable=broad-except
+            future.set_exception(exception)
+        finally:
+            with self.lock:
+                del self.tasks[flight]
+                joined = self.joined.pop(flight, 0)
+
+        return joined
+
+    async def async_do(self, key, call, timeout=None):
+        """
+        Same as do but awaiting a coroutine call, shared within the running loop
+        """
+
+        loop = asyncio.get_running_loop()
+        flight = (id(loop), key)
+
+        with self.lock:
+
+            future = self.tasks.get(flight)
+            leader = future is None
+
+            if leader:
+                future = loop.create_future()
+                self.tasks[flight] = future
+            else:
+                self.shared += 1
+                self.joined[flight] = self.joined.get(flight, 0) + 1
+
+        if leader and timeout is None:
+            joined = await self.async_run(flight, future, call)
+            return copy.deepcopy(future.result()) if joined else future.result()
+
+        if leader:
+            task = loop.create_task(self.async_run(flight, future, call))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+        return copy.deepcopy(await asyncio.wait_for(asyncio.shield(future), timeout))
+
+def clone(value):
+    """
+    Copies parsed json, dicts and lists all the way down, several times
+    faster than deepcopy since there's nothing else to handle
+    """
+
+    if type(value) is dict: # pylint: disable=unidiomatic-typecheck
+        return {key: clone(item) for key, item in value.items()}
+
+    if type(value) is list: # pylint: disable=unidiomatic-typecheck
+        return [clone(item) for item in value]
+
+    return value
+
+
+class Validators:
+    """
+    ETag and Last-Modified of derivations with what they parsed to, so
+    lookups can ask if it changed and reuse it if not. Set VALIDATORS to
+    one to have lookup revalidate.
+    """
+
+    def __init__(self, size=1024):
+        """
+        At most size derivations are kept
+        """
+
+        self.size = size
+
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+        self.revalidations = 0
+        self.not_modified = 0
+
+    def headers(self, key):
+        """
+        Returns the conditional headers for a derivation, counting a
+        revalidation if there are any
+        """
+
+        with self.lock:
+
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return {}
+
+            self.revalidations += 1
+
+        etag, modified, _ = entry
+        headers = {}
+
+        if etag is not None:
+            headers["If-None-Match"] = etag
+
+        if modified is not None:
+            headers["If-Modified-Since"] = modified
+
+        return headers
+
+    def store(self, key, headers, value):
+        """
+        Keeps what a derivation parsed to if it came with validators, returning
+        a copy to hand out since callers update what they get in place
+        """
+
+        etag = headers.get("ETag")
+        modified = headers.get("Last-Modified")
+
+        if etag is None and modified is None:
+            return value
+
+        with self.lock:
+
+            self.entries[key] = (etag, modified, value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+        return clone(value)
+
+    def reuse(self, key):
+        """
+        Returns a copy of what a derivation last parsed to after a 304,
+        None if it's since been evicted
+        """
+
+        with self.lock:
+
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return None
+
+            self.not_modified += 1
+            self.entries.move_to_end(key)
+
+        return clone(entry[2])
+
+    def invalidate(self, key=None):
+        """
+        Drops a derivation, or everything if no key
+        """
+
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        """
+        Returns the counters to see how often revalidating pays off
+        """
+
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "revalidations": self.revalidations,
+                "not_modified": self.not_modified
+            }
+
+
+def derivation_key(derivation):
+    """
+    Normalizes a derivation to a string, by url or sorted node params
+    """
+
+    if "url" in derivation:
+        return f"url:{derivation['url']}"
+
+    return f"node:{json.dumps(derivation.get('node'), sort_keys=True)}"
+
+
+def derivation_target(derivation):
+    """
+    What a derivation calls, its url or the node api
+    """
+
+    return derivation["url"] if "url" in derivation else "http://api.klot-io/node"
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a lookup cut short to fit a deadline runs out of time, which
+    says nothing about its target
+    """
+
+
+
+class FailFast(Exception):
+    """
+    Raised instead of looking up a derivation whose target is down or that just failed
+    """
+
+
+class Breaker: # pylint: disable=too-many-instance-attributes
+    """
+    Circuit breaker per derivation target, with failures remembered briefly
+    per derivation. Set BREAKER to one to have derive fail fast.
+    """
+
+    STATES = ("closed", "half-open", "open")
+
+    def __init__(self, failures=5, reset=30, negative=5, clock=time.monotonic):
+        """
+        A target's circuit opens after failures in a row and stays open for
+        reset seconds, then lets one call through to see if it's back. A
+        derivation that failed fails fast for negative seconds.
+        """
+
+        self.failures = failures
+        self.reset = reset
+        self.negative = negative
+        self.clock = clock
+
+        self.circuits = {}
+        self.failed = {}
+        self.lock = threading.Lock()
+
+        self.negatives = 0
+
+    def circuit(self, target):
+        """
+        Returns a target's circuit, creating it closed. Call with the lock held.
+        """
+
+        circuit = self.circuits.get(target)
+
+        if circuit is None:
+            circuit = self.circuits[target] = {
+                "state": "closed",
+                "failures": 0,
+                "opened": None,
+                "probing": False,
+                "rejected": 0,
+                "opens": 0
+            }
+
+        return circuit
+
+    def before(self, derivation):
+        """
+        Raises FailFast if the derivation just failed or its target's circuit is
+        open, moving an open circuit to half-open once it's waited long enough
+        """
+
+        key = derivation_key(derivation)
+        target = derivation_target(derivation)
+        now = self.clock()
+
+        with self.lock:
+
+            failed = self.failed.get(key)
+
+            if failed is not None:
+                if failed[1] > now:
+                    self.negatives += 1
+                    raise FailFast(f"recently failed: {failed[0]}")
+                del self.failed[key]
+
+            circuit = self.circuit(target)
+
+            if circuit["state"] == "open" and now - circuit["opened"] >= self.reset:
+                circuit["state"] = "half-open"
+
+            if circuit["state"] == "open" or (circuit["state"] == "half-open" and circuit["probing"]):
+                circuit["rejected"] += 1
+                raise FailFast(f"circuit open for {target}")
+
+            if circuit["state"] == "half-open":
+                circuit["probing"] = True
+
+    def success(self, derivation):
+        """
+        Closes the derivation's target's circuit
+        """
+
+        with self.lock:
+
+            circuit = self.circuit(derivation_target(derivation))
+
+            circuit["state"] = "closed"
+            circuit["failures"] = 0
+            circuit["probing"] = False
+
+    def failure(self, derivation, exception):
+        """
+        Remembers the derivation failed, and counts it against the target unless
+        the target answered that the request itself was wrong, opening the
+        circuit after too many or if it was a half-open probe. Running out of
+        a caller's deadline is neither.
+        """
+
+        response = getattr(exception, "response", None)
+        status = getattr(response, "status_code", None)
+
+        with self.lock:
+
+            if isinstance(exception, DeadlineExceeded):
+                self.circuit(derivation_target(derivation))["probing"] = False
+                return
+
+            if self.negative:
+
+                now = self.clock()
+
+                if len(self.failed) >= 1024:
+                    self.failed = {key: failed for key, failed in self.failed.items() if failed[1] > now}
+
+                self.failed[derivation_key(derivation)] = (exception, now + self.negative)
+
+            circuit = self.circuit(derivation_target(derivation))
+            probe = circuit["probing"]
+            circuit["probing"] = False
+
+            if isinstance(status, int) and 400 <= status < 500:
+                if probe:
+                    circuit["state"] = "closed"
+                    circuit["failures"] = 0
+                return
+
+            circuit["failures"] += 1
+
+            if probe or circuit["failures"] >= self.failures:
+                if circuit["state"] != "open":
+                    circuit["opens"] += 1
+                circuit["state"] = "open"
+                circuit["opened"] = self.clock()
+
+    def call(self, derivation, call):
+        """
+        Makes the call for a derivation unless failing fast, recording how it went
+        """
+
+        self.before(derivation)
+
+        try:
+            result = call()
+        except Exception as exception:
+            self.failure(derivation, exception)
+            raise
+
+        self.success(derivation)
+
+        return result
+
+    def states(self):
+        """
+        Returns each target's circuit state
+        """
+
+        with self.lock:
+            return {target: circuit["state"] for target, circuit in self.circuits.items()}
+
+    def as_dict(self):
+        """
+        Returns each target's state, failures in a row, rejections and opens
+        """
+
+        with self.lock:
+            return {
+                target: {
+                    "state": circuit["state"],
+                    "failures": circuit["failures"],
+                    "rejected": circuit["rejected"],
+                    "opens": circuit["opens"]
+                }
+                for target, circuit in sorted(self.circuits.items())
+            }
+
+    def prometheus(self):
+        """
+        Returns the states, 0 closed, 1 half-open, 2 open, and counters in
+        Prometheus text format
+        """
+
+        circuits = self.as_dict()
+        lines = ["# TYPE klotio_breaker_state gauge"]
+
+        for target, circuit in circuits.items():
+            lines.append(f"klotio_breaker_state{selector('target', target)} {self.STATES.index(circuit['state'])}")
+
+        for counter, field in (("rejected", "rejected"), ("opened", "opens")):
+            lines.append(f"# TYPE klotio_breaker_{counter}_total counter")
+            for target, circuit in circuits.items():
+                lines.append(f"klotio_breaker_{counter}_total{selector('target', target)} {circuit[field]}")
+
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        """
+        Closes every circuit and forgets every failure
+        """
+
+        with self.lock:
+            self.circuits.clear()
+            self.failed.clear()
@@ -4,77 +4,1453 @@ Module for unittesting and mocking general klot-io functionality
 
 #pylint: disable=unused-argument,invalid-name
 
+import time
+import heapq
+import bisect
+import contextlib
+import fnmatch
+import reprlib
+import threading
+import datetime
 import unittest
+import functools
+import collections
 
-class MockRedis:
+import redis
+
+
+class MockClock:
+    """
+    Clock for MockRedis that only moves when told to
+    """
+
+    def __init__(self, now=0.0):
+        """
+        Start at whenever
+        """
+
+        self.now = now
+
+    def __call__(self):
+        """
+        Tells the time like time.time
+        """
+
+        return self.now
+
+    def advance(self, seconds):
+        """
+        Moves time forward
+        """
+
+        self.now += seconds
+
+
+def command(method):
+    """
+    Wraps a MockRedis command to expire whatever's due first, counting
+    a round trip unless it's part of a larger command or a pipeline
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+
+        local = self.local
+
+        with self.lock:
+
+            if not local.depth:
+                self.trip()
+
+            local.depth += 1
+
+            try:
+                self.expire_due()
+                return method(self, *args, **kwargs)
+            finally:
+                local.depth -= 1
+
+    return wrapper
+
+
+class MockDepth(threading.local): # pylint: disable=too-few-public-methods
+    """
+    How deep into MockRedis commands each thread is
+    """
+
+    depth = 0
+
+
+class MockRedis: # pylint: disable=too-many-instance-attributes,too-many-public-methods
+    """
+    Object for mocking Redis
+    """
+
+    WRONGTYPE = "WRONGTYPE Operation against a key holding the wrong kind of value"
+
+    def __init__(self, host, port, clock=None, threadsafe=False, **kwargs):
+        """
+        Keep track of the host/post, data with expirations, and
+        any messages sent or received. Expirations go by clock,
+        time.time unless a MockClock or the like. Every command
+        or pipeline execute counts as a round trip.
+
+        If threadsafe, commands lock the keyspace, publishing and
+        subscribing lock the subscribers, and round trips lock their
+        count, so each only waits on what it touches.
+        """
+
+        self.host = host
+        self.port = port
+        self.channel = None
+        self.clock = clock or time.time
+
+        self.data = {}
+        self.hashes = {}
+        self.lists = {}
+        self.sets = {}
+        self.zsets = {}
+
+        self.expires = {}
+        self.deadlines = []
+        self.versions = {}
+        self.scanned = {}
+        self.scanning = []
+        self.messages = []
+        self.subscribers = []
+
+        self.round_trips = 0
+        self.local = MockDepth()
+
+        self.threadsafe = threadsafe
+        self.lock = threading.RLock() if threadsafe else contextlib.nullcontext()
+        self.registry = threading.Lock() if threadsafe else contextlib.nullcontext()
+        self.tally = threading.Lock() if threadsafe else contextlib.nullcontext()
+
+    def __str__(self):
+        """
+        String representation for testing logging
+        """
+
+        return f"MockRedis<host={self.host},port={self.port}>"
+
+    @property
+    def depth(self):
+        """
+        How deep into commands this thread is, so only the outermost counts
+        """
+
+        return self.local.depth
+
+    @depth.setter
+    def depth(self, depth):
+        """
+        Sets how deep into commands this thread is
+        """
+
+        self.local.depth = depth
+
+    def trip(self):
+        """
+        Counts a round trip
+        """
+
+        with self.tally:
+            self.round_trips += 1
+
+    def stores(self):
+        """
+        Every store of keys, one per type
+        """
+
+        return (self.data, self.hashes, self.lists, self.sets, self.zsets)
+
+    def typed(self, key, store):
+        """
+        Returns the store after making sure key isn't held by another type
+        """
+
+        if key in store:
+            return store
+
+        for other in self.stores():
+            if other is not store and key in other:
+                raise redis.exceptions.ResponseError(self.WRONGTYPE)
+
+        return store
+
+    def changed(self, key):
+        """
+        Bumps a key's version so watches notice it changed
+        """
+
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def remove(self, key):
+        """
+        Removes a key of any type and its expiration, returning if it was there
+        """
+
+        removed = False
+
+        for store in self.stores():
+            if key in store:
+                del store[key]
+                removed = True
+
+        self.expires.pop(key, None)
+
+        if removed:
+            self.changed(key)
+
+        return removed
+
+    def emptied(self, key, store):
+        """
+        Marks a hash, list, set or sorted set as changed after removing from
+        it, removing it entirely once it's empty, like Redis
+        """
+
+        if key not in store:
+            return
+
+        if store[key]:
+            self.changed(key)
+        else:
+            self.remove(key)
+
+    def deadline(self, key, seconds):
+        """
+        Expires key after seconds, an int, float or timedelta
+        """
+
+        if isinstance(seconds, datetime.timedelta):
+            seconds = seconds.total_seconds()
+
+        self.expires[key] = self.clock() + seconds
+        self.changed(key)
+        heapq.heappush(self.deadlines, (self.expires[key], key))
+
+        # Compact once superseded deadlines outnumber the live ones
+
+        if len(self.deadlines) > 2 * len(self.expires) + 64:
+            self.deadlines = [
+                (deadline, key) for deadline, key in self.deadlines
+                if self.expires.get(key) == deadline
+            ]
+            heapq.heapify(self.deadlines)
+
+    def expire_due(self):
+        """
+        Removes keys whose deadline has passed, skipping deadlines since
+        changed or removed
+        """
+
+        now = self.clock()
+
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, key = heapq.heappop(self.deadlines)
+            if self.expires.get(key) == deadline:
+                self.remove(key)
+
+    # keys
+
+    @command
+    def delete(self, *names):
+        """
+        Deletes keys, returning how many there were
+        """
+
+        return sum(self.remove(name) for name in names)
+
+    @command
+    def exists(self, *names):
+        """
+        Returns how many of the keys exist
+        """
+
+        return sum(any(name in store for store in self.stores()) for name in names)
+
+    @command
+    def expire(self, name, time): # pylint: disable=redefined-outer-name
+        """
+        Expires a key after time seconds, returning whether it exists
+        """
+
+        if not any(name in store for store in self.stores()):
+            return False
+
+        self.deadline(name, time)
+
+        return True
+
+    @command
+    def persist(self, name):
+        """
+        Removes a key's expiration, returning whether it had one
+        """
+
+        if self.expires.get(name) is None:
+            return False
+
+        self.expires[name] = None
+        self.changed(name)
+
+        return True
+
+    @command
+    def ttl(self, name):
+        """
+        Seconds until a key expires, -1 if it doesn't, -2 if it doesn't exist
+        """
+
+        if not any(name in store for store in self.stores()):
+            return -2
+
+        if self.expires.get(name) is None:
+            return -1
+
+        return int((self.expires[name] - self.clock()) * 1000 + 500) // 1000
+
+    @command
+    def keys(self, pattern="*"):
+        """
+        Returns the keys matching a glob style pattern
+        """
+
+        return [key for store in self.stores() for key in store if fnmatch.fnmatchcase(str(key), pattern)]
+
+    def index(self):
+        """
+        Gives every key a place in the order scan goes through them, keeping
+        the places of those already there, and forgets the removed ones once
+        they outnumber the rest
+        """
+
+        keys = [key for store in self.stores() for key in store]
+
+        if len(self.scanned) > 2 * len(keys) + 64:
+            self.scanned = {key: self.scanned[key] for key in keys if key in self.scanned}
+            self.scanning = sorted((place, key) for key, place in self.scanned.items())
+
+        for key in keys:
+            if key not in self.scanned:
+                place = self.scanning[-1][0] + 1 if self.scanning else 0
+                self.scanned[key] = place
+                self.scanning.append((place, key))
+
+    @command
+    def scan(self, cursor=0, match=None, count=None):
+        """
+        Returns the next cursor, 0 when done, and a batch of keys matching.
+        Like Redis, keys there from the first call to the last are returned,
+        however many are added or removed along the way.
+        """
+
+        if not cursor:
+            self.index()
+
+        count = count or 10
+        position = bisect.bisect_left(self.scanning, (cursor,))
+        batch = []
+
+        while position < len(self.scanning) and count:
+
+            _, key = self.scanning[position]
+            position += 1
+
+            if any(key in store for store in self.stores()):
+                count -= 1
+                if match is None or fnmatch.fnmatchcase(str(key), match):
+                    batch.append(key)
+
+        return (self.scanning[position][0] if position < len(self.scanning) else 0, batch)
+
+    def scan_iter(self, match=None, count=None):
+        """
+        Iterates all the keys matching through scan
+        """
+
+        cursor = None
+
+        while cursor != 0:
+            cursor, batch = self.scan(cursor or 0, match, count)
+            yield from batch
+
+    @command
+    def flushdb(self):
+        """
+        Removes everything
+        """
+
+        for key in [key for store in self.stores() for key in store]:
+            self.remove(key)
+
+        self.expires.clear()
+        self.deadlines.clear()
+
+        return True
+
+    # strings
+
+    @command
+    def get(self, key):
+        """
+        Gets a value
+        """
+
+        return self.typed(key, self.data).get(key)
+
+    @command
+    def set(self, key, value, ex=None, px=None, nx=False, xx=False, keepttl=False): # pylint: disable=too-many-arguments
+        """
+        Sets a values with optional expiration
+        """
+
+        exists = any(key in store for store in self.stores())
+
+        if (nx and exists) or (xx and not exists):
+            return None
+
+        expires = self.expires.get(key) if keepttl else None
+
+        self.remove(key)
+        self.data[key] = value
+        self.expires[key] = expires
+        self.changed(key)
+
+        if ex is not None:
+            self.deadline(key, ex)
+        elif px is not None:
+            self.deadline(key, px / 1000 if not isinstance(px, datetime.timedelta) else px)
+
+        return True
+
+    @command
+    def mget(self, keys, *args):
+        """
+        Gets many values, None for those that aren't strings
+        """
+
+        return [self.data.get(key) for key in (list(keys) if isinstance(keys, (list, tuple)) else [keys]) + list(args)]
+
+    @command
+    def mset(self, mapping):
+        """
+        Sets many values
+        """
+
+        for key, value in mapping.items():
+            self.remove(key)
+            self.data[key] = value
+            self.expires[key] = None
+            self.changed(key)
+
+        return True
+
+    @command
+    def incrby(self, name, amount=1):
+        """
+        Increments an integer value, starting from 0
+        """
+
+        try:
+            value = int(self.typed(name, self.data).get(name, 0)) + amount
+        except (TypeError, ValueError):
+            raise redis.exceptions.ResponseError("value is not an integer or out of range")
+
+        self.data[name] = value
+        self.expires.setdefault(name, None)
+        self.changed(name)
+
+        return value
+
+    def incr(self, name, amount=1):
+        """
+        Increments an integer value
+        """
+
+        return self.incrby(name, amount)
+
+    def decrby(self, name, amount=1):
+        """
+        Decrements an integer value
+        """
+
+        return self.incrby(name, -amount)
+
+    def decr(self, name, amount=1):
+        """
+        Decrements an integer value
+        """
+
+        return self.incrby(name, -amount)
+
+    # hashes
+
+    @command
+    def hset(self, name, key=None, value=None, mapping=None):
+        """
+        Sets fields in a hash, returning how many were added
+        """
+
+        values = dict(mapping or {})
+
+        if key is not None:
+            values[key] = value
+
+        fields = self.typed(name, self.hashes).setdefault(name, {})
+        self.expires.setdefault(name, None)
+        self.changed(name)
+
+        added = sum(field not in fields for field in values)
+        fields.update(values)
+
+        return added
+
+    def hmset(self, name, mapping):
+        """
+        Sets fields in a hash
+        """
+
+        self.hset(name, mapping=mapping)
+
+        return True
+
+    @command
+    def hget(self, name, key):
+        """
+        Gets a field from a hash
+        """
+
+        return self.typed(name, self.hashes).get(name, {}).get(key)
+
+    @command
+    def hmget(self, name, keys, *args):
+        """
+        Gets many fields from a hash
+        """
+
+        fields = self.typed(name, self.hashes).get(name, {})
+
+        return [fields.get(key) for key in (list(keys) if isinstance(keys, (list, tuple)) else [keys]) + list(args)]
+
+    @command
+    def hgetall(self, name):
+        """
+        Gets all of a hash
+        """
+
+        return dict(self.typed(name, self.hashes).get(name, {}))
+
+    @command
+    def hdel(self, name, *keys):
+        """
+        Deletes fields from a hash, returning how many there were
+        """
+
+        fields = self.typed(name, self.hashes).get(name, {})
+        deleted = sum(fields.pop(key, self) is not self for key in keys)
+
+        self.emptied(name, self.hashes)
+
+        return deleted
+
+    @command
+    def hexists(self, name, key):
+        """
+        Whether a hash has a field
+        """
+
+        return key in self.typed(name, self.hashes).get(name, {})
+
+    @command
+    def hincrby(self, name, key, amount=1):
+        """
+        Increments a field in a hash
+        """
+
+        fields = self.typed(name, self.hashes).setdefault(name, {})
+        self.expires.setdefault(name, None)
+        self.changed(name)
+
+        try:
+            fields[key] = int(fields.get(key, 0)) + amount
+        except (TypeError, ValueError):
+            raise redis.exceptions.ResponseError("hash value is not an integer")
+
+        return fields[key]
+
+    @command
+    def hkeys(self, name):
+        """
+        The fields of a hash
+        """
+
+        return list(self.typed(name, self.hashes).get(name, {}).keys())
+
+    @command
+    def hvals(self, name):
+        """
+        The values of a hash
+        """
+
+        return list(self.typed(name, self.hashes).get(name, {}).values())
+
+    @command
+    def hlen(self, name):
+        """
+        How many fields a hash has
+        """
+
+        return len(self.typed(name, self.hashes).get(name, {}))
+
+    # lists
+
+    @command
+    def lpush(self, name, *values):
+        """
+        Pushes values onto the front of a list, returning its length
+        """
+
+        items = self.typed(name, self.lists).setdefault(name, collections.deque())
+        self.expires.setdefault(name, None)
+        self.changed(name)
+        items.extendleft(values)
+
+        return len(items)
+
+    @command
+    def rpush(self, name, *values):
+        """
+        Pushes values onto the end of a list, returning its length
+        """
+
+        items = self.typed(name, self.lists).setdefault(name, collections.deque())
+        self.expires.setdefault(name, None)
+        self.changed(name)
+        items.extend(values)
+
+        return len(items)
+
+    @command
+    def lpop(self, name):
+        """
+        Pops from the front of a list
+        """
+
+        items = self.typed(name, self.lists).get(name)
+
+        if not items:
+            return None
+
+        value = items.popleft()
+        self.emptied(name, self.lists)
+
+        return value
+
+    @command
+    def rpop(self, name):
+        """
+        Pops from the end of a list
+        """
+
+        items = self.typed(name, self.lists).get(name)
+
+        if not items:
+            return None
+
+        value = items.pop()
+        self.emptied(name, self.lists)
+
+        return value
+
+    @staticmethod
+    def span(length, start, end):
+        """
+        Turns Redis' inclusive, possibly negative start and end into a slice
+        """
+
+        start = max(start + length if start < 0 else start, 0)
+        end = end + length if end < 0 else end
+
+        return slice(start, min(end, length - 1) + 1) if start <= end else slice(0, 0)
+
+    @command
+    def lrange(self, name, start, end):
+        """
+        Returns a range of a list, inclusive of end
+        """
+
+        items = self.typed(name, self.lists).get(name, collections.deque())
+
+        return list(items)[self.span(len(items), start, end)]
+
+    @command
+    def lindex(self, name, index):
+        """
+        Returns the value at an index of a list
+        """
+
+        items = self.typed(name, self.lists).get(name, collections.deque())
+
+        try:
+            return items[index]
+        except IndexError:
+            return None
+
+    @command
+    def llen(self, name):
+        """
+        The length of a list
+        """
+
+        return len(self.typed(name, self.lists).get(name, ()))
+
+    @command
+    def ltrim(self, name, start, end):
+        """
+        Trims a list to a range, inclusive of end
+        """
+
+        items = self.typed(name, self.lists).get(name)
+
+        if items is not None:
+            self.lists[name] = collections.deque(list(items)[self.span(len(items), start, end)])
+            self.emptied(name, self.lists)
+
+        return True
+
+    # sets
+
+    @command
+    def sadd(self, name, *values):
+        """
+        Adds to a set, returning how many were new
+        """
+
+        members = self.typed(name, self.sets).setdefault(name, set())
+        self.expires.setdefault(name, None)
+        self.changed(name)
+
+        added = len(set(values) - members)
+        members.update(values)
+
+        return added
+
+    @command
+    def srem(self, name, *values):
+        """
+        Removes from a set, returning how many were there
+        """
+
+        members = self.typed(name, self.sets).get(name, set())
+
+        removed = len(members & set(values))
+        members.difference_update(values)
+        self.emptied(name, self.sets)
+
+        return removed
+
+    @command
+    def smembers(self, name):
+        """
+        The members of a set
+        """
+
+        return set(self.typed(name, self.sets).get(name, set()))
+
+    @command
+    def sismember(self, name, value):
+        """
+        Whether a value is in a set
+        """
+
+        return value in self.typed(name, self.sets).get(name, set())
+
+    @command
+    def scard(self, name):
+        """
+        How many members a set has
+        """
+
+        return len(self.typed(name, self.sets).get(name, set()))
+
+    # sorted sets
+
+    @command
+    def zadd(self, name, mapping, nx=False, xx=False, ch=False, incr=False): # pylint: disable=too-many-arguments
+        """
+        Adds members with scores to a sorted set, returning how many were
+        added, or changed if ch, or the new score if incr
+        """
+
+        zset = self.typed(name, self.zsets).setdefault(name, MockSortedSet())
+        self.expires.setdefault(name, None)
+        self.changed(name)
+
+        changed = 0
+
+        for member, score in mapping.items():
+
+            current = zset.scores.get(member)
+
+            if (nx and current is not None) or (xx and current is None):
+                continue
+
+            if incr:
+                score += current or 0
+
+            if current is None or (ch and current != score):
+                changed += 1
+
+            zset.add(member, score)
+
+            if incr:
+                return score
+
+        self.emptied(name, self.zsets)
+
+        return None if incr else changed
+
+    @command
+    def zincrby(self, name, amount, value):
+        """
+        Increments a member's score, returning the new score
+        """
+
+        zset = self.typed(name, self.zsets).setdefault(name, MockSortedSet())
+        self.expires.setdefault(name, None)
+        self.changed(name)
+
+        score = zset.scores.get(value, 0) + amount
+        zset.add(value, score)
+
+        return score
+
+    @command
+    def zrem(self, name, *values):
+        """
+        Removes members from a sorted set, returning how many there were
+        """
+
+        zset = self.typed(name, self.zsets).get(name, MockSortedSet())
+
+        removed = sum(zset.remove(value) for value in values)
+        self.emptied(name, self.zsets)
+
+        return removed
+
+    @command
+    def zscore(self, name, value):
+        """
+        A member's score
+        """
+
+        return self.typed(name, self.zsets).get(name, MockSortedSet()).scores.get(value)
+
+    @command
+    def zcard(self, name):
+        """
+        How many members a sorted set has
+        """
+
+        return len(self.typed(name, self.zsets).get(name, MockSortedSet()))
+
+    @command
+    def zrank(self, name, value):
+        """
+        A member's position by score, lowest first
+        """
+
+        zset = self.typed(name, self.zsets).get(name, MockSortedSet())
+
+        if value not in zset.scores:
+            return None
+
+        return bisect.bisect_left(zset.ordered, (zset.scores[value], value))
+
+    @command
+    def zrange(self, name, start, end, desc=False, withscores=False, score_cast_func=float): # pylint: disable=too-many-arguments
+        """
+        Returns a range of members by position, inclusive of end
+        """
+
+        ordered = self.typed(name, self.zsets).get(name, MockSortedSet()).ordered
+
+        if desc:
+            ordered = list(reversed(ordered))
+
+        selected = ordered[self.span(len(ordered), start, end)]
+
+        if withscores:
+            return [(member, score_cast_func(score)) for score, member in selected]
+
+        return [member for score, member in selected]
+
+    @command
+    def zrangebyscore(self, name, min, max, start=None, num=None, withscores=False, score_cast_func=float): # pylint: disable=redefined-builtin,too-many-arguments
+        """
+        Returns members with scores between min and max inclusive
+        """
+
+        ordered = self.typed(name, self.zsets).get(name, MockSortedSet()).ordered
+
+        low = bisect.bisect_left(ordered, (float(min),))
+        high = low
+
+        while high < len(ordered) and ordered[high][0] <= float(max):
+            high += 1
+
+        selected = ordered[low:high]
+
+        if start is not None and num is not None:
+            selected = selected[start:start + num]
+
+        if withscores:
+            return [(member, score_cast_func(score)) for score, member in selected]
+
+        return [member for score, member in selected]
+
+    # pipelines
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        """
+        Creates a pipeline, transactional by default
+        """
+
+        return MockPipeline(self, transaction)
+
+    # pub/sub
+
+    def publish(self, channel, message):
+        """
+        Publish a message on a channel, recording it and delivering it to
+        every subscriber listening, returning how many were
+        """
+
+        if not self.depth:
+            self.trip()
+
+        with self.registry:
+            self.channel = channel
+            self.messages.append(message)
+            subscribers = list(self.subscribers)
+
+        return sum(subscriber.deliver(channel, message) for subscriber in subscribers)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        """
+        Creates a subscriber with its own queue of messages
+        """
+
+        return MockPubSub(self, ignore_subscribe_messages)
+
+
+class MockPipeline:
+    """
+    Pipeline for MockRedis, queuing commands to run in one round trip
+    """
+
+    def __init__(self, redis, transaction=True): # pylint: disable=redefined-outer-name
+        """
+        Start with nothing queued or watched
+        """
+
+        self.redis = redis
+        self.transaction = transaction
+
+        self.commands = []
+        self.watching = {}
+        self.immediate = False
+        self.explicit = False
+
+    def __len__(self):
+        """
+        How many commands are queued
+        """
+
+        return len(self.commands)
+
+    def __enter__(self):
+        """
+        Use as a context manager
+        """
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Resets when done
+        """
+
+        self.reset()
+
+    def __getattr__(self, name):
+        """
+        Runs commands right away while watching, else queues them to run
+        on execute, returning the pipeline for chaining
+        """
+
+        method = getattr(self.redis, name)
+
+        if self.immediate:
+            return method
+
+        def queue(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+
+        return queue
+
+    def reset(self):
+        """
+        Drops anything queued or watched
+        """
+
+        self.commands = []
+        self.watching = {}
+        self.immediate = False
+        self.explicit = False
+
+    def watch(self, *names):
+        """
+        Watches keys so execute fails if they change, running commands
+        right away until multi
+        """
+
+        if self.explicit:
+            raise redis.exceptions.RedisError("Cannot issue a WATCH after a MULTI")
+
+        self.redis.trip()
+
+        with self.redis.lock:
+
+            self.redis.expire_due()
+
+            for name in names:
+                self.watching[name] = self.redis.versions.get(name, 0)
+
+        self.immediate = True
+
+        return True
+
+    def unwatch(self):
+        """
+        Stops watching keys
+        """
+
+        self.redis.trip()
+
+        self.watching = {}
+
+        return True
+
+    def multi(self):
+        """
+        Starts the transaction, queuing commands even after watching
+        """
+
+        if self.explicit:
+            raise redis.exceptions.RedisError("Cannot issue nested calls to MULTI")
+
+        if self.commands:
+            raise redis.exceptions.RedisError("Commands without an initial WATCH have already been issued")
+
+        self.explicit = True
+        self.immediate = False
+
+    def execute(self, raise_on_error=True):
+        """
+        Runs all the commands queued in one round trip, holding the keyspace
+        so nothing else runs in between, failing with WatchError if any
+        watched key changed, returning their results
+        """
+
+        commands = self.commands
+
+        self.redis.trip()
+
+        with self.redis.lock:
+            results = self.run(commands)
+
+        if raise_on_error:
+            for result in results:
+                if isinstance(result, redis.exceptions.ResponseError):
+                    raise result
+
+        return results
+
+    def run(self, commands):
+        """
+        Runs commands as part of execute, collecting errors as results
+        """
+
+        self.redis.depth += 1
+
+        try:
+
+            self.redis.expire_due()
+
+            if any(self.redis.versions.get(name, 0) != version for name, version in self.watching.items()):
+                raise redis.exceptions.WatchError("Watched variable changed.")
+
+            results = []
+
+            for method, args, kwargs in commands:
+                try:
+                    results.append(method(*args, **kwargs))
+                except redis.exceptions.ResponseError as exception:
+                    results.append(exception)
+
+        finally:
+
+            self.redis.depth -= 1
+            self.reset()
+
+        return results
+
+
+class MockPubSub:
     """
-    Object for mocking Redis
+    Subscriber for MockRedis, with its own queue of messages
     """
 
-    def __init__(self, host, port):
+    def __init__(self, redis, ignore_subscribe_messages=False): # pylint: disable=redefined-outer-name
         """
-        Keep track of the host/post, data with expirations, and
-        any messages sent or received.
+        Start subscribed to nothing
         """
 
-        self.host = host
-        self.port = port
-        self.channel = None
+        self.redis = redis
+        self.ignore_subscribe_messages = ignore_subscribe_messages
 
-        self.data = {}
-        self.expires = {}
-        self.messages = []
+        self.channels = set()
+        self.patterns = set()
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
 
-    def __str__(self):
+    @property
+    def subscribed(self):
         """
-        String representation for testing logging
+        Whether subscribed to any channels or patterns
         """
 
-        return f"MockRedis<host={self.host},port={self.port}>"
+        return bool(self.channels or self.patterns)
 
-    def get(self, key):
+    def register(self):
         """
-        Gets a value
+        Keeps MockRedis delivering to this subscriber only while subscribed
         """
 
-        return self.data.get(key)
+        with self.redis.registry:
+            if self.subscribed and self not in self.redis.subscribers:
+                self.redis.subscribers.append(self)
+            elif not self.subscribed and self in self.redis.subscribers:
+                self.redis.subscribers.remove(self)
 
-    def set(self, key, value, ex=None):
+    def confirm(self, kind, pattern, channel):
         """
-        Sets a values with optional expiration
+        Queues a (un)subscribe message like Redis sends back
         """
 
-        self.data[key] = value
-        self.expires[key] = ex
+        self.push({
+            "type": kind,
+            "pattern": pattern,
+            "channel": channel,
+            "data": len(self.channels) + len(self.patterns)
+        })
 
-    def publish(self, channel, message):
+    def push(self, message):
         """
-        Publish a message on a channel
+        Queues a message and wakes up anyone waiting for it
         """
 
-        self.channel = channel
-        self.messages.append(message)
+        with self.condition:
+            self.queue.append(message)
+            self.condition.notify()
 
-    def pubsub(self):
+    def deliver(self, channel, message):
         """
-        Mock creates a pubsub by returning itself
+        Queues a published message if subscribed to the channel or a matching
+        pattern, once per match like Redis, returning whether it did
         """
 
-        return self
+        delivered = False
+
+        with self.condition:
+
+            if channel in self.channels:
+                self.push({"type": "message", "pattern": None, "channel": channel, "data": message})
+                delivered = True
+
+            for pattern in sorted(self.patterns):
+                if fnmatch.fnmatchcase(channel, pattern):
+                    self.push({"type": "pmessage", "pattern": pattern, "channel": channel, "data": message})
+                    delivered = True
+
+        return delivered
+
+    def subscribe(self, *channels):
+        """
+        Subscribes to channels
+        """
+
+        with self.condition:
+            for channel in channels:
+                self.channels.add(channel)
+                self.confirm("subscribe", None, channel)
+
+        self.register()
+
+    def unsubscribe(self, *channels):
+        """
+        Unsubscribes from channels, all if none
+        """
+
+        with self.condition:
+            for channel in channels or sorted(self.channels):
+                self.channels.discard(channel)
+                self.confirm("unsubscribe", None, channel)
+
+        self.register()
+
+    def psubscribe(self, *patterns):
+        """
+        Subscribes to glob style patterns of channels
+        """
+
+        with self.condition:
+            for pattern in patterns:
+                self.patterns.add(pattern)
+                self.confirm("psubscribe", pattern, None)
+
+        self.register()
+
+    def punsubscribe(self, *patterns):
+        """
+        Unsubscribes from patterns, all if none
+        """
+
+        with self.condition:
+            for pattern in patterns or sorted(self.patterns):
+                self.patterns.discard(pattern)
+                self.confirm("punsubscribe", pattern, None)
+
+        self.register()
+
+    def pop(self, timeout):
+        """
+        Pops the next message of any type, waiting up to timeout seconds,
+        forever if None, returning None if none comes or no longer subscribed
+        """
+
+        with self.condition:
+
+            self.condition.wait_for(lambda: self.queue or not self.subscribed, timeout)
+
+            return self.queue.popleft() if self.queue else None
+
+    def ignored(self, message, ignore_subscribe_messages=False):
+        """
+        Whether a message is a (un)subscribe message being ignored
+        """
+
+        return (
+            (ignore_subscribe_messages or self.ignore_subscribe_messages) and
+            message["type"] not in ("message", "pmessage")
+        )
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        """
+        Gets the next message, waiting up to timeout seconds for one, or
+        forever if None, returning None if there isn't one in time
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+
+            message = self.pop(None if deadline is None else max(deadline - time.monotonic(), 0))
+
+            if message is None or not self.ignored(message, ignore_subscribe_messages):
+                return message
+
+    def listen(self):
+        """
+        Yields messages as they come while subscribed
+        """
+
+        while self.subscribed or self.queue:
+
+            message = self.pop(None)
+
+            if message is not None and not self.ignored(message):
+                yield message
+
+    def close(self):
+        """
+        Unsubscribes from everything and drops anything queued
+        """
+
+        with self.condition:
+
+            self.channels.clear()
+            self.patterns.clear()
+            self.queue.clear()
+
+            self.condition.notify_all()
+
+        self.register()
+
+
+class MockSortedSet:
+    """
+    Sorted set for MockRedis, scores by member and (score, member) kept in order
+    """
+
+    def __init__(self):
+        """
+        Start empty
+        """
+
+        self.scores = {}
+        self.ordered = []
+
+    def __len__(self):
+        """
+        How many members
+        """
+
+        return len(self.scores)
+
+    def add(self, member, score):
+        """
+        Adds or rescores a member
+        """
+
+        self.remove(member)
+
+        self.scores[member] = score
+        bisect.insort(self.ordered, (score, member))
+
+    def remove(self, member):
+        """
+        Removes a member, returning whether it was there
+        """
+
+        if member not in self.scores:
+            return False
+
+        score = self.scores.pop(member)
+        del self.ordered[bisect.bisect_left(self.ordered, (score, member))]
+
+        return True
+
+
+class IndexedList(list):
+    """
+    List that buckets its dict items by their scalar top level values, so
+    the candidates consistent with a member can be found without a scan.
+    Appends and extends index as they go, other changes reindex on next use.
+    Changing an item in place isn't noticed.
+    """
+
+    def __init__(self, items=()):
+        """
+        Index whatever it starts with
+        """
+
+        super().__init__(items)
+        self.reindex()
+
+    def reindex(self):
+        """
+        Indexes every item from scratch
+        """
+
+        self.buckets = {}
+        self.stale = False
+
+        for position, item in enumerate(self):
+            self.bucket(position, item)
+
+    def bucket(self, position, item):
+        """
+        Adds an item's position to the buckets for its scalar values
+        """
+
+        if isinstance(item, dict):
+            for key, value in item.items():
+                if TestCase.scalar(value):
+                    self.buckets.setdefault((key, value), []).append(position)
 
-    def subscribe(self, channel):
+    def append(self, item):
         """
-        Subscirbes to a channel as a pubsub
+        Appends and indexes
         """
 
-        self.channel = channel
+        super().append(item)
 
-    def get_message(self):
+        if not self.stale:
+            self.bucket(len(self) - 1, item)
+
+    def extend(self, items):
+        """
+        Extends and indexes
+        """
+
+        start = len(self)
+
+        super().extend(items)
+
+        if not self.stale:
+            for position in range(start, len(self)):
+                self.bucket(position, self[position])
+
+    def candidates(self, member):
         """
-        Gets a message as a pubsub
+        Returns the items that might be consistent with member, from its
+        narrowest bucket, or None if it has nothing to narrow by
         """
 
-        return self.messages.pop(0)
+        if not isinstance(member, dict):
+            return None
+
+        if self.stale:
+            self.reindex()
+
+        narrowest = None
+
+        for key, value in member.items():
+            if TestCase.scalar(value):
+                bucket = self.buckets.get((key, value), [])
+                if narrowest is None or len(bucket) < len(narrowest):
+                    narrowest = bucket
+
+        if narrowest is None:
+            return None
+
+        return [self[position] for position in narrowest]
+
+
+def changing(method):
+    """
+    Wraps a list method to mark an IndexedList stale after calling it
+    """
+
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.stale = True
+        return result
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+
+    return wrapper
+
+
+for changer in ["__setitem__", "__delitem__", "__iadd__", "__imul__", "insert", "pop", "remove", "clear", "sort", "reverse"]:
+    setattr(IndexedList, changer, changing(getattr(list, changer)))
 
 
 class MockLogger:
@@ -95,7 +1471,7 @@ class MockLogger:
         Clears the events. Good between tests
         """
 
-        self.events = []
+        self.events = IndexedList()
 
     @staticmethod
     def event(level, message, extra=None):
@@ -202,11 +1578,45 @@ class TestCase(unittest.TestCase):
 
     maxDiff = None
 
+    PATHS = 10
+
+    TRUNCATE = reprlib.Repr()
+    TRUNCATE.maxstring = 80
+    TRUNCATE.maxother = 80
+
+    SCALARS = (str, int, float, bool, type(None))
+
+    @classmethod
+    def scalar(cls, item):
+        """
+        Whether an item is a plain scalar that's equal to itself, so hashing finds what == would
+        """
+
+        return type(item) in cls.SCALARS and item == item # pylint: disable=unidiomatic-typecheck,comparison-with-itself
+
+    @classmethod
+    def positions(cls, items):
+        """
+        Indexes where each value is in a list of scalars, or None if not all scalars
+        """
+
+        positions = {}
+
+        for index, item in enumerate(items):
+
+            if not cls.scalar(item):
+                return None
+
+            positions.setdefault(item, []).append(index)
+
+        return positions
+
     def consistent(self, first, second):
         """
         A loose equals for checking only the parts of dictionares and lists you care about
         {"a": 1} is consistent with {"a": 1, "b": 2} while {"a": 2} is not
         [1,2] is consistent with [1,2,3] but [1,2,4] is not. Neither is [2,1]
+        Each item in a list is looked for from where the one before it matched.
         """
 
         if isinstance(first, dict) and isinstance(second, dict):
@@ -217,18 +1627,19 @@ class TestCase(unittest.TestCase):
 
         elif isinstance(first, list) and isinstance(second, list):
 
+            positions = self.positions(second) if first and all(self.scalar(item) for item in first) else None
+
+            if positions is not None:
+                return self.consistent_positions(first, positions)
+
             second_index = 0
 
             for first_item in first:
 
-                found = False
-
-                for second_index, second_item in enumerate(second[second_index:]):
-                    if self.consistent(first_item, second_item):
-                        found = True
+                for second_index in range(second_index, len(second)):
+                    if self.consistent(first_item, second[second_index]):
                         break
-
-                if not found:
+                else:
                     return False
 
         else:
@@ -237,32 +1648,148 @@ class TestCase(unittest.TestCase):
 
         return True
 
+    @staticmethod
+    def consistent_positions(first, positions):
+        """
+        Same as consistent for a list of scalars against the positions of another's
+        """
+
+        second_index = 0
+
+        for first_item in first:
+
+            indexes = positions.get(first_item)
+
+            if indexes is None:
+                return False
+
+            found = bisect.bisect_left(indexes, second_index)
+
+            if found == len(indexes):
+                return False
+
+            second_index = indexes[found]
+
+        return True
+
+    def inconsistencies(self, first, second, path="", every=False):
+        """
+        Walks like consistent but returns the paths to where first isn't
+        consistent with second, with truncated values, like
+        ("fields[3].integrate.node", "expected 'a' got 'b'"). Stops at the
+        first unless every.
+        """
+
+        found = []
+
+        if isinstance(first, dict) and isinstance(second, dict):
+
+            for first_key, first_item in first.items():
+
+                key_path = f"{path}.{first_key}" if path else str(first_key)
+
+                if first_key not in second:
+                    found.append((key_path, f"missing, expected {self.TRUNCATE.repr(first_item)}"))
+                else:
+                    found.extend(self.inconsistencies(first_item, second[first_key], key_path, every))
+
+                if found and not every:
+                    break
+
+        elif isinstance(first, list) and isinstance(second, list):
+
+            found.extend(self.list_inconsistencies(first, second, path, every))
+
+        elif first != second:
+
+            found.append((path, f"expected {self.TRUNCATE.repr(first)} got {self.TRUNCATE.repr(second)}"))
+
+        return found
+
+    def list_inconsistencies(self, first, second, path="", every=False):
+        """
+        Returns the paths to where the first item of list first without a
+        consistent item in order in list second isn't consistent with the
+        one in its place
+        """
+
+        start = 0
+
+        for first_index, first_item in enumerate(first):
+
+            for second_index in range(start, len(second)):
+                if self.consistent(first_item, second[second_index]):
+                    start = second_index
+                    break
+            else:
+                item_path = f"{path}[{first_index}]"
+                closest = first_index if first_index >= start else start
+                if closest < len(second):
+                    return self.inconsistencies(first_item, second[closest], item_path, every)
+                return [(item_path, f"missing, expected {self.TRUNCATE.repr(first_item)}")]
+
+        return []
+
+    def inconsistent(self, first, second, path="", every=False):
+        """
+        Describes where first isn't consistent with second, a line per path
+        """
+
+        found = self.inconsistencies(first, second, path, every)
+
+        lines = [f"  {found_path or '<top>'}: {description}" for found_path, description in found[:self.PATHS]]
+
+        if len(found) > self.PATHS:
+            lines.append(f"  ...and {len(found) - self.PATHS} more")
+
+        return "\n".join(lines)
+
     def contains(self, member, container):
         """
         Checks to see if members is conistent with an item within container
         """
 
-        for item in container:
+        candidates = container.candidates(member) if isinstance(container, IndexedList) else None
+
+        for item in container if candidates is None else candidates:
             if self.consistent(member, item):
                 return True
 
         return False
 
-    def assertConsistent(self, first, second, message=None):
+    def assertConsistent(self, first, second, message=None, path="", every=False): # pylint: disable=too-many-arguments
         """
-        Asserts first is consistent with second
+        Asserts first is consistent with second, failing with just the paths
+        to what's inconsistent rather than a diff of everything
         """
 
         if not self.consistent(first, second):
-            self.assertEqual(first, second, message)
+            self.fail(self._formatMessage(message, f"not consistent:\n{self.inconsistent(first, second, path, every)}"))
 
-    def assertContains(self, member, container, message=None):
+    def assertContains(self, member, container, message=None, every=False):
         """
-        Asserts member is contained within second
+        Asserts member is contained within second, failing with the paths
+        to what's inconsistent with the closest item
         """
 
         if not self.contains(member, container):
-            self.assertIn(member, container, message)
+
+            closest = min(
+                enumerate(container),
+                key=lambda indexed: len(self.inconsistencies(member, indexed[1], every=True)),
+                default=None
+            )
+
+            if closest is None:
+                standard = f"{self.TRUNCATE.repr(member)} not contained in empty container"
+            else:
+                index, item = closest
+                standard = (
+                    f"{self.TRUNCATE.repr(member)} not contained in {len(container)} items, closest [{index}]:\n"
+                    f"{self.inconsistent(member, item, f'[{index}]', every)}"
+                )
+
+            self.fail(self._formatMessage(message, standard))
 
     def assertLogged(self, logger, level, message, extra=None):
         """
@@ -322,7 +1849,7 @@ class TestCase(unittest.TestCase):
         """
 
         self.assertEqual(response.status_code, code, response.json)
-        self.assertConsistent(model, response.json[key])
+        self.assertConsistent(model, response.json[key], path=key)
 
     def assertStatusModels(self, response, code, key, models):
         """
@@ -334,4 +1861,4 @@ class TestCase(unittest.TestCase):
         self.assertEqual(response.status_code, code, response.json)
 
         for index, model in enumerate(models):
-            self.assertConsistent(model, response.json[key][index])
+            self.assertConsistent(model, response.json[key][index], path=f"{key}[{index}]")
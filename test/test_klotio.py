@@ -1,61 +1,1452 @@
+import io
+import os
+import atexit
+import sys
+import json
+import datetime
+import tempfile
 import unittest
 import unittest.mock
+import time
+import queue
+import threading
+import asyncio
+import concurrent.futures
 
 import yaml
+import requests
 
 import logging
+import pythonjsonlogger.jsonlogger
 import klotio
 
+class TestBudget(unittest.TestCase):
+
+    def setUp(self):
+
+        self.now = 100
+        self.budget = klotio.Budget(deadline=10, derives=2, depth=3, clock=lambda: self.now)
+
+    def test___init__(self):
+
+        budget = klotio.Budget()
+
+        self.assertIsNone(budget.expires)
+        self.assertIsNone(budget.derives)
+        self.assertIsNone(budget.depth)
+        self.assertEqual(budget.spent, 0)
+        self.assertFalse(budget.closed)
+
+        self.assertEqual(self.budget.expires, 110)
+
+    def test_remaining(self):
+
+        self.assertIsNone(klotio.Budget().remaining())
+        self.assertEqual(self.budget.remaining(), 10)
+
+        self.now = 120
+
+        self.assertEqual(self.budget.remaining(), 0)
+
+    def test_spend(self):
+
+        self.assertEqual(self.budget.spend(3), "depth limit of 3 reached")
+        self.assertIsNone(self.budget.spend(2))
+        self.assertIsNone(self.budget.spend(0))
+        self.assertEqual(self.budget.spend(0), "derive limit of 2 reached")
+        self.assertEqual(self.budget.spent, 2)
+
+        self.now = 110
+
+        self.assertEqual(self.budget.spend(0), "deadline exceeded")
+
+        self.now = 100
+        self.budget.closed = True
+
+        self.assertEqual(self.budget.spend(0), "deadline exceeded")
+
+    def test_settle(self):
+
+        integration = {}
+
+        self.assertTrue(self.budget.settle(integration, update={"name": "yep"}))
+        self.assertTrue(self.budget.settle(integration, error=Exception("whoops")))
+        self.assertEqual(integration, {"name": "yep", "errors": ["failed to integrate: whoops"]})
+
+        self.budget.closed = True
+
+        self.assertFalse(self.budget.settle(integration, update={"name": "nope"}))
+        self.assertEqual(integration["name"], "yep")
+
+    def test_close(self):
+
+        integration = {"errors": ["before"]}
+
+        self.budget.close([integration])
+
+        self.assertTrue(self.budget.closed)
+        self.assertEqual(integration, {"errors": ["before", "failed to integrate: deadline exceeded"]})
+
+
+class TestFiles(unittest.TestCase):
+
+    def setUp(self):
+
+        self.files = klotio.Files()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "settings.yaml")
+
+        with open(self.path, "w") as settings_file:
+            settings_file.write("unit: test")
+
+    def tearDown(self):
+
+        self.directory.cleanup()
+
+    def test___init__(self):
+
+        self.assertEqual(self.files.parsed, {})
+
+    def test_signature(self):
+
+        stat = os.stat(self.path)
+
+        self.assertEqual(klotio.Files.signature(self.path), (stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        self.assertIsNone(klotio.Files.signature(os.path.join(self.directory.name, "nope.yaml")))
+
+    @unittest.mock.patch("klotio.load_yaml")
+    def test_load(self, mock_load):
+
+        mock_load.side_effect = lambda stream: {"unit": stream.read()}
+
+        loaded = self.files.load(self.path)
+        self.assertEqual(loaded, {"unit": "unit: test"})
+
+        loaded["unit"] = "mutated"
+
+        self.assertEqual(self.files.load(self.path), {"unit": "unit: test"})
+        self.assertEqual(mock_load.call_count, 1)
+
+        self.files.load(self.path, reload=True)
+        self.assertEqual(mock_load.call_count, 2)
+
+        # symlink swap like a ConfigMap
+
+        swapped = os.path.join(self.directory.name, "swapped.yaml")
+
+        with open(swapped, "w") as swapped_file:
+            swapped_file.write("test: unit")
+
+        os.replace(swapped, self.path)
+
+        self.assertEqual(self.files.load(self.path), {"unit": "test: unit"})
+        self.assertEqual(mock_load.call_count, 3)
+
+    def test_clear(self):
+
+        self.files.load(self.path)
+
+        self.files.clear()
+
+        self.assertEqual(self.files.parsed, {})
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = klotio.Index(self.directory.name, klotio.Files())
+
+        self.write("unit", "test", {"integrate": {"url": "sure"}})
+        self.write("other", "test", {"integrate": {"url": "other"}})
+        self.write("unit", "nope", {"integrate": {"url": "nope"}})
+
+    def tearDown(self):
+
+        self.directory.cleanup()
+
+    def write(self, name, form, integration):
+
+        path = os.path.join(self.directory.name, f"integration_{name}_{form}.fields.yaml")
+
+        with open(path, "w") as integration_file:
+            yaml.safe_dump(integration, integration_file)
+
+        return path
+
+    def test___init__(self):
+
+        index = klotio.Index()
+
+        self.assertEqual(index.directory, "/opt/service/config")
+        self.assertIs(index.files, klotio.FILES)
+        self.assertEqual(index.forms, {})
+
+    @unittest.mock.patch("glob.glob")
+    def test_paths(self, mock_glob):
+
+        paths = [
+            os.path.join(self.directory.name, "integration_other_test.fields.yaml"),
+            os.path.join(self.directory.name, "integration_unit_test.fields.yaml")
+        ]
+
+        mock_glob.side_effect = lambda pattern: list(reversed(paths))
+
+        self.assertEqual(self.index.paths("test"), paths)
+        self.assertEqual(self.index.paths("test"), paths)
+        mock_glob.assert_called_once_with(f"{self.directory.name}/integration_*_test.fields.yaml")
+
+        # a new file changes the directory
+
+        mock_glob.side_effect = None
+        mock_glob.return_value = []
+
+        self.write("more", "test", {})
+        os.utime(self.directory.name, ns=(0, 0))
+
+        self.assertEqual(self.index.paths("test"), [])
+        self.assertEqual(mock_glob.call_count, 2)
+
+        # no directory is never cached
+
+        index = klotio.Index(os.path.join(self.directory.name, "nope"))
+
+        index.paths("test")
+        index.paths("test")
+
+        self.assertEqual(index.forms, {})
+        self.assertEqual(mock_glob.call_count, 4)
+
+    def test_templates(self):
+
+        templates = self.index.templates("test")
+
+        self.assertEqual(templates, [
+            {"name": "other", "integrate": {"url": "other"}},
+            {"name": "unit", "integrate": {"url": "sure"}}
+        ])
+
+        templates[0]["integrate"]["url"] = "mutated"
+
+        self.assertEqual(self.index.templates("test")[0], {"name": "other", "integrate": {"url": "other"}})
+
+        self.write("other", "test", {"integrate": {"url": "changed"}, "fields": []})
+
+        self.assertEqual(self.index.templates("test")[0], {"name": "other", "integrate": {"url": "changed"}, "fields": []})
+
+    def test_clear(self):
+
+        self.index.paths("test")
+
+        self.index.clear()
+
+        self.assertEqual(self.index.forms, {})
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+
+        self.hook = unittest.mock.MagicMock()
+        self.metrics = klotio.Metrics(self.hook)
+
+    def test___init__(self):
+
+        metrics = klotio.Metrics()
+
+        self.assertIsNone(metrics.hook)
+        self.assertEqual(metrics.labels, {})
+        self.assertEqual(metrics.series, {})
+
+    def test_record(self):
+
+        error = Exception("whoops")
+
+        self.metrics.record("derive", "target", "sure", 0.003)
+        self.metrics.record("derive", "target", "sure", 20, error)
+
+        self.assertEqual(self.metrics.labels, {"derive": "target"})
+        self.assertEqual(self.metrics.series, {
+            ("derive", "sure"): [2, 1, 20.003, [0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1]]
+        })
+
+        self.hook.assert_has_calls([
+            unittest.mock.call("derive", "sure", 0.003, None),
+            unittest.mock.call("derive", "sure", 20, error)
+        ])
+
+    def test_as_dict(self):
+
+        self.metrics.record("settings", None, None, 0.0001)
+        self.metrics.record("derive", "target", "sure", 0.3, Exception("whoops"))
+
+        exported = self.metrics.as_dict()
+
+        self.assertEqual(exported["derive"]["sure"]["count"], 1)
+        self.assertEqual(exported["derive"]["sure"]["errors"], 1)
+        self.assertEqual(exported["derive"]["sure"]["sum"], 0.3)
+        self.assertEqual(exported["derive"]["sure"]["buckets"][0.25], 0)
+        self.assertEqual(exported["derive"]["sure"]["buckets"][0.5], 1)
+        self.assertEqual(exported["derive"]["sure"]["buckets"][float("inf")], 1)
+        self.assertEqual(exported["settings"][None]["buckets"][0.0005], 1)
+
+    def test_selector(self):
+
+        self.assertEqual(klotio.Metrics.selector(None, None), "")
+        self.assertEqual(klotio.Metrics.selector(None, None, "+Inf"), '{le="+Inf"}')
+        self.assertEqual(klotio.Metrics.selector("target", 'a"b\\c\n'), '{target="a\\"b\\\\c\\n"}')
+        self.assertEqual(klotio.Metrics.selector("depth", 1, "0.5"), '{depth="1",le="0.5"}')
+
+    def test_prometheus(self):
+
+        self.metrics.record("integrate", "depth", 0, 0.0001)
+
+        self.assertEqual(self.metrics.prometheus().splitlines(), [
+            "# TYPE klotio_integrate_seconds histogram"
+        ] + [
+            f'klotio_integrate_seconds_bucket{{depth="0",le="{le}"}} 1' for le in klotio.Metrics.BUCKETS
+        ] + [
+            'klotio_integrate_seconds_bucket{depth="0",le="+Inf"} 1',
+            'klotio_integrate_seconds_sum{depth="0"} 0.0001',
+            'klotio_integrate_seconds_count{depth="0"} 1',
+            "# TYPE klotio_integrate_errors_total counter",
+            'klotio_integrate_errors_total{depth="0"} 0'
+        ])
+
+    def test_clear(self):
+
+        self.metrics.record("settings", None, None, 0.0001)
+
+        self.metrics.clear()
+
+        self.assertEqual(self.metrics.labels, {})
+        self.assertEqual(self.metrics.series, {})
+
+
+class TestQueuedListener(unittest.TestCase):
+
+    def test_enqueue_sentinel(self):
+
+        full = queue.Queue(1)
+        full.put("waiting")
+
+        listener = klotio.QueuedListener(full)
+
+        stopping = threading.Thread(target=listener.enqueue_sentinel)
+        stopping.start()
+        time.sleep(0.05)
+
+        self.assertTrue(stopping.is_alive())
+        self.assertEqual(full.get(), "waiting")
+
+        stopping.join(5)
+
+        self.assertFalse(stopping.is_alive())
+        self.assertIsNone(full.get_nowait())
+
+
+class TestQueuedHandler(unittest.TestCase):
+
+    def setUp(self):
+
+        self.stream = io.StringIO()
+        self.handler = logging.StreamHandler(self.stream)
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+
+    def record(self, message):
+
+        return logging.LogRecord("unit", logging.WARNING, __file__, 1, message, None, None)
+
+    def test___init__(self):
+
+        queued = klotio.QueuedHandler(self.handler, size=3, block=True, timeout=1)
+
+        self.assertEqual(queued.queue.maxsize, 3)
+        self.assertTrue(queued.block)
+        self.assertEqual(queued.timeout, 1)
+        self.assertEqual(queued.dropped, 0)
+        self.assertEqual(queued.listener.handlers, (self.handler,))
+        self.assertIsNotNone(queued.listener._thread)
+
+        queued.close()
+
+    def test_prepare(self):
+
+        queued = klotio.QueuedHandler(self.handler)
+
+        values = ["sure"]
+        record = logging.LogRecord("unit", logging.WARNING, __file__, 1, "%s", (values,), None)
+        prepared = queued.prepare(record)
+        values.append("changed")
+
+        self.assertIsNot(prepared, record)
+        self.assertEqual(prepared.message, "['sure']")
+        self.assertEqual(prepared.msg, "['sure']")
+        self.assertIsNone(prepared.args)
+        self.assertEqual(prepared.getMessage(), "['sure']")
+        self.assertEqual(record.args, (values,))
+
+        structured = {"event": "sure"}
+        record = logging.LogRecord("unit", logging.WARNING, __file__, 1, structured, None, None)
+        prepared = queued.prepare(record)
+        structured["event"] = "changed"
+
+        self.assertEqual(prepared.msg, {"event": "sure"})
+
+        queued.close()
+
+    def test_enqueue(self):
+
+        queued = klotio.QueuedHandler(self.handler, size=1)
+        queued.listener.stop()
+
+        queued.enqueue(self.record("first"))
+        queued.enqueue(self.record("second"))
+
+        self.assertEqual(queued.queue.qsize(), 1)
+        self.assertEqual(queued.dropped, 1)
+
+        queued.block = True
+        queued.timeout = 0.01
+
+        queued.enqueue(self.record("third"))
+        self.assertEqual(queued.dropped, 2)
+
+    def test_close(self):
+
+        queued = klotio.QueuedHandler(self.handler)
+
+        for index in range(100):
+            queued.handle(self.record(f"message {index}"))
+
+        queued.close()
+
+        self.assertEqual(self.stream.getvalue().splitlines(), [f"message {index}" for index in range(100)])
+        self.assertIsNone(queued.listener._thread)
+
+        queued.close()
+
+        # closing with a full queue waits for room and flushes it
+
+        release = threading.Event()
+        emitted = []
+
+        class Slow(logging.Handler):
+            def emit(self, record):
+                release.wait(5)
+                emitted.append(record.getMessage())
+
+        queued = klotio.QueuedHandler(Slow(), size=2)
+
+        queued.handle(self.record("taken"))
+
+        while queued.queue.qsize():
+            time.sleep(0.01)
+
+        queued.handle(self.record("first"))
+        queued.handle(self.record("second"))
+
+        self.assertTrue(queued.queue.full())
+
+        closing = threading.Thread(target=queued.close)
+        closing.start()
+        time.sleep(0.05)
+        release.set()
+        closing.join(5)
+
+        self.assertFalse(closing.is_alive())
+        self.assertEqual(emitted, ["taken", "first", "second"])
+        self.assertEqual(queued.dropped, 0)
+        self.assertIsNone(queued.listener._thread)
+
+
+class TestFastJsonFormatter(unittest.TestCase):
+
+    def setUp(self):
+
+        self.formatter = klotio.FastJsonFormatter()
+
+    def record(self, message, args=None, exc_info=None, extra=None):
+
+        return logging.getLogger("unit").makeRecord(
+            "unit", logging.ERROR, "test.py", 7, message, args, exc_info, func="test", extra=extra
+        )
+
+    def test___init__(self):
+
+        self.assertEqual(self.formatter.fields, [
+            "created", "asctime", "name", "levelname", "pathname", "funcName", "lineno", "message"
+        ])
+        self.assertTrue(self.formatter.asctime)
+        self.assertIn("pathname", self.formatter.skip)
+        self.assertIn("args", self.formatter.skip)
+
+        formatter = klotio.FastJsonFormatter(fmt="%(name)s %(pathname)s %(funcName)s %(lineno)d %(message)s", caller=False)
+
+        self.assertEqual(formatter.fields, ["name", "message"])
+        self.assertFalse(formatter.asctime)
+
+    def test_formatTime(self):
+
+        record = self.record("sure")
+        record.created = 1600000000.5
+        record.msecs = 500
+
+        self.formatter.converter = time.gmtime
+
+        with unittest.mock.patch("time.strftime", wraps=time.strftime) as mock_strftime:
+
+            self.assertEqual(self.formatter.formatTime(record, "%Y-%m-%d %H:%M:%S"), "2020-09-13 12:26:40")
+            self.assertEqual(self.formatter.formatTime(record, "%Y-%m-%d %H:%M:%S"), "2020-09-13 12:26:40")
+            mock_strftime.assert_called_once()
+
+            self.assertEqual(self.formatter.formatTime(record), "2020-09-13 12:26:40,500")
+
+            record.created = 1600000001.0
+            self.assertEqual(self.formatter.formatTime(record, "%Y-%m-%d %H:%M:%S"), "2020-09-13 12:26:41")
+            self.assertEqual(mock_strftime.call_count, 2)
+
+    def test_dumps(self):
+
+        log = {"a": 1, "when": datetime.date(2020, 1, 1), "big": 2 ** 70}
+
+        self.assertEqual(json.loads(klotio.FastJsonFormatter.dumps(log)), {"a": 1, "when": "2020-01-01", "big": 2 ** 70})
+
+        with unittest.mock.patch("klotio.orjson", None):
+            self.assertEqual(klotio.FastJsonFormatter.dumps(log), '{"a": 1, "when": "2020-01-01", "big": 1180591620717411303424}')
+
+    def test_format(self):
+
+        compatible = pythonjsonlogger.jsonlogger.JsonFormatter(fmt=klotio.LOG_FORMAT, datefmt=klotio.LOG_DATEFMT)
+
+        try:
+            raise Exception("whoops")
+        except Exception:
+            exc_info = sys.exc_info()
+
+        for record in [
+            self.record("hi %s", ("there",), exc_info, {"a": 1, "when": datetime.date(2020, 1, 1)}),
+            self.record({"msg": "dict"}),
+            self.record("plain")
+        ]:
+            fast = json.loads(self.formatter.format(record))
+            self.assertEqual(fast, json.loads(compatible.format(record)))
+            self.assertEqual(list(fast.keys()), list(json.loads(compatible.format(record)).keys()))
+
+        formatter = klotio.FastJsonFormatter(caller=False)
+
+        self.assertEqual(list(json.loads(formatter.format(self.record("plain"))).keys()), [
+            "created", "asctime", "name", "levelname", "message"
+        ])
+
+
+class TestRateLimitFilter(unittest.TestCase):
+
+    def setUp(self):
+
+        self.now = 0
+        self.handler = unittest.mock.MagicMock()
+        self.timer = unittest.mock.MagicMock()
+        self.limiter = klotio.RateLimitFilter(self.handler, rate=2, period=10, clock=lambda: self.now, timer=self.timer)
+
+    def record(self, message, name="unit", level=logging.WARNING):
+
+        return logging.LogRecord(name, level, __file__, 1, message, None, None, "test")
+
+    def test___init__(self):
+
+        limiter = klotio.RateLimitFilter(self.handler)
+
+        self.assertEqual(limiter.handler, self.handler)
+        self.assertEqual(limiter.rate, 0)
+        self.assertEqual(limiter.period, 1.0)
+        self.assertEqual(limiter.sample, 1.0)
+        self.assertEqual(limiter.timer, threading.Timer)
+        self.assertEqual(limiter.windows, {})
+        self.assertEqual(limiter.pending, [])
+        self.assertIsNone(limiter.scheduled)
+
+    @unittest.mock.patch("klotio.RateLimitFilter.SIZE", 1)
+    def test_prune(self):
+
+        self.limiter.windows = {
+            "expired": [0, 1, 0],
+            "suppressed": [0, 1, 1],
+            "current": [5, 1, 0]
+        }
+
+        self.now = 12
+        self.limiter.prune(self.now)
+
+        self.assertEqual(list(self.limiter.windows.keys()), ["suppressed", "current"])
+
+    def test_summarize(self):
+
+        record = self.record("hot %s")
+
+        self.limiter.summarize(record, 5)
+
+        summary = self.handler.handle.call_args[0][0]
+
+        self.assertEqual(summary.name, "unit")
+        self.assertEqual(summary.levelno, logging.WARNING)
+        self.assertEqual(summary.suppressed, 5)
+        self.assertEqual(summary.getMessage(), "5 similar messages suppressed: hot %s")
+        self.assertTrue(self.limiter.filter(summary))
+
+    def test_due(self):
+
+        hot = self.record("hot %s")
+        cold = self.record("cold %s")
+
+        for record in [hot] * 3 + [cold] * 3:
+            self.limiter.filter(record)
+
+        self.assertEqual(self.limiter.due(9), [])
+        self.assertEqual(self.limiter.due(10), [(hot, 1), (cold, 1)])
+        self.assertEqual(self.limiter.pending, [])
+        self.assertEqual(self.limiter.due(), [])
+
+        for record in [hot] * 3:
+            self.limiter.filter(record)
+
+        self.assertEqual(self.limiter.due(), [(hot, 3)])
+
+    def test_schedule(self):
+
+        self.limiter.schedule()
+
+        self.timer.assert_not_called()
+
+        self.limiter.pending = [(10, 0, None, None)]
+        self.now = 4
+        self.limiter.schedule()
+
+        self.timer.assert_called_once_with(6, self.limiter.flush)
+        self.assertTrue(self.timer.return_value.daemon)
+        self.timer.return_value.start.assert_called_once_with()
+        self.assertEqual(self.limiter.scheduled, (10, self.timer.return_value))
+
+        # already set for then or sooner
+
+        self.limiter.pending = [(12, 0, None, None)]
+        self.limiter.schedule()
+
+        self.assertEqual(self.timer.call_count, 1)
+
+        # sooner replaces it
+
+        self.limiter.pending = [(8, 0, None, None)]
+        self.limiter.schedule()
+
+        self.timer.return_value.cancel.assert_called_once_with()
+        self.timer.assert_called_with(4, self.limiter.flush)
+        self.assertEqual(self.limiter.scheduled, (8, self.timer.return_value))
+
+        # overdue goes right away
+
+        self.limiter.scheduled = None
+        self.now = 20
+        self.limiter.schedule()
+
+        self.timer.assert_called_with(0, self.limiter.flush)
+
+    def test_flush(self):
+
+        hot = self.record("hot %s")
+        cold = self.record("cold %s")
+
+        for record in [hot] * 3:
+            self.limiter.filter(record)
+
+        self.now = 5
+
+        for record in [cold] * 3:
+            self.limiter.filter(record)
+
+        self.timer.assert_called_once_with(10, self.limiter.flush)
+
+        # the hot loop's over though nothing's logged since
+
+        self.now = 10
+        self.limiter.flush()
+
+        self.assertEqual(
+            [call[0][0].getMessage() for call in self.handler.handle.call_args_list],
+            ["1 similar messages suppressed: hot %s"]
+        )
+        self.timer.assert_called_with(5, self.limiter.flush)
+        self.assertEqual(self.limiter.scheduled, (15, self.timer.return_value))
+
+        self.now = 15
+        self.limiter.flush()
+
+        self.assertEqual(self.handler.handle.call_args[0][0].getMessage(), "1 similar messages suppressed: cold %s")
+        self.assertIsNone(self.limiter.scheduled)
+        self.assertEqual(self.timer.call_count, 2)
+
+    def test_flush_timer(self):
+
+        limiter = klotio.RateLimitFilter(self.handler, rate=1, period=0.05)
+
+        for _ in range(3):
+            limiter.filter(self.record("hot %s"))
+
+        for _ in range(100):
+            if self.handler.handle.called:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(self.handler.handle.call_args[0][0].getMessage(), "2 similar messages suppressed: hot %s")
+        self.assertIsNone(limiter.scheduled)
+
+        limiter.close()
+
+    @unittest.mock.patch("atexit.unregister")
+    def test_close(self, mock_unregister):
+
+        for _ in range(5):
+            self.limiter.filter(self.record("hot %s"))
+
+        self.limiter.close()
+
+        mock_unregister.assert_called_once_with(self.limiter.close)
+        self.assertEqual(self.handler.handle.call_args[0][0].getMessage(), "3 similar messages suppressed: hot %s")
+        self.timer.return_value.cancel.assert_called_once_with()
+        self.assertIsNone(self.limiter.scheduled)
+
+        self.handler.handle.reset_mock()
+        self.limiter.close()
+
+        self.handler.handle.assert_not_called()
+
+    def test_filter(self):
+
+        self.assertTrue(self.limiter.filter(self.record("hot %s")))
+        self.assertTrue(self.limiter.filter(self.record("hot %s")))
+        self.assertFalse(self.limiter.filter(self.record("hot %s")))
+        self.assertFalse(self.limiter.filter(self.record("hot %s")))
+
+        # different level, logger, or template isn't limited
+
+        self.assertTrue(self.limiter.filter(self.record("hot %s", level=logging.ERROR)))
+        self.assertTrue(self.limiter.filter(self.record("hot %s", name="other")))
+        self.assertTrue(self.limiter.filter(self.record({"hot": True})))
+
+        self.handler.handle.assert_not_called()
+
+        # next period summarizes
+
+        self.now = 10
+
+        self.assertTrue(self.limiter.filter(self.record("hot %s")))
+        self.assertEqual(self.handler.handle.call_args[0][0].getMessage(), "2 similar messages suppressed: hot %s")
+
+        # once the hot loop stops, any later record summarizes it
+
+        self.handler.handle.reset_mock()
+
+        for _ in range(100):
+            self.limiter.filter(self.record("loop %s"))
+
+        self.now = 25
+
+        self.assertTrue(self.limiter.filter(self.record("something else")))
+        self.assertEqual(
+            [call[0][0].getMessage() for call in self.handler.handle.call_args_list],
+            ["98 similar messages suppressed: loop %s"]
+        )
+
+        # sampling
+
+        chances = iter([0.1, 0.9])
+        limiter = klotio.RateLimitFilter(self.handler, sample=0.5, chance=lambda: next(chances))
+
+        self.assertTrue(limiter.filter(self.record("hot %s")))
+        self.assertFalse(limiter.filter(self.record("hot %s")))
+
+
 class TestKlotIO(unittest.TestCase):
 
-    def test_logger(self):
+    def test_logger(self):
+
+        custom = klotio.logger("unit-test")
+        self.assertEqual(custom.name, "unit-test")
+
+        root = logging.getLogger()
+        self.assertEqual(root.name, "root")
+        self.assertEqual(root.level, logging.WARNING)
+        self.assertEqual(len(root.handlers), 1)
+        self.assertEqual(root.handlers[0].__class__.__name__, "StreamHandler")
+        self.assertEqual(root.handlers[0].formatter.__class__.__name__, "JsonFormatter")
+        self.assertEqual(root.handlers[0].formatter._fmt, "%(created)f %(asctime)s %(name)s %(levelname)s %(pathname)s %(funcName)s %(lineno)d %(message)s")
+        self.assertEqual(root.handlers[0].formatter.datefmt, "%Y-%m-%d %H:%M:%S %Z")
+
+        custom = klotio.logger("unit-test", queued=True, size=5, block=True)
+        self.assertEqual(custom.name, "unit-test")
+
+        self.assertEqual(len(root.handlers), 1)
+        queued = root.handlers[0]
+        self.assertIsInstance(queued, klotio.QueuedHandler)
+        self.assertEqual(queued.queue.maxsize, 5)
+        self.assertTrue(queued.block)
+        self.assertEqual(queued.listener.handlers[0].__class__.__name__, "StreamHandler")
+        self.assertEqual(queued.listener.handlers[0].formatter.__class__.__name__, "JsonFormatter")
+
+        klotio.logger("unit-test")
+        self.assertIsNone(queued.listener._thread)
+
+        klotio.logger("unit-test", fast=True, caller=False)
+        self.assertIsInstance(root.handlers[0].formatter, klotio.FastJsonFormatter)
+        self.assertNotIn("pathname", root.handlers[0].formatter.fields)
+        self.assertIsNone(logging._srcfile)
+
+        klotio.logger("unit-test", fast=True)
+        self.assertIn("pathname", root.handlers[0].formatter.fields)
+        self.assertEqual(logging._srcfile, klotio.LOG_SRCFILE)
+
+        self.assertEqual(root.handlers[0].filters, [])
+
+        with unittest.mock.patch.dict(os.environ, {"LOG_RATE": "5", "LOG_RATE_PERIOD": "2", "LOG_SAMPLE": "0.5"}):
+            klotio.logger("unit-test")
+
+        limiter = root.handlers[0].filters[0]
+        self.assertIsInstance(limiter, klotio.RateLimitFilter)
+        self.assertIs(limiter.handler, root.handlers[0])
+        self.assertEqual(limiter.rate, 5)
+        self.assertEqual(limiter.period, 2)
+        self.assertEqual(limiter.sample, 0.5)
+
+        with unittest.mock.patch("atexit.unregister") as mock_unregister:
+            klotio.logger("unit-test")
+
+        mock_unregister.assert_called_once_with(limiter.close)
+        atexit.unregister(limiter.close)
+
+    @unittest.mock.patch("klotio.METRICS", None)
+    def test_instrument(self):
+
+        hook = unittest.mock.MagicMock()
+
+        metrics = klotio.instrument(hook)
+
+        self.assertIs(klotio.METRICS, metrics)
+        self.assertIs(metrics.hook, hook)
+
+    @unittest.mock.patch("klotio.METRICS", None)
+    def test_instrumented(self):
+
+        @klotio.instrumented("unit", "test", lambda value, fail=False: value)
+        def function(value, fail=False):
+            """
+            Documented
+            """
+
+            if fail:
+                raise Exception("whoops")
+
+            return value
+
+        self.assertEqual(function.__doc__.strip(), "Documented")
+        self.assertEqual(function("sure"), "sure")
+
+        metrics = klotio.instrument()
+
+        self.assertEqual(function("sure"), "sure")
+        self.assertRaisesRegex(Exception, "whoops", function, "nope", fail=True)
+
+        exported = metrics.as_dict()["unit"]
+
+        self.assertEqual(exported["sure"]["count"], 1)
+        self.assertEqual(exported["sure"]["errors"], 0)
+        self.assertEqual(exported["nope"]["errors"], 1)
+
+    @unittest.mock.patch("klotio.METRICS", None)
+    @unittest.mock.patch("klotio.lookup")
+    def test_instrumented_paths(self, mock_lookup):
+
+        mock_lookup.side_effect = lambda derivation, timeout=None: {"fields": [{"integrate": {"node": {"a": 1}}}]} if "url" in derivation else {}
+
+        metrics = klotio.instrument()
+
+        klotio.integrate({"integrate": {"url": "sure"}})
+
+        exported = metrics.as_dict()
+
+        self.assertEqual(set(exported["derive"].keys()), {"sure", "http://api.klot-io/node"})
+        self.assertEqual(set(exported["integrate"].keys()), {0, 1})
+
+    def test_yaml_backend(self):
+
+        with unittest.mock.patch("klotio.YAML_LOADER", yaml.SafeLoader):
+            self.assertEqual(klotio.yaml_backend(), "python")
+
+        with unittest.mock.patch("klotio.YAML_LOADER", unittest.mock.MagicMock()):
+            self.assertEqual(klotio.yaml_backend(), "libyaml")
+
+    def test_load_yaml(self):
+
+        self.assertEqual(klotio.load_yaml("unit: test"), {"unit": "test"})
+
+        with unittest.mock.patch("klotio.YAML_LOADER", yaml.SafeLoader):
+            self.assertEqual(klotio.load_yaml("unit: test"), {"unit": "test"})
+
+        with self.assertRaises(yaml.YAMLError):
+            klotio.load_yaml("!!python/object:os.system ls")
+
+    @unittest.mock.patch("builtins.open", create=True)
+    def test_settings(self, mock_open):
+
+        mock_open.side_effect = [
+            unittest.mock.mock_open(read_data='unit: test').return_value
+        ]
+
+        self.assertEqual(klotio.settings(), {"unit": "test"})
+
+        mock_open.assert_called_once_with("/opt/service/config/settings.yaml", "r")
+
+        with unittest.mock.patch("klotio.FILES") as mock_files:
+
+            mock_files.load.return_value = {"unit": "test"}
+
+            self.assertEqual(klotio.settings(reload=True), {"unit": "test"})
+            mock_files.load.assert_called_once_with("/opt/service/config/settings.yaml", True)
+
+    @unittest.mock.patch("klotio.SESSION", None)
+    @unittest.mock.patch("klotio.SESSION_TWIN", None)
+    def test_session(self):
+
+        shared = klotio.session()
+
+        self.assertIsInstance(shared, requests.Session)
+        self.assertIs(klotio.session(), shared)
+
+        adapter = shared.get_adapter("http://api.klot-io/node")
+
+        self.assertEqual(adapter._pool_connections, 10)
+        self.assertEqual(adapter._pool_maxsize, 10)
+        self.assertEqual(adapter.max_retries.total, 3)
+        self.assertEqual(adapter.max_retries.backoff_factor, 0.1)
+        self.assertEqual(adapter.max_retries.status_forcelist, (502, 503, 504))
+        self.assertIn("OPTIONS", adapter.max_retries.method_whitelist)
+        self.assertIs(shared.get_adapter("https://api.klot-io/node"), adapter)
+        self.assertIn("gzip", shared.headers["Accept-Encoding"])
+
+        # bounded by a deadline its twin tries just once
+
+        bounded = klotio.session(retries=False)
+
+        self.assertIsNot(bounded, shared)
+        self.assertIs(klotio.session(retries=False), bounded)
+        self.assertEqual(klotio.SESSION_TWIN, (shared, bounded))
+
+        adapter = bounded.get_adapter("http://api.klot-io/node")
+
+        self.assertEqual(adapter._pool_maxsize, 10)
+        self.assertEqual(adapter.max_retries.total, 0)
+        self.assertIn("gzip", bounded.headers["Accept-Encoding"])
+
+        # a stand-in is used for both
+
+        with unittest.mock.patch("klotio.SESSION", "stand-in"):
+            self.assertEqual(klotio.session(), "stand-in")
+            self.assertEqual(klotio.session(retries=False), "stand-in")
+
+    def test_pooled(self):
+
+        pooled = klotio.pooled(2)
+
+        self.assertIsInstance(pooled, requests.Session)
+        self.assertEqual(pooled.get_adapter("http://api.klot-io/node").max_retries.total, 2)
+        self.assertIs(pooled.get_adapter("https://api.klot-io/node"), pooled.get_adapter("http://api.klot-io/node"))
+        self.assertIn("gzip", pooled.headers["Accept-Encoding"])
+
+    @unittest.mock.patch("klotio.SESSION")
+    def test_lookup(self, mock_session):
+
+        mock_options = mock_session.options
+        mock_options.return_value.json.return_value = "yep"
+
+        self.assertEqual(klotio.lookup({"url": "sure"}), "yep")
+        mock_options.assert_has_calls([
+            unittest.mock.call("sure", timeout=(3.05, 10)),
+            unittest.mock.call().raise_for_status(),
+            unittest.mock.call().json()
+        ])
+
+        self.assertEqual(klotio.lookup({"node": "sure"}), "yep")
+        mock_options.assert_has_calls([
+            unittest.mock.call("http://api.klot-io/node", params="sure", timeout=(3.05, 10)),
+            unittest.mock.call().raise_for_status(),
+            unittest.mock.call().json()
+        ])
+
+    @unittest.mock.patch("klotio.SESSION")
+    def test_lookup_timeout(self, mock_session):
+
+        mock_options = mock_session.options
+        mock_options.return_value.json.return_value = "yep"
+
+        self.assertEqual(klotio.lookup({"url": "sure"}, timeout=5), "yep")
+        mock_options.assert_called_once_with("sure", timeout=(3.05, 5))
+
+        with self.assertRaisesRegex(klotio.DeadlineExceeded, "deadline exceeded"):
+            klotio.lookup({"url": "sure"}, timeout=0)
+
+        self.assertEqual(mock_options.call_count, 1)
+
+        # timing out early is the deadline's doing, not the target's
+
+        mock_options.side_effect = requests.exceptions.ReadTimeout("slow")
+
+        with self.assertRaisesRegex(klotio.DeadlineExceeded, "deadline exceeded"):
+            klotio.lookup({"url": "sure"}, timeout=5)
+
+        with self.assertRaisesRegex(requests.exceptions.ReadTimeout, "slow"):
+            klotio.lookup({"url": "sure"}, timeout=20)
+
+        with self.assertRaisesRegex(requests.exceptions.ReadTimeout, "slow"):
+            klotio.lookup({"url": "sure"})
+
+        mock_options.side_effect = requests.exceptions.ConnectTimeout("down")
+
+        with self.assertRaisesRegex(klotio.DeadlineExceeded, "deadline exceeded"):
+            klotio.lookup({"url": "sure"}, timeout=1)
+
+        with self.assertRaisesRegex(requests.exceptions.ConnectTimeout, "down"):
+            klotio.lookup({"url": "sure"}, timeout=5)
+
+    @unittest.mock.patch("klotio.SESSION")
+    def test_integrate_session(self, mock_session):
+
+        mock_session.options.return_value.json.return_value = {"name": "master"}
+
+        # with a deadline, shared or not, it still goes through the stand-in
+
+        for flight in [klotio.SingleFlight(), None]:
+
+            with unittest.mock.patch("klotio.FLIGHT", flight):
+                self.assertEqual(klotio.integrate({"integrate": {"url": "sure"}}, deadline=5), {
+                    "integrate": {"url": "sure"},
+                    "name": "master"
+                })
+
+        self.assertEqual(mock_session.options.call_count, 2)
+        self.assertEqual(mock_session.options.call_args[0], ("sure",))
+        self.assertLessEqual(mock_session.options.call_args[1]["timeout"][1], 5)
+
+    @unittest.mock.patch("klotio.SESSION")
+    def test_lookup_validators(self, mock_session):
+
+        validators = klotio.Validators()
+
+        ok = unittest.mock.MagicMock(status_code=200, headers={"ETag": '"v1"', "Last-Modified": "then"})
+        ok.json.return_value = {"fields": [{"name": "a"}]}
+
+        not_modified = unittest.mock.MagicMock(status_code=304, headers={"ETag": '"v1"'})
+        not_modified.json.side_effect = Exception("parsed again")
+
+        mock_session.options.side_effect = [ok, not_modified]
+
+        with unittest.mock.patch("klotio.VALIDATORS", validators):
+
+            first = klotio.lookup({"url": "sure"})
+            first["fields"][0]["value"] = "mutated"
+
+            second = klotio.lookup({"url": "sure"})
+
+        self.assertEqual(second, {"fields": [{"name": "a"}]})
+        mock_session.options.assert_has_calls([
+            unittest.mock.call("sure", timeout=(3.05, 10)),
+            unittest.mock.call("sure", timeout=(3.05, 10), headers={
+                "If-None-Match": '"v1"',
+                "If-Modified-Since": "then"
+            })
+        ])
+        self.assertEqual(validators.stats(), {
+            "entries": 1,
+            "revalidations": 1,
+            "not_modified": 1
+        })
+
+        # evicted between asking and the 304 asks again unconditionally
+
+        ok.json.return_value = {"fields": []}
+        mock_session.options.side_effect = [not_modified, ok]
+        mock_session.options.reset_mock()
+
+        with unittest.mock.patch("klotio.VALIDATORS", validators):
+            with unittest.mock.patch.object(validators, "reuse", return_value=None):
+                self.assertEqual(klotio.lookup({"url": "sure"}), {"fields": []})
+
+        mock_session.options.assert_has_calls([
+            unittest.mock.call("sure", timeout=(3.05, 10), headers=unittest.mock.ANY),
+            unittest.mock.call("sure", timeout=(3.05, 10))
+        ])
+
+    @unittest.mock.patch("klotio.lookup")
+    def test_guard(self, mock_lookup):
+
+        mock_lookup.return_value = "yep"
+
+        self.assertEqual(klotio.guard({"url": "sure"}), "yep")
+
+        breaker = klotio.Breaker(failures=1)
+        mock_lookup.side_effect = Exception("whoops")
+
+        with unittest.mock.patch("klotio.BREAKER", breaker):
+
+            with self.assertRaisesRegex(Exception, "whoops"):
+                klotio.guard({"node": {"name": "a"}})
+
+            with self.assertRaisesRegex(klotio.FailFast, "circuit open for http://api.klot-io/node"):
+                klotio.guard({"node": {"name": "b"}})
+
+        self.assertEqual(mock_lookup.call_count, 2)
+
+        integration = {"integrate": {"node": {"name": "a"}}}
+
+        with unittest.mock.patch("klotio.BREAKER", breaker):
+            klotio.derived(integration)
+
+        self.assertEqual(integration["errors"], ["failed to integrate: recently failed: whoops"])
+        self.assertEqual(mock_lookup.call_count, 2)
+
+    @unittest.mock.patch("klotio.lookup")
+    def test_coalesce(self, mock_lookup):
+
+        mock_lookup.return_value = "yep"
+
+        self.assertEqual(klotio.coalesce({"url": "sure"}), "yep")
+        mock_lookup.assert_called_once_with({"url": "sure"}, timeout=None)
+
+        with unittest.mock.patch("klotio.FLIGHT") as mock_flight:
+
+            mock_flight.do.return_value = "shared"
+
+            self.assertEqual(klotio.coalesce({"url": "sure"}), "shared")
+            mock_flight.do.assert_called_once_with("url:sure", unittest.mock.ANY, None)
 
-        custom = klotio.logger("unit-test")
-        self.assertEqual(custom.name, "unit-test")
+            mock_flight.do.side_effect = concurrent.futures.TimeoutError()
 
-        root = logging.getLogger()
-        self.assertEqual(root.name, "root")
-        self.assertEqual(root.level, logging.WARNING)
-        self.assertEqual(len(root.handlers), 1)
-        self.assertEqual(root.handlers[0].__class__.__name__, "StreamHandler")
-        self.assertEqual(root.handlers[0].formatter.__class__.__name__, "JsonFormatter")
-        self.assertEqual(root.handlers[0].formatter._fmt, "%(created)f %(asctime)s %(name)s %(levelname)s %(pathname)s %(funcName)s %(lineno)d %(message)s")
-        self.assertEqual(root.handlers[0].formatter.datefmt, "%Y-%m-%d %H:%M:%S %Z")
+            with self.assertRaisesRegex(klotio.DeadlineExceeded, "deadline exceeded"):
+                klotio.coalesce({"url": "sure"}, 5)
 
-    @unittest.mock.patch("builtins.open", create=True)
-    def test_settings(self, mock_open):
+            # the shared lookup isn't bound by the caller's deadline
 
-        mock_open.side_effect = [
-            unittest.mock.mock_open(read_data='unit: test').return_value
-        ]
+            mock_flight.do.assert_called_with("url:sure", unittest.mock.ANY, 5)
+            mock_flight.do.call_args[0][1]()
+            mock_lookup.assert_called_with({"url": "sure"}, timeout=None)
 
-        self.assertEqual(klotio.settings(), {"unit": "test"})
+        with unittest.mock.patch("klotio.FLIGHT", None):
 
-        mock_open.assert_called_once_with("/opt/service/config/settings.yaml", "r")
+            self.assertEqual(klotio.coalesce({"url": "sure"}), "yep")
+            self.assertEqual(klotio.coalesce({"url": "sure"}, 5), "yep")
+            mock_lookup.assert_called_with({"url": "sure"}, timeout=5)
+            self.assertEqual(mock_lookup.call_count, 4)
 
-    @unittest.mock.patch("requests.options")
-    def test_derive(self, mock_options):
+        # a caller with a deadline doesn't cut short one without that joins it
 
-        mock_options.return_value.json.return_value = "yep"
+        def slow(derivation, timeout=None):
+            time.sleep(0.3)
+            return {"name": "slow"}
 
-        self.assertEqual(klotio.derive({"url": "sure"}), "yep")
-        mock_options.assert_has_calls([
-            unittest.mock.call("sure"),
-            unittest.mock.call().raise_for_status(),
-            unittest.mock.call().json()
-        ])
+        mock_lookup.side_effect = slow
 
-        self.assertEqual(klotio.derive({"node": "sure"}), "yep")
-        mock_options.assert_has_calls([
-            unittest.mock.call("http://api.klot-io/node", params="sure"),
-            unittest.mock.call().raise_for_status(),
-            unittest.mock.call().json()
+        with unittest.mock.patch("klotio.FLIGHT", klotio.SingleFlight()):
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+
+                bounded = pool.submit(klotio.coalesce, {"url": "slow"}, 0.1)
+                time.sleep(0.02)
+                unbounded = pool.submit(klotio.coalesce, {"url": "slow"})
+
+                self.assertRaisesRegex(klotio.DeadlineExceeded, "deadline exceeded", bounded.result)
+                self.assertEqual(unbounded.result(), {"name": "slow"})
+
+        mock_lookup.assert_called_with({"url": "slow"}, timeout=None)
+        self.assertEqual(mock_lookup.call_count, 5)
+
+    @unittest.mock.patch("klotio.lookup")
+    def test_derive(self, mock_lookup):
+
+        mock_lookup.return_value = {"name": "master"}
+
+        self.assertEqual(klotio.derive({"url": "sure"}), {"name": "master"})
+        self.assertEqual(klotio.derive({"url": "sure"}), {"name": "master"})
+        self.assertEqual(mock_lookup.call_count, 2)
+
+        with unittest.mock.patch("klotio.CACHE", klotio.Cache()):
+
+            self.assertEqual(klotio.derive({"url": "sure"}), {"name": "master"})
+            self.assertEqual(klotio.derive({"url": "sure"}), {"name": "master"})
+            mock_lookup.assert_called_with({"url": "sure"}, timeout=None)
+            self.assertEqual(mock_lookup.call_count, 3)
+
+            self.assertEqual(klotio.CACHE.stats()["hits"], 1)
+
+        # stale entries refresh without the deadline of whoever found them
+
+        with unittest.mock.patch("klotio.CACHE", klotio.Cache(ttl=0, stale=60)):
+            with unittest.mock.patch("klotio.FLIGHT", None):
+
+                self.assertEqual(klotio.derive({"url": "sure"}, 5), {"name": "master"})
+                mock_lookup.assert_called_with({"url": "sure"}, timeout=5)
+
+                time.sleep(0.01)
+
+                self.assertEqual(klotio.derive({"url": "sure"}, 5), {"name": "master"})
+
+                while klotio.CACHE.refreshing:
+                    time.sleep(0.01)
+
+                mock_lookup.assert_called_with({"url": "sure"}, timeout=None)
+                self.assertEqual(mock_lookup.call_count, 5)
+
+    @unittest.mock.patch("klotio.derive")
+    def test_derived(self, mock_derive):
+
+        mock_derive.return_value = {"name": "master"}
+
+        self.assertEqual(klotio.derived({"integrate": {"node": "yep"}}), {
+            "integrate": {"node": "yep"},
+            "name": "master"
+        })
+
+        mock_derive.side_effect = Exception("whoops")
+
+        self.assertEqual(klotio.derived({"integrate": {"url": "nope"}, "errors": ["before"]}), {
+            "integrate": {"url": "nope"},
+            "errors": ["before", "failed to integrate: whoops"]
+        })
+
+        self.assertEqual(klotio.derived({"name": "plain"}), {"name": "plain"})
+
+        # refused for cycles and the budget, dropped once closed
+
+        mock_derive.side_effect = None
+
+        self.assertEqual(klotio.derived({"integrate": {"url": "sure"}}, ancestors=("url:sure",)), {
+            "integrate": {"url": "sure"},
+            "errors": ["failed to integrate: cycle through url:sure"]
+        })
+
+        self.assertEqual(klotio.derived({"integrate": {"url": "sure"}}, klotio.Budget(depth=1), 1), {
+            "integrate": {"url": "sure"},
+            "errors": ["failed to integrate: depth limit of 1 reached"]
+        })
+
+        budget = klotio.Budget()
+        budget.closed = True
+
+        self.assertEqual(klotio.derived({"integrate": {"url": "sure"}}, budget), {"integrate": {"url": "sure"}})
+
+    @unittest.mock.patch("klotio.derive")
+    def test_fan_out(self, mock_derive):
+
+        def derive(derivation, timeout=None):
+
+            if derivation == {"url": "sure"}:
+                return {"fields": [{"integrate": {"node": "yep"}}, {"name": "plain"}]}
+
+            if derivation == {"node": "yep"}:
+                return {"name": "master"}
+
+            raise Exception("whoops")
+
+        mock_derive.side_effect = derive
+
+        integrations = [
+            {"integrate": {"url": "sure"}},
+            {"fields": [{"integrate": {"url": "nope"}}]}
+        ]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+            klotio.fan_out(pool, integrations)
+
+        self.assertEqual(integrations, [
+            {
+                "integrate": {"url": "sure"},
+                "fields": [
+                    {"integrate": {"node": "yep"}, "name": "master"},
+                    {"name": "plain"}
+                ]
+            },
+            {
+                "fields": [
+                    {"integrate": {"url": "nope"}, "errors": ["failed to integrate: whoops"]}
+                ]
+            }
         ])
 
-    @unittest.mock.patch("requests.options")
-    def test_integrate(self, mock_options):
+        self.assertEqual(mock_derive.call_count, 3)
+
+    def test_lineage(self):
+
+        self.assertEqual(klotio.lineage({"name": "plain"}, ("url:a",)), ("url:a",))
+        self.assertEqual(klotio.lineage({"integrate": {"url": "b"}}, ("url:a",)), ("url:a", "url:b"))
+
+    def test_refusal(self):
+
+        budget = klotio.Budget(derives=1)
+
+        self.assertEqual(klotio.refusal({"integrate": {"url": "a"}}, budget, 0, ("url:a",)), "cycle through url:a")
+        self.assertIsNone(klotio.refusal({"integrate": {"url": "a"}}, budget, 0, ()))
+        self.assertEqual(klotio.refusal({"integrate": {"url": "a"}}, budget, 0, ()), "derive limit of 1 reached")
+
+    def test_integrating(self):
+
+        budgets = []
+
+        @klotio.integrating
+        def function(value, budget=None):
+            budgets.append(budget)
+            return value
+
+        self.assertEqual(function("yep", deadline=5, max_derives=2, max_depth=3), "yep")
+        self.assertEqual(budgets[0].derives, 2)
+        self.assertEqual(budgets[0].depth, 3)
+        self.assertIsNotNone(budgets[0].expires)
+
+        function("yep", budget=budgets[0])
+
+        self.assertIs(budgets[1], budgets[0])
+
+    @unittest.mock.patch("klotio.derive")
+    def test_integrate_budget(self, mock_derive):
+
+        def derive(derivation, timeout=None):
+
+            if derivation == {"url": "loop"}:
+                return {"fields": [{"integrate": {"url": "loop"}}]}
+
+            if derivation == {"url": "slow"}:
+                if timeout is not None and timeout < 0.5:
+                    time.sleep(timeout)
+                    raise klotio.DeadlineExceeded("deadline exceeded")
+                time.sleep(0.5)
+                return {"name": "slow"}
+
+            depth = int(derivation["url"])
+
+            return {"fields": [{"integrate": {"url": str(depth + 1)}}, {"integrate": {"url": str(depth + 1)}}]}
+
+        mock_derive.side_effect = derive
+
+        def errors(integration):
+            found = list(integration.get("errors", []))
+            for field in integration.get("fields", []):
+                found.extend(errors(field))
+            return found
+
+        for run in [
+            lambda integration, **budget: klotio.integrate(integration, **budget),
+            lambda integration, **budget: klotio.integrate(integration, concurrency=2, **budget),
+            lambda integration, **budget: asyncio.run(klotio.async_integrate(integration, concurrency=2, **budget))
+        ]:
+
+            # cycles stop at the repeat
+
+            looped = run({"integrate": {"url": "loop"}})
+
+            self.assertEqual(looped, {
+                "integrate": {"url": "loop"},
+                "fields": [{
+                    "integrate": {"url": "loop"},
+                    "errors": ["failed to integrate: cycle through url:loop"]
+                }]
+            })
+
+            # depth leaves deeper fields underived
+
+            deep = run({"integrate": {"url": "0"}}, max_depth=2)
+
+            self.assertEqual(deep["fields"][0]["fields"][0], {
+                "integrate": {"url": "2"},
+                "errors": ["failed to integrate: depth limit of 2 reached"]
+            })
+            self.assertEqual(errors(deep), ["failed to integrate: depth limit of 2 reached"] * 4)
+
+            # derives stops after so many
+
+            limited = run({"integrate": {"url": "0"}}, max_derives=3)
+
+            self.assertEqual(len(errors(limited)), 4)
+            self.assertEqual(set(errors(limited)), {"failed to integrate: derive limit of 3 reached"})
+
+        # sequentially each derive gets what's left of the deadline
+
+        start = time.monotonic()
+        timed = klotio.integrate({"fields": [{"integrate": {"url": "slow"}}, {"integrate": {"url": "slow"}}]}, deadline=0.1)
+
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual(timed, {"fields": [
+            {"integrate": {"url": "slow"}, "errors": ["failed to integrate: deadline exceeded"]},
+            {"integrate": {"url": "slow"}, "errors": ["failed to integrate: deadline exceeded"]}
+        ]})
+        self.assertLessEqual(mock_derive.call_args[0][1], 0.1)
+
+        # concurrently it returns in time, leaving the slow ones with an error
+        # and dropping their results when they do come back
+
+        def timing(integration, **budget):
+            start = time.monotonic()
+            return klotio.integrate(integration, concurrency=2, **budget), time.monotonic() - start
+
+        async def async_timing(integration, **budget):
+            start = time.monotonic()
+            return await klotio.async_integrate(integration, concurrency=2, **budget), time.monotonic() - start
+
+        for run in [
+            timing,
+            lambda integration, **budget: asyncio.run(async_timing(integration, **budget))
+        ]:
+
+            timed, elapsed = run({"fields": [{"integrate": {"url": "slow"}}, {"name": "plain"}]}, deadline=0.1)
+
+            self.assertLess(elapsed, 0.4)
+            self.assertEqual(timed, {"fields": [
+                {"integrate": {"url": "slow"}, "errors": ["failed to integrate: deadline exceeded"]},
+                {"name": "plain"}
+            ]})
+
+            time.sleep(0.5)
+
+            self.assertNotIn("name", timed["fields"][0])
+
+    @unittest.mock.patch("klotio.INDEX")
+    @unittest.mock.patch("klotio.derive")
+    def test_integrations_budget(self, mock_derive, mock_index):
+
+        mock_derive.return_value = {"name": "derived"}
+
+        for concurrency in [None, 2]:
+
+            mock_index.templates.return_value = [
+                {"integrate": {"url": "a"}},
+                {"integrate": {"url": "b"}},
+                {"integrate": {"url": "c"}}
+            ]
+
+            integrated = klotio.integrations("unittest", concurrency=concurrency, max_derives=2)
+
+            self.assertEqual(sum("errors" in integration for integration in integrated), 1)
+            self.assertEqual(sum("name" in integration for integration in integrated), 2)
+
+        mock_index.templates.return_value = [
+            {"integrate": {"url": "a"}},
+            {"integrate": {"url": "b"}}
+        ]
+
+        integrated = asyncio.run(klotio.async_integrations("unittest", max_derives=1))
+
+        self.assertEqual(sum("errors" in integration for integration in integrated), 1)
 
-        def options(url, params=None):
+    @unittest.mock.patch("klotio.SESSION")
+    def test_integrate(self, mock_session):
+
+        def options(url, params=None, timeout=None):
 
             response = unittest.mock.MagicMock()
 
@@ -88,7 +1479,33 @@ class TestKlotIO(unittest.TestCase):
 
             return response
 
-        mock_options.side_effect = options
+        mock_session.options.side_effect = options
+
+        integrated = {
+            "integrate": {
+                "url": "sure"
+            },
+            "fields": [
+                {
+                    "integrate": {
+                        "node": "yep"
+                    },
+                    "name": "master"
+                },
+                {
+                    "integrate": {
+                        "url": "nope"
+                    },
+                    "errors": ["failed to integrate: whoops"]
+                }
+            ]
+        }
+
+        self.assertEqual(klotio.integrate({
+            "integrate": {
+                "url": "sure"
+            }
+        }, concurrency=2), integrated)
 
         self.assertEqual(klotio.integrate({
             "integrate": {
@@ -116,8 +1533,8 @@ class TestKlotIO(unittest.TestCase):
 
     @unittest.mock.patch("glob.glob")
     @unittest.mock.patch("klotio.open", create=True)
-    @unittest.mock.patch("requests.options")
-    def test_integrations(self, mock_options, mock_open, mock_glob):
+    @unittest.mock.patch("klotio.SESSION")
+    def test_integrations(self, mock_session, mock_open, mock_glob):
 
         mock_glob.return_value = ["/opt/service/config/integration_unit.test_unittest.fields.yaml"]
 
@@ -129,7 +1546,7 @@ class TestKlotIO(unittest.TestCase):
             })).return_value
         ]
 
-        def options(url, params=None):
+        def options(url, params=None, timeout=None):
 
             response = unittest.mock.MagicMock()
 
@@ -162,7 +1579,7 @@ class TestKlotIO(unittest.TestCase):
 
             return response
 
-        mock_options.side_effect = options
+        mock_session.options.side_effect = options
 
         self.assertEqual(klotio.integrations("unittest"), [
             {
@@ -190,3 +1607,160 @@ class TestKlotIO(unittest.TestCase):
         mock_glob.assert_called_once_with("/opt/service/config/integration_*_unittest.fields.yaml")
 
         mock_open.assert_called_once_with("/opt/service/config/integration_unit.test_unittest.fields.yaml", "r")
+
+        mock_open.side_effect = [
+            unittest.mock.mock_open(read_data=yaml.safe_dump({
+                "integrate": {
+                    "url": "sure"
+                }
+            })).return_value
+        ]
+
+        self.assertEqual(klotio.integrations("unittest", concurrency=2), [
+            {
+                "name": "unit.test",
+                "integrate": {
+                    "url": "sure"
+                },
+                "fields": [
+                    {
+                        "integrate": {
+                            "node": "yep"
+                        },
+                        "name": "master"
+                    },
+                    {
+                        "integrate": {
+                            "url": "nope"
+                        },
+                        "errors": ["failed to integrate: whoops"]
+                    }
+                ]
+            }
+        ])
+
+    @unittest.mock.patch("klotio.derive")
+    def test_async_derive(self, mock_derive):
+
+        mock_derive.return_value = {"name": "master"}
+
+        self.assertEqual(asyncio.run(klotio.async_derive({"url": "sure"})), {"name": "master"})
+        mock_derive.assert_called_once_with({"url": "sure"})
+
+        with unittest.mock.patch("klotio.FLIGHT", None):
+            self.assertEqual(asyncio.run(klotio.async_derive({"url": "sure"}, 5)), {"name": "master"})
+            mock_derive.assert_called_with({"url": "sure"}, 5)
+
+        mock_derive.side_effect = Exception("whoops")
+
+        with unittest.mock.patch("klotio.FLIGHT", None):
+            self.assertRaisesRegex(Exception, "whoops", asyncio.run, klotio.async_derive({"url": "sure"}))
+
+        # a caller with a deadline doesn't cut short one without that joins it
+
+        def slow(derivation):
+            time.sleep(0.3)
+            return {"name": "slow"}
+
+        mock_derive.side_effect = slow
+
+        async def run():
+
+            bounded = asyncio.ensure_future(klotio.async_derive({"url": "slow"}, 0.1))
+            await asyncio.sleep(0.02)
+            unbounded = asyncio.ensure_future(klotio.async_derive({"url": "slow"}))
+
+            return await asyncio.gather(bounded, unbounded, return_exceptions=True)
+
+        with unittest.mock.patch("klotio.FLIGHT", klotio.SingleFlight()):
+            bounded, unbounded = asyncio.run(run())
+
+        self.assertIsInstance(bounded, klotio.DeadlineExceeded)
+        self.assertEqual(unbounded, {"name": "slow"})
+        mock_derive.assert_called_with({"url": "slow"})
+
+    @unittest.mock.patch("klotio.SESSION")
+    def test_async_integrate(self, mock_session):
+
+        def options(url, params=None, timeout=None):
+
+            response = unittest.mock.MagicMock()
+
+            if url == "sure":
+
+                response.json.return_value = {
+                    "fields": [
+                        {
+                            "integrate": {
+                                "node": "yep"
+                            }
+                        },
+                        {
+                            "integrate": {
+                                "url": "nope"
+                            }
+                        }
+                    ]
+                }
+
+            elif url == "http://api.klot-io/node" and params == "yep":
+
+                response.json.return_value = {
+                    "name": "master"
+                }
+
+            elif url == "nope":
+
+                response.raise_for_status.side_effect = Exception("whoops")
+
+            return response
+
+        mock_session.options.side_effect = options
+
+        integrated = klotio.integrate({
+            "integrate": {
+                "url": "sure"
+            }
+        })
+
+        self.assertEqual(asyncio.run(klotio.async_integrate({
+            "integrate": {
+                "url": "sure"
+            }
+        }, concurrency=2)), integrated)
+
+        self.assertEqual(integrated["fields"][1]["errors"], ["failed to integrate: whoops"])
+
+    @unittest.mock.patch("klotio.INDEX")
+    @unittest.mock.patch("klotio.derive")
+    def test_async_integrations(self, mock_derive, mock_index):
+
+        mock_index.templates.return_value = [
+            {"name": "unit", "integrate": {"url": "sure"}},
+            {"name": "test", "fields": [{"integrate": {"url": "nope"}}]}
+        ]
+
+        def derive(derivation, timeout=None):
+
+            if derivation == {"url": "sure"}:
+                return {"fields": [{"name": "master"}]}
+
+            raise Exception("whoops")
+
+        mock_derive.side_effect = derive
+
+        self.assertEqual(asyncio.run(klotio.async_integrations("unittest")), [
+            {
+                "name": "unit",
+                "integrate": {"url": "sure"},
+                "fields": [{"name": "master"}]
+            },
+            {
+                "name": "test",
+                "fields": [
+                    {"integrate": {"url": "nope"}, "errors": ["failed to integrate: whoops"]}
+                ]
+            }
+        ])
+
+        mock_index.templates.assert_called_once_with("unittest")
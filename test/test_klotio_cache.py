@@ -0,0 +1,1256 @@
+import os
+import json
+import tempfile
+import unittest
+import unittest.mock
+import time
+import threading
+import asyncio
+import concurrent.futures
+
+import redis
+
+import klotio_cache
+import klotio_unittest
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+
+        self.now = 0
+        self.cache = klotio_cache.Cache(ttl=10, size=2, stale=5, clock=lambda: self.now)
+
+    def test___init__(self):
+
+        cache = klotio_cache.Cache()
+
+        self.assertEqual(cache.ttl, 60)
+        self.assertEqual(cache.size, 1024)
+        self.assertEqual(cache.stale, 0)
+        self.assertEqual(cache.tiers, [])
+        self.assertEqual(cache.entries, {})
+        self.assertEqual(cache.refreshing, set())
+        self.assertEqual(cache.stats(), {
+            "entries": 0,
+            "hits": 0,
+            "misses": 0,
+            "stales": 0,
+            "evictions": 0
+        })
+
+    def test_store(self):
+
+        value = {"fields": []}
+
+        self.cache.store("a", value)
+        self.cache.store("b", {})
+        self.cache.store("c", {})
+
+        self.assertEqual(list(self.cache.entries.keys()), ["b", "c"])
+        self.assertEqual(self.cache.evictions, 1)
+
+        self.cache.store("b", value)
+
+        self.assertEqual(list(self.cache.entries.keys()), ["c", "b"])
+        self.assertEqual(self.cache.entries["b"], ({"fields": []}, 0))
+        self.assertIsNot(self.cache.entries["b"][0], value)
+
+        self.now = 10
+        self.cache.store("b", value, 4)
+
+        self.assertEqual(self.cache.entries["b"], ({"fields": []}, 6))
+
+    def test_save(self):
+
+        tier = unittest.mock.MagicMock()
+        self.cache.tiers = [tier]
+
+        self.cache.save("a", 1)
+
+        self.assertEqual(self.cache.entries["a"], (1, 0))
+        tier.set.assert_called_once_with("a", 1)
+
+    def test_recall(self):
+
+        first = unittest.mock.MagicMock()
+        first.get.return_value = None
+        second = unittest.mock.MagicMock()
+        second.get.return_value = (1, 3)
+
+        self.assertIsNone(self.cache.recall("a"))
+
+        self.cache.tiers = [first, second]
+
+        self.assertEqual(self.cache.recall("a"), (1, 3))
+        first.set.assert_called_once_with("a", 1, 3)
+        second.set.assert_not_called()
+
+        second.get.return_value = None
+
+        self.assertIsNone(self.cache.recall("a"))
+
+    def test_sync(self):
+
+        tier = unittest.mock.MagicMock()
+        self.cache.tiers = [tier]
+
+        self.cache.store("a", 1)
+        self.cache.store("b", 2)
+
+        tier.invalidated.return_value = ["a", "c"]
+        self.cache.sync()
+
+        self.assertEqual(list(self.cache.entries.keys()), ["b"])
+
+        tier.invalidated.return_value = [None]
+        self.cache.sync()
+
+        self.assertEqual(self.cache.entries, {})
+
+    def test_refresh(self):
+
+        self.cache.refreshing.add("a")
+        self.cache.store("a", "before")
+
+        self.cache.refresh("a", unittest.mock.MagicMock(side_effect=Exception("whoops")))
+
+        self.assertEqual(self.cache.entries["a"], ("before", 0))
+        self.assertEqual(self.cache.refreshing, set())
+
+        self.now = 3
+        self.cache.tiers = [unittest.mock.MagicMock()]
+        self.cache.refreshing.add("a")
+        self.cache.refresh("a", lambda: "after")
+
+        self.assertEqual(self.cache.entries["a"], ("after", 3))
+        self.assertEqual(self.cache.refreshing, set())
+        self.cache.tiers[0].set.assert_called_once_with("a", "after")
+
+    def test_serve(self):
+
+        load = unittest.mock.MagicMock(return_value=2)
+
+        self.assertEqual(self.cache.serve("a", load), (False, None))
+
+        self.cache.store("a", [1])
+
+        found, value = self.cache.serve("a", load)
+
+        self.assertTrue(found)
+        self.assertEqual(value, [1])
+        self.assertIsNot(value, self.cache.entries["a"][0])
+        self.assertEqual(self.cache.hits, 1)
+
+        self.now = 15
+        self.cache.refreshing.add("a")
+
+        self.assertEqual(self.cache.serve("a", load), (True, [1]))
+        self.assertEqual(self.cache.stales, 1)
+        load.assert_not_called()
+
+        self.now = 16
+
+        self.assertEqual(self.cache.serve("a", load), (False, None))
+
+    def test_fetch(self):
+
+        load = unittest.mock.MagicMock(return_value={"fields": []})
+
+        first = self.cache.fetch("a", load)
+        second = self.cache.fetch("a", load)
+
+        self.assertEqual(second, {"fields": []})
+        self.assertIsNot(first, second)
+        load.assert_called_once_with()
+
+        second["fields"].append("mutated")
+        self.assertEqual(self.cache.fetch("a", load), {"fields": []})
+
+        # stale serves the old value and refreshes in the background
+
+        self.now = 12
+
+        self.assertEqual(self.cache.fetch("a", lambda: {"fields": ["new"]}), {"fields": []})
+
+        while self.cache.refreshing:
+            time.sleep(0.01)
+
+        self.assertEqual(self.cache.fetch("a", load), {"fields": ["new"]})
+
+        # expired past stale is a miss
+
+        self.now = 100
+        self.assertEqual(self.cache.fetch("a", load), {"fields": []})
+        self.assertEqual(load.call_count, 2)
+
+        self.assertEqual(self.cache.hits, 3)
+        self.assertEqual(self.cache.stales, 1)
+        self.assertEqual(self.cache.misses, 2)
+
+        # refresh, if given, reloads stale entries instead of load
+
+        self.now = 112
+        bounded = unittest.mock.MagicMock(return_value={"fields": ["bounded"]})
+
+        self.assertEqual(self.cache.fetch("a", bounded, lambda: {"fields": ["refreshed"]}), {"fields": []})
+
+        while self.cache.refreshing:
+            time.sleep(0.01)
+
+        self.assertEqual(self.cache.fetch("a", bounded), {"fields": ["refreshed"]})
+        bounded.assert_not_called()
+
+    def test_fetch_tiers(self):
+
+        redis = klotio_unittest.MockRedis("unit", 123)
+        now = [1000]
+        tier = klotio_cache.RedisCache(redis, clock=lambda: now[0])
+
+        self.cache.tiers = [tier]
+        load = unittest.mock.MagicMock(return_value={"fields": []})
+
+        # a miss everywhere loads and saves to the tier
+
+        self.assertEqual(self.cache.fetch("a", load), {"fields": []})
+        self.assertEqual(tier.get("a"), ({"fields": []}, 0))
+
+        # another process finds it in the tier, as old as it is there
+
+        other = klotio_cache.Cache(ttl=10, size=2, stale=5, clock=lambda: self.now, tiers=[
+            klotio_cache.RedisCache(redis, clock=lambda: now[0])
+        ])
+
+        now[0] = 1003
+
+        self.assertEqual(other.fetch("a", load), {"fields": []})
+        self.assertEqual(other.entries["a"], ({"fields": []}, -3))
+        load.assert_called_once_with()
+
+        # too old in the tier loads again
+
+        self.cache.invalidate()
+        now[0] = 1100
+
+        self.assertEqual(self.cache.fetch("a", load), {"fields": []})
+        self.assertEqual(load.call_count, 2)
+
+        # invalidating in one process drops it in the other
+
+        other.fetch("a", load)
+        self.cache.invalidate("a")
+        other.sync()
+
+        self.assertEqual(other.entries, {})
+
+        # filling in a tier keeps how old it was in the one it came from
+
+        directory = tempfile.TemporaryDirectory()
+        disk = klotio_cache.DiskCache(directory.name, clock=lambda: now[0])
+        disk.set("b", {"fields": ["old"]}, 50)
+
+        filling = klotio_cache.Cache(ttl=100, clock=lambda: self.now, tiers=[tier, disk])
+
+        self.assertEqual(filling.fetch("b", load), {"fields": ["old"]})
+        self.assertEqual(tier.get("b"), ({"fields": ["old"]}, 50))
+
+        fresh = klotio_cache.Cache(ttl=10, clock=lambda: self.now, tiers=[klotio_cache.RedisCache(redis, clock=lambda: now[0])])
+
+        self.assertEqual(fresh.fetch("b", load), {"fields": []})
+        self.assertEqual(load.call_count, 3)
+
+        directory.cleanup()
+
+    def test_invalidate(self):
+
+        tier = unittest.mock.MagicMock()
+        self.cache.tiers = [tier]
+
+        self.cache.store("a", 1)
+        self.cache.store("b", 2)
+
+        self.cache.invalidate("a")
+        self.assertEqual(list(self.cache.entries.keys()), ["b"])
+        tier.delete.assert_called_once_with("a")
+
+        self.cache.invalidate()
+        self.assertEqual(self.cache.entries, {})
+        tier.delete.assert_called_with(None)
+
+    def test_stats(self):
+
+        self.cache.fetch("a", lambda: 1)
+        self.cache.fetch("a", lambda: 1)
+
+        self.assertEqual(self.cache.stats(), {
+            "entries": 1,
+            "hits": 1,
+            "misses": 1,
+            "stales": 0,
+            "evictions": 0
+        })
+
+
+class TestRedisCache(unittest.TestCase):
+
+    def setUp(self):
+
+        self.now = 1000
+        self.redis = klotio_unittest.MockRedis("unit", 123)
+        self.tier = klotio_cache.RedisCache(self.redis, ttl=30, clock=lambda: self.now)
+
+    def test___init__(self):
+
+        tier = klotio_cache.RedisCache(self.redis)
+
+        self.assertEqual(tier.client, self.redis)
+        self.assertEqual(tier.ttl, 300)
+        self.assertEqual(tier.prefix, "klotio:derive:")
+        self.assertEqual(tier.channel, "klotio:derive:invalidate")
+        self.assertEqual(tier.pubsub.channels, {"klotio:derive:invalidate"})
+        self.assertEqual(tier.stats(), {
+            "hits": 0,
+            "misses": 0,
+            "errors": 0,
+            "corruptions": 0,
+            "invalidations": 0
+        })
+
+    def test_encode(self):
+
+        self.assertEqual(json.loads(klotio_cache.RedisCache.encode({"a": [1, 2]}, 5.5)), [5.5, {"a": [1, 2]}])
+        self.assertNotIn(" ", str(klotio_cache.RedisCache.encode({"a": [1, 2]}, 5.5)))
+
+    def test_decode(self):
+
+        self.assertEqual(klotio_cache.RedisCache.decode(b'[5.5,{"a":[1,2]}]'), ({"a": [1, 2]}, 5.5))
+        self.assertEqual(klotio_cache.RedisCache.decode('[5.5,{"a":[1,2]}]'), ({"a": [1, 2]}, 5.5))
+
+    def test_subscribe(self):
+
+        self.tier.pubsub = None
+
+        self.tier.subscribe()
+
+        self.assertEqual(self.tier.pubsub.channels, {"klotio:derive:invalidate"})
+
+        self.redis.pubsub = unittest.mock.MagicMock(side_effect=redis.exceptions.ConnectionError("down"))
+
+        self.tier.subscribe()
+
+        self.assertIsNone(self.tier.pubsub)
+        self.assertEqual(self.tier.errors, 1)
+
+    def test_get(self):
+
+        self.assertIsNone(self.tier.get("a"))
+        self.assertEqual(self.tier.misses, 1)
+
+        self.tier.set("a", {"fields": []})
+        self.now = 1004
+
+        self.assertEqual(self.tier.get("a"), ({"fields": []}, 4))
+        self.assertEqual(self.tier.hits, 1)
+
+        # corrupt or foreign values are misses
+
+        self.redis.set("klotio:derive:b", b"{nope")
+        self.redis.set("klotio:derive:c", b'["then",{}]')
+        self.redis.set("klotio:derive:d", b"1")
+
+        self.assertIsNone(self.tier.get("b"))
+        self.assertIsNone(self.tier.get("c"))
+        self.assertIsNone(self.tier.get("d"))
+        self.assertEqual(self.tier.corruptions, 3)
+        self.assertEqual(self.tier.hits, 1)
+
+        self.tier.client = unittest.mock.MagicMock()
+        self.tier.client.get.side_effect = redis.exceptions.ConnectionError("down")
+
+        self.assertIsNone(self.tier.get("a"))
+        self.assertEqual(self.tier.errors, 1)
+
+    def test_set(self):
+
+        self.redis.clock = klotio_unittest.MockClock()
+
+        self.tier.set("a", {"fields": []})
+
+        self.assertEqual(json.loads(self.redis.get("klotio:derive:a")), [1000, {"fields": []}])
+        self.assertEqual(self.redis.ttl("klotio:derive:a"), 30)
+
+        self.redis.clock.advance(30)
+
+        self.assertIsNone(self.tier.get("a"))
+
+        # already aged it keeps when it was stored and expires sooner
+
+        self.tier.set("a", {"fields": []}, 20)
+
+        self.assertEqual(self.tier.get("a"), ({"fields": []}, 20))
+        self.assertEqual(self.redis.ttl("klotio:derive:a"), 10)
+
+        self.tier.set("b", {"fields": []}, 30)
+
+        self.assertIsNone(self.redis.get("klotio:derive:b"))
+
+        self.tier.client = unittest.mock.MagicMock()
+        self.tier.client.set.side_effect = redis.exceptions.ConnectionError("down")
+
+        self.tier.set("a", {})
+        self.assertEqual(self.tier.errors, 1)
+
+    def test_delete(self):
+
+        self.tier.set("a", 1)
+        self.tier.set("b", 2)
+        self.redis.set("other", 3)
+
+        self.tier.delete("a")
+
+        self.assertIsNone(self.tier.get("a"))
+        self.assertEqual(self.tier.get("b"), (2, 0))
+
+        self.tier.delete()
+
+        self.assertIsNone(self.tier.get("b"))
+        self.assertEqual(self.redis.get("other"), 3)
+        self.assertEqual(self.redis.messages, ["a", "*"])
+
+        self.tier.delete()
+
+        self.tier.client = unittest.mock.MagicMock()
+        self.tier.client.delete.side_effect = redis.exceptions.ConnectionError("down")
+
+        self.tier.delete("a")
+        self.assertEqual(self.tier.errors, 1)
+
+    def test_invalidated(self):
+
+        self.assertEqual(self.tier.invalidated(), [])
+
+        self.redis.publish("klotio:derive:invalidate", "a")
+        self.redis.publish("klotio:derive:invalidate", b"b")
+        self.redis.publish("klotio:derive:invalidate", "*")
+        self.redis.publish("elsewhere", "c")
+
+        self.assertEqual(self.tier.invalidated(), ["a", "b", None])
+        self.assertEqual(self.tier.invalidated(), [])
+        self.assertEqual(self.tier.invalidations, 3)
+
+        # another thread already polling skips
+
+        self.redis.publish("klotio:derive:invalidate", "a")
+
+        with self.tier.polling:
+            self.assertEqual(self.tier.invalidated(), [])
+
+        self.assertEqual(self.tier.invalidated(), ["a"])
+
+        # dropped connections resubscribe next time
+
+        self.tier.pubsub = unittest.mock.MagicMock()
+        self.tier.pubsub.get_message.side_effect = redis.exceptions.ConnectionError("down")
+
+        self.assertEqual(self.tier.invalidated(), [])
+        self.assertIsNone(self.tier.pubsub)
+        self.assertEqual(self.tier.errors, 1)
+
+        self.assertEqual(self.tier.invalidated(), [])
+        self.assertIsNotNone(self.tier.pubsub)
+
+    def test_stats(self):
+
+        self.tier.get("a")
+
+        self.assertEqual(self.tier.stats(), {
+            "hits": 0,
+            "misses": 1,
+            "errors": 0,
+            "corruptions": 0,
+            "invalidations": 0
+        })
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+
+        self.now = 1000
+        self.directory = tempfile.TemporaryDirectory()
+        self.tier = klotio_cache.DiskCache(f"{self.directory.name}/cache", ttl=30, clock=lambda: self.now)
+
+    def tearDown(self):
+
+        self.directory.cleanup()
+
+    @unittest.mock.patch.dict(os.environ, {"DISK_CACHE_DIRECTORY": "/tmp/nope"})
+    @unittest.mock.patch("klotio_cache.DiskCache.prune")
+    def test___init__(self, mock_prune):
+
+        tier = klotio_cache.DiskCache()
+
+        self.assertEqual(tier.directory, "/tmp/nope")
+        self.assertEqual(tier.path, "/tmp/nope/derive.sqlite")
+        self.assertEqual(tier.ttl, 86400)
+        self.assertEqual(tier.timeout, 5.0)
+        self.assertEqual(tier.stats(), {
+            "hits": 0,
+            "misses": 0,
+            "errors": 0,
+            "corruptions": 0
+        })
+        mock_prune.assert_called_once_with()
+
+        self.assertTrue(os.path.exists(f"{self.directory.name}/cache/derive.sqlite"))
+
+    def test_encode(self):
+
+        self.assertEqual(klotio_cache.DiskCache.encode({"a": [1, 2]}), '{"a":[1,2]}')
+
+    def test_decode(self):
+
+        self.assertEqual(klotio_cache.DiskCache.decode('{"a":[1,2]}'), {"a": [1, 2]})
+
+    def test_inode(self):
+
+        self.assertEqual(klotio_cache.DiskCache.inode(self.tier.path), os.stat(self.tier.path).st_ino)
+        self.assertIsNone(klotio_cache.DiskCache.inode(f"{self.directory.name}/nope"))
+
+    def test_connection(self):
+
+        connection = self.tier.connection()
+
+        self.assertIs(self.tier.connection(), connection)
+        self.assertEqual(connection.execute("PRAGMA journal_mode").fetchone(), ("wal",))
+
+        # each thread has its own
+
+        others = []
+        thread = threading.Thread(target=lambda: others.append(self.tier.connection()))
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(others[0], connection)
+
+        # replaced files are reconnected to
+
+        os.remove(self.tier.path)
+
+        self.assertIsNot(self.tier.connection(), connection)
+        self.assertTrue(os.path.exists(self.tier.path))
+
+    def test_recreate(self):
+
+        self.tier.set("a", 1)
+
+        self.tier.recreate()
+
+        self.assertFalse(os.path.exists(self.tier.path))
+        self.assertIsNone(self.tier.local.connected)
+        self.assertEqual(self.tier.corruptions, 1)
+        self.assertIsNone(self.tier.get("a"))
+
+    def test_execute(self):
+
+        self.assertEqual(self.tier.execute("SELECT 1"), [(1,)])
+
+        # busy or bad statements are misses
+
+        self.assertIsNone(self.tier.execute("SELECT nope FROM nowhere"))
+        self.assertEqual(self.tier.errors, 1)
+
+        # corrupt files get recreated
+
+        self.tier.set("a", 1)
+        self.tier.local.connected[1].close()
+        self.tier.local.connected = None
+
+        for path in (self.tier.path, f"{self.tier.path}-wal", f"{self.tier.path}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+        with open(self.tier.path, "wb") as corrupt:
+            corrupt.write(b"garbage" * 1000)
+
+        self.assertIsNone(self.tier.get("a"))
+        self.assertEqual(self.tier.corruptions, 1)
+
+        self.tier.set("a", 2)
+
+        self.assertEqual(self.tier.get("a"), (2, 0))
+
+    def test_get(self):
+
+        self.assertIsNone(self.tier.get("a"))
+        self.assertEqual(self.tier.misses, 1)
+
+        self.tier.set("a", {"fields": []})
+        self.now = 1004
+
+        self.assertEqual(self.tier.get("a"), ({"fields": []}, 4))
+        self.assertEqual(self.tier.hits, 1)
+
+        # past ttl is a miss
+
+        self.now = 1031
+
+        self.assertIsNone(self.tier.get("a"))
+        self.assertEqual(self.tier.misses, 2)
+
+        # unreadable values are dropped
+
+        self.tier.execute("INSERT OR REPLACE INTO entries VALUES ('b', '{nope', 1031)")
+
+        self.assertIsNone(self.tier.get("b"))
+        self.assertEqual(self.tier.corruptions, 1)
+        self.assertEqual(self.tier.execute("SELECT * FROM entries WHERE key = 'b'"), [])
+
+    def test_set(self):
+
+        self.tier.set("a", {"fields": []})
+
+        self.assertEqual(self.tier.execute("SELECT * FROM entries"), [("a", '{"fields":[]}', 1000)])
+
+        self.tier.set("b", {"fields": []}, 20)
+
+        self.assertEqual(self.tier.get("b"), ({"fields": []}, 20))
+
+        # a restarted process sees it
+
+        restarted = klotio_cache.DiskCache(f"{self.directory.name}/cache", ttl=30, clock=lambda: self.now)
+
+        self.assertEqual(restarted.get("a"), ({"fields": []}, 0))
+
+    def test_delete(self):
+
+        self.tier.set("a", 1)
+        self.tier.set("b", 2)
+
+        self.tier.delete("a")
+
+        self.assertIsNone(self.tier.get("a"))
+        self.assertEqual(self.tier.get("b"), (2, 0))
+
+        self.tier.delete()
+
+        self.assertIsNone(self.tier.get("b"))
+
+    def test_invalidated(self):
+
+        self.assertEqual(self.tier.invalidated(), [])
+
+    def test_prune(self):
+
+        self.tier.set("a", 1)
+        self.now = 1020
+        self.tier.set("b", 2)
+        self.now = 1031
+
+        self.tier.prune()
+
+        self.assertEqual(self.tier.execute("SELECT key FROM entries"), [("b",)])
+
+    def test_stats(self):
+
+        self.tier.get("a")
+
+        self.assertEqual(self.tier.stats(), {
+            "hits": 0,
+            "misses": 1,
+            "errors": 0,
+            "corruptions": 0
+        })
+
+    def test_concurrent(self):
+
+        tiers = [klotio_cache.DiskCache(f"{self.directory.name}/cache", ttl=30) for _ in range(4)]
+
+        def work(tier, worker):
+            for index in range(50):
+                tier.set(f"{worker}:{index}", {"index": index})
+                self.assertEqual(tier.get(f"{worker}:{index}")[0], {"index": index})
+
+        threads = [threading.Thread(target=work, args=(tier, worker)) for worker, tier in enumerate(tiers)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(tiers[0].execute("SELECT COUNT(*) FROM entries"), [(200,)])
+        self.assertEqual(sum(tier.errors for tier in tiers), 0)
+
+    def test_warm_restart(self):
+
+        self.tier.set("a", {"fields": ["old"]})
+        self.now = 1020
+
+        cache = klotio_cache.Cache(ttl=10, stale=30, clock=lambda: 0, tiers=[self.tier])
+        refreshed = threading.Event()
+
+        def load():
+            refreshed.set()
+            return {"fields": ["new"]}
+
+        self.assertEqual(cache.fetch("a", load), {"fields": ["old"]})
+        self.assertTrue(refreshed.wait(5))
+
+        while cache.refreshing:
+            time.sleep(0.01)
+
+        self.assertEqual(self.tier.get("a"), ({"fields": ["new"]}, 0))
+
+
+class TestValidators(unittest.TestCase):
+
+    def setUp(self):
+
+        self.validators = klotio_cache.Validators(size=2)
+
+    def test___init__(self):
+
+        validators = klotio_cache.Validators()
+
+        self.assertEqual(validators.size, 1024)
+        self.assertEqual(validators.entries, {})
+        self.assertEqual(validators.stats(), {
+            "entries": 0,
+            "revalidations": 0,
+            "not_modified": 0
+        })
+
+    def test_headers(self):
+
+        self.assertEqual(self.validators.headers("a"), {})
+        self.assertEqual(self.validators.revalidations, 0)
+
+        self.validators.store("a", {"ETag": '"v1"'}, 1)
+        self.validators.store("b", {"Last-Modified": "then"}, 2)
+
+        self.assertEqual(self.validators.headers("a"), {"If-None-Match": '"v1"'})
+        self.assertEqual(self.validators.headers("b"), {"If-Modified-Since": "then"})
+        self.assertEqual(self.validators.revalidations, 2)
+
+    def test_store(self):
+
+        value = {"fields": []}
+
+        self.assertIs(self.validators.store("a", {}, value), value)
+        self.assertEqual(self.validators.entries, {})
+
+        stored = self.validators.store("a", {"ETag": '"v1"'}, value)
+
+        self.assertEqual(stored, value)
+        self.assertIsNot(stored, value)
+        self.assertIs(self.validators.entries["a"][2], value)
+
+        self.validators.store("b", {"ETag": '"v1"'}, 2)
+        self.validators.store("c", {"ETag": '"v1"'}, 3)
+
+        self.assertEqual(list(self.validators.entries.keys()), ["b", "c"])
+
+    def test_reuse(self):
+
+        self.assertIsNone(self.validators.reuse("a"))
+
+        self.validators.store("a", {"ETag": '"v1"'}, {"fields": []})
+        self.validators.store("b", {"ETag": '"v1"'}, 2)
+
+        reused = self.validators.reuse("a")
+
+        self.assertEqual(reused, {"fields": []})
+        self.assertIsNot(reused, self.validators.entries["a"][2])
+        self.assertEqual(list(self.validators.entries.keys()), ["b", "a"])
+        self.assertEqual(self.validators.not_modified, 1)
+
+    def test_invalidate(self):
+
+        self.validators.store("a", {"ETag": '"v1"'}, 1)
+        self.validators.store("b", {"ETag": '"v1"'}, 2)
+
+        self.validators.invalidate("a")
+        self.assertEqual(list(self.validators.entries.keys()), ["b"])
+
+        self.validators.invalidate()
+        self.assertEqual(self.validators.entries, {})
+
+    def test_stats(self):
+
+        self.validators.store("a", {"ETag": '"v1"'}, 1)
+        self.validators.headers("a")
+        self.validators.reuse("a")
+
+        self.assertEqual(self.validators.stats(), {
+            "entries": 1,
+            "revalidations": 1,
+            "not_modified": 1
+        })
+
+
+class TestBreaker(unittest.TestCase):
+
+    def setUp(self):
+
+        self.now = 0
+        self.breaker = klotio_cache.Breaker(failures=2, reset=10, negative=1, clock=lambda: self.now)
+
+    def fail(self, derivation, status=None):
+
+        exception = Exception("whoops")
+
+        if status is not None:
+            exception.response = unittest.mock.MagicMock(status_code=status)
+
+        self.breaker.failure(derivation, exception)
+
+    def test___init__(self):
+
+        breaker = klotio_cache.Breaker()
+
+        self.assertEqual(breaker.failures, 5)
+        self.assertEqual(breaker.reset, 30)
+        self.assertEqual(breaker.negative, 5)
+        self.assertEqual(breaker.circuits, {})
+        self.assertEqual(breaker.failed, {})
+
+    def test_circuit(self):
+
+        circuit = self.breaker.circuit("http://api.klot-io/node")
+
+        self.assertEqual(circuit, {
+            "state": "closed",
+            "failures": 0,
+            "opened": None,
+            "probing": False,
+            "rejected": 0,
+            "opens": 0
+        })
+        self.assertIs(self.breaker.circuit("http://api.klot-io/node"), circuit)
+
+    def test_before(self):
+
+        self.breaker.before({"url": "a"})
+
+        # recently failed fails fast until negative passes
+
+        self.fail({"url": "a"})
+
+        with self.assertRaisesRegex(klotio_cache.FailFast, "recently failed: whoops"):
+            self.breaker.before({"url": "a"})
+
+        self.assertEqual(self.breaker.negatives, 1)
+
+        self.breaker.before({"url": "b"})
+
+        self.now = 1
+        self.breaker.before({"url": "a"})
+
+        self.assertEqual(self.breaker.failed, {})
+
+        # open fails fast until reset
+
+        self.breaker.circuit("a").update(state="open", opened=1)
+
+        with self.assertRaisesRegex(klotio_cache.FailFast, "circuit open for a"):
+            self.breaker.before({"url": "a"})
+
+        self.assertEqual(self.breaker.circuits["a"]["rejected"], 1)
+
+        # then lets one probe through while half-open
+
+        self.now = 11
+        self.breaker.before({"url": "a"})
+
+        self.assertEqual(self.breaker.circuits["a"]["state"], "half-open")
+        self.assertTrue(self.breaker.circuits["a"]["probing"])
+
+        with self.assertRaisesRegex(klotio_cache.FailFast, "circuit open for a"):
+            self.breaker.before({"url": "a"})
+
+    def test_success(self):
+
+        self.breaker.circuit("a").update(state="half-open", failures=3, probing=True)
+
+        self.breaker.success({"url": "a"})
+
+        self.assertEqual(self.breaker.circuits["a"]["state"], "closed")
+        self.assertEqual(self.breaker.circuits["a"]["failures"], 0)
+        self.assertFalse(self.breaker.circuits["a"]["probing"])
+
+    def test_failure(self):
+
+        self.fail({"url": "a"})
+
+        self.assertEqual(self.breaker.failed["url:a"][1], 1)
+        self.assertEqual(self.breaker.circuits["a"]["state"], "closed")
+        self.assertEqual(self.breaker.circuits["a"]["failures"], 1)
+
+        # client errors don't count against the target
+
+        self.fail({"url": "a"}, 404)
+
+        self.assertEqual(self.breaker.circuits["a"]["failures"], 1)
+
+        self.now = 3
+        self.fail({"url": "a"}, 503)
+
+        self.assertEqual(self.breaker.circuits["a"]["state"], "open")
+        self.assertEqual(self.breaker.circuits["a"]["opened"], 3)
+        self.assertEqual(self.breaker.circuits["a"]["opens"], 1)
+
+        # failed probes open it again, client errors close it
+
+        self.breaker.circuits["a"].update(state="half-open", probing=True)
+        self.now = 20
+        self.fail({"url": "a"})
+
+        self.assertEqual(self.breaker.circuits["a"]["state"], "open")
+        self.assertEqual(self.breaker.circuits["a"]["opened"], 20)
+        self.assertEqual(self.breaker.circuits["a"]["opens"], 2)
+
+        self.breaker.circuits["a"].update(state="half-open", probing=True)
+        self.fail({"url": "a"}, 400)
+
+        self.assertEqual(self.breaker.circuits["a"]["state"], "closed")
+
+        # without negative caching nothing's remembered
+
+        self.breaker.negative = 0
+        self.breaker.failed = {}
+        self.fail({"url": "a"})
+
+        self.assertEqual(self.breaker.failed, {})
+
+        # expired failures are pruned once there are many
+
+        self.breaker.negative = 1
+        self.breaker.failed = {f"url:{index}": ("old", 0) for index in range(1024)}
+        self.fail({"url": "a"})
+
+        self.assertEqual(list(self.breaker.failed.keys()), ["url:a"])
+
+        # running out of a caller's deadline counts for nothing, bar freeing the probe
+
+        self.breaker.circuits["a"].update(state="half-open", probing=True, failures=1)
+        self.breaker.failure({"url": "b"}, klotio_cache.DeadlineExceeded("deadline exceeded"))
+        self.breaker.failure({"url": "a"}, klotio_cache.DeadlineExceeded("deadline exceeded"))
+
+        self.assertEqual(list(self.breaker.failed.keys()), ["url:a"])
+        self.assertEqual(self.breaker.circuits["a"]["state"], "half-open")
+        self.assertEqual(self.breaker.circuits["a"]["failures"], 1)
+        self.assertFalse(self.breaker.circuits["a"]["probing"])
+
+    def test_call(self):
+
+        self.assertEqual(self.breaker.call({"url": "a"}, lambda: "yep"), "yep")
+
+        call = unittest.mock.MagicMock(side_effect=Exception("whoops"))
+
+        with self.assertRaisesRegex(Exception, "whoops"):
+            self.breaker.call({"url": "a"}, call)
+
+        self.now = 1
+
+        with self.assertRaisesRegex(Exception, "whoops"):
+            self.breaker.call({"url": "a"}, call)
+
+        self.now = 2
+
+        with self.assertRaisesRegex(klotio_cache.FailFast, "circuit open for a"):
+            self.breaker.call({"url": "a"}, call)
+
+        self.assertEqual(call.call_count, 2)
+
+        # the probe after reset closes it
+
+        self.now = 12
+
+        self.assertEqual(self.breaker.call({"url": "a"}, lambda: "back"), "back")
+        self.assertEqual(self.breaker.states(), {"a": "closed"})
+
+    def test_states(self):
+
+        self.breaker.circuit("a")
+        self.breaker.circuit("b")["state"] = "open"
+
+        self.assertEqual(self.breaker.states(), {"a": "closed", "b": "open"})
+
+    def test_as_dict(self):
+
+        self.breaker.circuit("b").update(state="open", failures=2, rejected=3, opens=1)
+        self.breaker.circuit("a")
+
+        self.assertEqual(self.breaker.as_dict(), {
+            "a": {"state": "closed", "failures": 0, "rejected": 0, "opens": 0},
+            "b": {"state": "open", "failures": 2, "rejected": 3, "opens": 1}
+        })
+
+    def test_prometheus(self):
+
+        self.breaker.circuit("a")
+        self.breaker.circuit("b").update(state="open", rejected=3, opens=1)
+
+        self.assertEqual(self.breaker.prometheus(), "\n".join([
+            '# TYPE klotio_breaker_state gauge',
+            'klotio_breaker_state{target="a"} 0',
+            'klotio_breaker_state{target="b"} 2',
+            '# TYPE klotio_breaker_rejected_total counter',
+            'klotio_breaker_rejected_total{target="a"} 0',
+            'klotio_breaker_rejected_total{target="b"} 3',
+            '# TYPE klotio_breaker_opened_total counter',
+            'klotio_breaker_opened_total{target="a"} 0',
+            'klotio_breaker_opened_total{target="b"} 1'
+        ]) + "\n")
+
+    def test_clear(self):
+
+        self.breaker.circuit("a")
+        self.fail({"url": "a"})
+
+        self.breaker.clear()
+
+        self.assertEqual(self.breaker.circuits, {})
+        self.assertEqual(self.breaker.failed, {})
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+
+        self.flight = klotio_cache.SingleFlight()
+
+    def test___init__(self):
+
+        self.assertEqual(self.flight.calls, {})
+        self.assertEqual(self.flight.joined, {})
+        self.assertEqual(self.flight.running, set())
+        self.assertEqual(self.flight.shared, 0)
+
+    def test_run(self):
+
+        future = concurrent.futures.Future()
+        self.flight.calls["a"] = future
+        self.flight.joined["a"] = 2
+
+        self.assertEqual(self.flight.run("a", future, lambda: "yep"), 2)
+        self.assertEqual(future.result(), "yep")
+        self.assertEqual(self.flight.calls, {})
+        self.assertEqual(self.flight.joined, {})
+
+        future = concurrent.futures.Future()
+        self.flight.calls["b"] = future
+
+        self.assertEqual(self.flight.run("b", future, unittest.mock.MagicMock(side_effect=Exception("whoops"))), 0)
+        self.assertRaisesRegex(Exception, "whoops", future.result)
+        self.assertEqual(self.flight.calls, {})
+
+    def test_async_run(self):
+
+        async def call():
+            return "yep"
+
+        async def run():
+
+            future = asyncio.get_running_loop().create_future()
+            self.flight.tasks["a"] = future
+            self.flight.joined["a"] = 1
+
+            return await self.flight.async_run("a", future, call), future.result()
+
+        self.assertEqual(asyncio.run(run()), (1, "yep"))
+        self.assertEqual(self.flight.tasks, {})
+        self.assertEqual(self.flight.joined, {})
+
+    def test_do(self):
+
+        alone = {"fields": []}
+
+        self.assertIs(self.flight.do("a", lambda: alone), alone)
+        self.assertEqual(self.flight.calls, {})
+
+        with self.assertRaisesRegex(Exception, "whoops"):
+            self.flight.do("a", unittest.mock.MagicMock(side_effect=Exception("whoops")))
+
+        self.assertEqual(self.flight.calls, {})
+
+        # concurrent callers share one call
+
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        shared = {"fields": []}
+
+        def call():
+            calls.append(True)
+            started.set()
+            release.wait(5)
+            return shared
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+
+            leader = pool.submit(self.flight.do, "b", call)
+            self.assertTrue(started.wait(5))
+
+            followers = [pool.submit(self.flight.do, "b", call) for _ in range(3)]
+
+            while self.flight.shared < 3:
+                time.sleep(0.01)
+
+            release.set()
+
+            results = [leader.result()] + [follower.result() for follower in followers]
+
+        self.assertEqual(calls, [True])
+        self.assertEqual(results, [{"fields": []}] * 4)
+        self.assertEqual(len(set(id(result) for result in results)), 4)
+        self.assertNotIn(id(shared), [id(result) for result in results])
+        self.assertEqual(self.flight.joined, {})
+
+        # and share the exception
+
+        started.clear()
+        release.clear()
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise Exception("whoops")
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+
+            leader = pool.submit(self.flight.do, "c", fail)
+            self.assertTrue(started.wait(5))
+
+            follower = pool.submit(self.flight.do, "c", fail)
+
+            while self.flight.shared < 4:
+                time.sleep(0.01)
+
+            release.set()
+
+            self.assertRaisesRegex(Exception, "whoops", leader.result)
+            self.assertRaisesRegex(Exception, "whoops", follower.result)
+
+        # followers wait no longer than their timeout
+
+        started.clear()
+        release.clear()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+
+            leader = pool.submit(self.flight.do, "d", call)
+            self.assertTrue(started.wait(5))
+
+            with self.assertRaises(concurrent.futures.TimeoutError):
+                self.flight.do("d", call, 0.05)
+
+            release.set()
+
+            self.assertEqual(leader.result(), shared)
+
+        self.assertEqual(self.flight.joined, {})
+
+        # a leader with a timeout leaves the call running for the others
+
+        started.clear()
+        release.clear()
+        calls.clear()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+
+            with self.assertRaises(concurrent.futures.TimeoutError):
+                self.flight.do("e", call, 0.05)
+
+            follower = pool.submit(self.flight.do, "e", call)
+
+            while self.flight.shared < 6:
+                time.sleep(0.01)
+
+            release.set()
+
+            self.assertEqual(follower.result(), shared)
+            self.assertIsNot(follower.result(), shared)
+
+        self.assertEqual(calls, [True])
+        self.assertEqual(self.flight.calls, {})
+        self.assertEqual(self.flight.joined, {})
+        self.assertEqual(self.flight.do("e", lambda: shared, 5), shared)
+
+    def test_async_do(self):
+
+        async def call():
+            await asyncio.sleep(0.01)
+            return {"fields": []}
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise Exception("whoops")
+
+        async def run():
+
+            results = await asyncio.gather(*[self.flight.async_do("a", call) for _ in range(3)])
+            failures = await asyncio.gather(*[self.flight.async_do("b", fail) for _ in range(2)], return_exceptions=True)
+
+            return results, failures
+
+        results, failures = asyncio.run(run())
+
+        self.assertEqual(results, [{"fields": []}] * 3)
+        self.assertEqual(len(set(id(result) for result in results)), 3)
+        self.assertEqual([str(failure) for failure in failures], ["whoops", "whoops"])
+        self.assertEqual(self.flight.shared, 3)
+        self.assertEqual(self.flight.tasks, {})
+        self.assertEqual(self.flight.joined, {})
+
+        # a leader with a timeout leaves the call running for the others
+
+        async def slow():
+            await asyncio.sleep(0.2)
+            return {"fields": ["slow"]}
+
+        async def bounded():
+
+            leader = asyncio.ensure_future(self.flight.async_do("c", slow, 0.05))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(self.flight.async_do("c", slow))
+
+            return await asyncio.gather(leader, follower, return_exceptions=True)
+
+        leader, follower = asyncio.run(bounded())
+
+        self.assertIsInstance(leader, asyncio.TimeoutError)
+        self.assertEqual(follower, {"fields": ["slow"]})
+        self.assertEqual(self.flight.tasks, {})
+        self.assertEqual(self.flight.joined, {})
+        self.assertEqual(self.flight.running, set())
+
+
+class TestKlotIOCache(unittest.TestCase):
+
+    def test_selector(self):
+
+        self.assertEqual(klotio_cache.selector(None, None), "")
+        self.assertEqual(klotio_cache.selector(None, None, "+Inf"), '{le="+Inf"}')
+        self.assertEqual(klotio_cache.selector("target", 'a"b\\c\n'), '{target="a\\"b\\\\c\\n"}')
+        self.assertEqual(klotio_cache.selector("depth", 1, "0.5"), '{depth="1",le="0.5"}')
+
+    def test_clone(self):
+
+        value = {"fields": [{"name": "a", "options": [1, 2]}], "name": "b"}
+        cloned = klotio_cache.clone(value)
+
+        self.assertEqual(cloned, value)
+        self.assertIsNot(cloned["fields"], value["fields"])
+        self.assertIsNot(cloned["fields"][0]["options"], value["fields"][0]["options"])
+
+    def test_derivation_target(self):
+
+        self.assertEqual(klotio_cache.derivation_target({"url": "sure"}), "sure")
+        self.assertEqual(klotio_cache.derivation_target({"node": {"a": 1}}), "http://api.klot-io/node")
+
+    def test_derivation_key(self):
+
+        self.assertEqual(klotio_cache.derivation_key({"url": "sure"}), "url:sure")
+        self.assertEqual(klotio_cache.derivation_key({"node": {"b": 2, "a": 1}}), 'node:{"a": 1, "b": 2}')
+        self.assertEqual(klotio_cache.derivation_key({"node": {"a": 1, "b": 2}}), 'node:{"a": 1, "b": 2}')
@@ -1,3 +1,6 @@
+import time
+import datetime
+import threading
 import unittest
 import unittest.mock
 import klotio_unittest
@@ -6,6 +9,26 @@ import redis
 import klotio
 
 
+class TestMockClock(unittest.TestCase):
+
+    def test___init__(self):
+
+        self.assertEqual(klotio_unittest.MockClock().now, 0.0)
+        self.assertEqual(klotio_unittest.MockClock(5).now, 5)
+
+    def test___call__(self):
+
+        self.assertEqual(klotio_unittest.MockClock(5)(), 5)
+
+    def test_advance(self):
+
+        clock = klotio_unittest.MockClock(5)
+
+        clock.advance(1.5)
+
+        self.assertEqual(clock(), 6.5)
+
+
 class TestMockRedis(unittest.TestCase):
 
     @unittest.mock.patch("redis.Redis", klotio_unittest.MockRedis)
@@ -23,7 +46,19 @@ class TestMockRedis(unittest.TestCase):
         self.assertIsNone(db.channel)
         self.assertEqual(db.data, {})
         self.assertEqual(db.expires, {})
+        self.assertEqual(db.versions, {})
         self.assertEqual(db.messages, [])
+        self.assertEqual(db.round_trips, 0)
+        self.assertEqual(db.depth, 0)
+        self.assertFalse(db.threadsafe)
+
+        db = klotio_unittest.MockRedis("test", 456, threadsafe=True)
+
+        self.assertTrue(db.threadsafe)
+        self.assertTrue(db.lock.acquire(blocking=False))
+        self.assertTrue(db.lock.acquire(blocking=False))
+        self.assertTrue(db.registry.acquire(blocking=False))
+        self.assertTrue(db.tally.acquire(blocking=False))
 
     @unittest.mock.patch("redis.Redis", klotio_unittest.MockRedis)
     def test___str__(self):
@@ -41,33 +76,1186 @@ class TestMockRedis(unittest.TestCase):
 
     def test_set(self):
 
-        self.redis.set("yep", True, ex="wife")
+        self.redis.clock = klotio_unittest.MockClock(100)
+
+        self.assertTrue(self.redis.set("yep", True, ex=10))
 
         self.assertEqual(self.redis.data, {"yep": True})
-        self.assertEqual(self.redis.expires, {"yep": "wife"})
+        self.assertEqual(self.redis.expires, {"yep": 110})
+
+        self.assertIsNone(self.redis.set("yep", False, nx=True))
+        self.assertIsNone(self.redis.set("nope", False, xx=True))
+        self.assertTrue(self.redis.set("yep", False, keepttl=True))
+        self.assertEqual(self.redis.expires, {"yep": 110})
+
+        self.assertTrue(self.redis.set("yep", True, px=500))
+        self.assertEqual(self.redis.expires, {"yep": 100.5})
+
+        self.assertTrue(self.redis.set("yep", True))
+        self.assertEqual(self.redis.expires, {"yep": None})
+
+        self.redis.hset("hash", "a", 1)
+        self.assertTrue(self.redis.set("hash", "now"))
+        self.assertEqual(self.redis.hashes, {})
+
+    def test_typed(self):
+
+        self.redis.rpush("list", 1)
+
+        self.assertEqual(self.redis.typed("new", self.redis.data), self.redis.data)
+
+        with self.assertRaises(redis.exceptions.ResponseError):
+            self.redis.get("list")
+
+    def test_command(self):
+
+        self.redis.set("yep", 1)
+        self.redis.hmset("hash", {"a": 1})
+        self.redis.incr("count")
+
+        self.assertEqual(self.redis.round_trips, 3)
+        self.assertEqual(self.redis.depth, 0)
+
+        list(self.redis.scan_iter(count=1))
+
+        self.assertEqual(self.redis.round_trips, 6)
+
+    def test_depth(self):
+
+        self.redis.depth = 2
+
+        depths = []
+        thread = threading.Thread(target=lambda: depths.append(self.redis.depth))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(self.redis.depth, 2)
+        self.assertEqual(depths, [0])
+
+    def test_trip(self):
+
+        self.redis.trip()
+
+        self.assertEqual(self.redis.round_trips, 1)
+
+    def test_threadsafe(self):
+
+        db = klotio_unittest.MockRedis("stress", 789, threadsafe=True)
+
+        producers = 8
+        consumers = 4
+        messages = 200
+
+        subscribers = [db.pubsub(ignore_subscribe_messages=True) for _ in range(consumers)]
+
+        for index, subscriber in enumerate(subscribers):
+            if index % 2:
+                subscriber.psubscribe("work.*")
+            else:
+                subscriber.subscribe(*[f"work.{producer}" for producer in range(producers)])
+
+        received = [[] for _ in range(consumers)]
+        retries = []
+
+        def produce(producer):
+
+            for message in range(messages):
+
+                db.incr("count")
+                db.hincrby("counts", producer)
+                db.rpush("log", (producer, message))
+
+                # Optimistic increment that has to retry when others get in
+
+                with db.pipeline() as pipeline:
+                    while True:
+                        try:
+                            pipeline.watch("optimistic")
+                            value = pipeline.get("optimistic") or 0
+                            pipeline.multi()
+                            pipeline.set("optimistic", value + 1)
+                            pipeline.execute()
+                            break
+                        except redis.exceptions.WatchError:
+                            retries.append(producer)
+
+                db.publish(f"work.{producer}", (producer, message))
+
+        def consume(consumer):
+
+            while len(received[consumer]) < producers * messages:
+                message = subscribers[consumer].get_message(timeout=5)
+                if message is None:
+                    break
+                received[consumer].append(message["data"])
+
+        threads = [threading.Thread(target=consume, args=(consumer,)) for consumer in range(consumers)]
+        threads.extend(threading.Thread(target=produce, args=(producer,)) for producer in range(producers))
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join(30)
+
+        self.assertEqual(db.get("count"), producers * messages)
+        self.assertEqual(db.get("optimistic"), producers * messages)
+        self.assertEqual(db.hgetall("counts"), {producer: messages for producer in range(producers)})
+        self.assertEqual(db.llen("log"), producers * messages)
+
+        # Every consumer got every message, each producer's in order
+
+        for consumer in range(consumers):
+            self.assertEqual(len(received[consumer]), producers * messages)
+            for producer in range(producers):
+                self.assertEqual(
+                    [message for sender, message in received[consumer] if sender == producer],
+                    list(range(messages))
+                )
+
+        # Every command, watch, execute and publish was counted once
+
+        self.assertEqual(db.round_trips, producers * messages * 4 + len(retries) * 3 + producers * messages * 3 + 4)
+
+    def test_changed(self):
+
+        self.redis.changed("yep")
+        self.redis.changed("yep")
+
+        self.assertEqual(self.redis.versions, {"yep": 2})
+
+    def test_remove(self):
+
+        self.redis.set("yep", 1, ex=10)
+        self.redis.versions = {}
+
+        self.assertTrue(self.redis.remove("yep"))
+        self.assertFalse(self.redis.remove("yep"))
+        self.assertEqual(self.redis.expires, {})
+        self.assertEqual(self.redis.versions, {"yep": 1})
+
+    def test_emptied(self):
+
+        self.redis.sets["set"] = set()
+        self.redis.sets["full"] = {1}
+        self.redis.expires["set"] = None
+
+        self.redis.emptied("set", self.redis.sets)
+        self.redis.emptied("full", self.redis.sets)
+        self.redis.emptied("none", self.redis.sets)
+
+        self.assertEqual(self.redis.sets, {"full": {1}})
+        self.assertEqual(self.redis.expires, {})
+        self.assertEqual(self.redis.versions, {"set": 1, "full": 1})
+
+    def test_deadline(self):
+
+        self.redis.clock = klotio_unittest.MockClock(5)
+
+        self.redis.deadline("yep", datetime.timedelta(seconds=2))
+
+        self.assertEqual(self.redis.expires, {"yep": 7})
+        self.assertEqual(self.redis.deadlines, [(7, "yep")])
+
+    def test_expire_due(self):
+
+        self.redis.clock = klotio_unittest.MockClock()
+
+        self.redis.set("short", 1, ex=1)
+        self.redis.set("long", 2, ex=5)
+        self.redis.set("changed", 3, ex=1)
+        self.redis.expire("changed", 10)
+
+        self.redis.clock.advance(1)
+
+        self.assertIsNone(self.redis.get("short"))
+        self.assertEqual(self.redis.get("long"), 2)
+        self.assertEqual(self.redis.get("changed"), 3)
+        self.assertEqual(self.redis.deadlines, [(5, "long"), (10, "changed")])
+
+        self.redis.clock.advance(4)
+
+        self.assertEqual(self.redis.mget(["short", "long", "changed"]), [None, None, 3])
+
+    def test_delete(self):
+
+        self.redis.mset({"a": 1, "b": 2})
+        self.redis.sadd("c", 3)
+
+        self.assertEqual(self.redis.delete("a", "c", "d"), 2)
+        self.assertEqual(self.redis.data, {"b": 2})
+        self.assertEqual(self.redis.sets, {})
+
+    def test_exists(self):
+
+        self.redis.set("a", 1)
+        self.redis.lpush("b", 2)
+
+        self.assertEqual(self.redis.exists("a", "b", "c"), 2)
+
+    def test_expire(self):
+
+        self.redis.clock = klotio_unittest.MockClock()
+
+        self.assertFalse(self.redis.expire("yep", 1))
+
+        self.redis.hset("yep", "a", 1)
+
+        self.assertTrue(self.redis.expire("yep", 1))
+
+        self.redis.clock.advance(1)
+
+        self.assertEqual(self.redis.hgetall("yep"), {})
+
+    def test_persist(self):
+
+        self.redis.clock = klotio_unittest.MockClock()
+
+        self.redis.set("yep", 1, ex=1)
+
+        self.assertTrue(self.redis.persist("yep"))
+        self.assertFalse(self.redis.persist("yep"))
+
+        self.redis.clock.advance(1)
+
+        self.assertEqual(self.redis.get("yep"), 1)
+
+    def test_ttl(self):
+
+        self.redis.clock = klotio_unittest.MockClock()
+
+        self.assertEqual(self.redis.ttl("yep"), -2)
+
+        self.redis.set("yep", 1)
+        self.assertEqual(self.redis.ttl("yep"), -1)
+
+        self.redis.expire("yep", 10)
+        self.redis.clock.advance(2.4)
+        self.assertEqual(self.redis.ttl("yep"), 8)
+
+        self.redis.clock.advance(7.6)
+        self.assertEqual(self.redis.ttl("yep"), -2)
+
+    def test_keys(self):
+
+        self.redis.mset({"a:1": 1, "a:2": 2, "b:1": 3})
+
+        self.assertEqual(sorted(self.redis.keys("a:*")), ["a:1", "a:2"])
+        self.assertEqual(len(self.redis.keys()), 3)
+
+    def test_index(self):
+
+        self.redis.mset({"a": 1, "b": 2})
+        self.redis.index()
+
+        self.assertEqual(self.redis.scanned, {"a": 0, "b": 1})
+        self.assertEqual(self.redis.scanning, [(0, "a"), (1, "b")])
+
+        self.redis.delete("a")
+        self.redis.set("c", 3)
+        self.redis.index()
+
+        self.assertEqual(self.redis.scanning, [(0, "a"), (1, "b"), (2, "c")])
+
+        # forgets the removed once they outnumber the rest
+
+        self.redis.mset({f"key:{index}": index for index in range(100)})
+        self.redis.index()
+        self.redis.delete(*[f"key:{index}" for index in range(100)])
+        self.redis.index()
+
+        self.assertEqual(self.redis.scanned, {"b": 1, "c": 2})
+        self.assertEqual(self.redis.scanning, [(1, "b"), (2, "c")])
+
+    def test_scan(self):
+
+        self.redis.mset({f"key:{index}": index for index in range(5)})
+        self.redis.set("other", True)
+
+        self.assertEqual(self.redis.scan(0, count=4), (4, ["key:0", "key:1", "key:2", "key:3"]))
+        self.assertEqual(self.redis.scan(4, match="key:*", count=4), (0, ["key:4"]))
+
+        # keys stay put however many are removed or added along the way
+
+        cursor, batch = self.redis.scan(0, count=2)
+
+        self.assertEqual((cursor, batch), (2, ["key:0", "key:1"]))
+
+        self.redis.delete("key:0", "key:1", "key:2")
+        self.redis.set("new", True)
+
+        self.assertEqual(self.redis.scan(cursor, count=2), (5, ["key:3", "key:4"]))
+        self.assertEqual(self.redis.scan(5, count=2), (0, ["other"]))
+
+    def test_scan_iter(self):
+
+        self.redis.mset({f"key:{index}": index for index in range(5)})
+        self.redis.set("other", True)
+
+        self.assertEqual(list(self.redis.scan_iter("key:*", count=2)), [f"key:{index}" for index in range(5)])
+
+        # deleting as it goes still gets everything
+
+        self.redis.mset({f"key:{index}": index for index in range(100)})
+
+        for key in self.redis.scan_iter():
+            self.redis.delete(key)
+
+        self.assertEqual(self.redis.keys(), [])
+
+    def test_flushdb(self):
+
+        self.redis.set("a", 1, ex=1)
+        self.redis.rpush("b", 1)
+
+        self.assertTrue(self.redis.flushdb())
+        self.assertEqual(self.redis.exists("a", "b"), 0)
+        self.assertEqual(self.redis.deadlines, [])
+
+    def test_mget(self):
+
+        self.redis.mset({"a": 1, "b": 2})
+        self.redis.sadd("c", 3)
+
+        self.assertEqual(self.redis.mget(["a", "b"], "c", "d"), [1, 2, None, None])
+        self.assertEqual(self.redis.mget("a"), [1])
+
+    def test_mset(self):
+
+        self.redis.set("a", 0, ex=10)
+
+        self.assertTrue(self.redis.mset({"a": 1, "b": 2}))
+        self.assertEqual(self.redis.data, {"a": 1, "b": 2})
+        self.assertEqual(self.redis.ttl("a"), -1)
+
+    def test_incrby(self):
+
+        self.assertEqual(self.redis.incrby("count", 5), 5)
+        self.assertEqual(self.redis.incrby("count", 2), 7)
+
+        self.redis.set("text", "nope")
+
+        with self.assertRaises(redis.exceptions.ResponseError):
+            self.redis.incrby("text")
+
+    def test_incr(self):
+
+        self.redis.set("count", "1")
+
+        self.assertEqual(self.redis.incr("count"), 2)
+
+    def test_decrby(self):
+
+        self.assertEqual(self.redis.decrby("count", 3), -3)
+
+    def test_decr(self):
+
+        self.assertEqual(self.redis.decr("count"), -1)
+
+    def test_hset(self):
+
+        self.assertEqual(self.redis.hset("hash", "a", 1), 1)
+        self.assertEqual(self.redis.hset("hash", mapping={"a": 2, "b": 3}), 1)
+        self.assertEqual(self.redis.hashes, {"hash": {"a": 2, "b": 3}})
+
+        self.redis.set("text", "nope")
+
+        with self.assertRaises(redis.exceptions.ResponseError):
+            self.redis.hset("text", "a", 1)
+
+    def test_hmset(self):
+
+        self.assertTrue(self.redis.hmset("hash", {"a": 1}))
+        self.assertEqual(self.redis.hashes, {"hash": {"a": 1}})
+
+    def test_hget(self):
+
+        self.redis.hset("hash", "a", 1)
+
+        self.assertEqual(self.redis.hget("hash", "a"), 1)
+        self.assertIsNone(self.redis.hget("hash", "b"))
+        self.assertIsNone(self.redis.hget("none", "a"))
+
+    def test_hmget(self):
+
+        self.redis.hset("hash", mapping={"a": 1, "b": 2})
+
+        self.assertEqual(self.redis.hmget("hash", ["a", "c"], "b"), [1, None, 2])
+
+    def test_hgetall(self):
+
+        self.redis.hset("hash", mapping={"a": 1})
+
+        self.assertEqual(self.redis.hgetall("hash"), {"a": 1})
+        self.assertEqual(self.redis.hgetall("none"), {})
+
+    def test_hdel(self):
+
+        self.redis.hset("hash", mapping={"a": 1, "b": 2})
+
+        self.assertEqual(self.redis.hdel("hash", "a", "c"), 1)
+        self.assertEqual(self.redis.hdel("hash", "b"), 1)
+        self.assertEqual(self.redis.hashes, {})
+
+    def test_hexists(self):
+
+        self.redis.hset("hash", "a", 1)
+
+        self.assertTrue(self.redis.hexists("hash", "a"))
+        self.assertFalse(self.redis.hexists("hash", "b"))
+
+    def test_hincrby(self):
+
+        self.assertEqual(self.redis.hincrby("hash", "a"), 1)
+        self.assertEqual(self.redis.hincrby("hash", "a", 4), 5)
+
+        self.redis.hset("hash", "b", "nope")
+
+        with self.assertRaises(redis.exceptions.ResponseError):
+            self.redis.hincrby("hash", "b")
+
+    def test_hkeys(self):
+
+        self.redis.hset("hash", mapping={"a": 1, "b": 2})
+
+        self.assertEqual(self.redis.hkeys("hash"), ["a", "b"])
+
+    def test_hvals(self):
+
+        self.redis.hset("hash", mapping={"a": 1, "b": 2})
+
+        self.assertEqual(self.redis.hvals("hash"), [1, 2])
+
+    def test_hlen(self):
+
+        self.redis.hset("hash", mapping={"a": 1, "b": 2})
+
+        self.assertEqual(self.redis.hlen("hash"), 2)
+
+    def test_lpush(self):
+
+        self.assertEqual(self.redis.lpush("list", 1, 2), 2)
+        self.assertEqual(self.redis.lrange("list", 0, -1), [2, 1])
+
+    def test_rpush(self):
+
+        self.assertEqual(self.redis.rpush("list", 1, 2), 2)
+        self.assertEqual(self.redis.lrange("list", 0, -1), [1, 2])
+
+    def test_lpop(self):
+
+        self.redis.rpush("list", 1, 2)
+
+        self.assertEqual(self.redis.lpop("list"), 1)
+        self.assertEqual(self.redis.lpop("list"), 2)
+        self.assertIsNone(self.redis.lpop("list"))
+        self.assertEqual(self.redis.lists, {})
+
+    def test_rpop(self):
+
+        self.redis.rpush("list", 1, 2)
+
+        self.assertEqual(self.redis.rpop("list"), 2)
+        self.assertEqual(self.redis.rpop("list"), 1)
+        self.assertIsNone(self.redis.rpop("list"))
+        self.assertEqual(self.redis.lists, {})
+
+    def test_span(self):
+
+        self.assertEqual(self.redis.span(5, 0, -1), slice(0, 5))
+        self.assertEqual(self.redis.span(5, -2, 10), slice(3, 5))
+        self.assertEqual(self.redis.span(5, 3, 1), slice(0, 0))
+
+    def test_lrange(self):
+
+        self.redis.rpush("list", 1, 2, 3, 4)
+
+        self.assertEqual(self.redis.lrange("list", 1, 2), [2, 3])
+        self.assertEqual(self.redis.lrange("list", -2, -1), [3, 4])
+        self.assertEqual(self.redis.lrange("none", 0, -1), [])
+
+    def test_lindex(self):
+
+        self.redis.rpush("list", 1, 2)
+
+        self.assertEqual(self.redis.lindex("list", -1), 2)
+        self.assertIsNone(self.redis.lindex("list", 5))
+
+    def test_llen(self):
+
+        self.redis.rpush("list", 1, 2)
+
+        self.assertEqual(self.redis.llen("list"), 2)
+        self.assertEqual(self.redis.llen("none"), 0)
+
+    def test_ltrim(self):
+
+        self.redis.rpush("list", 1, 2, 3, 4)
+
+        self.assertTrue(self.redis.ltrim("list", 1, -2))
+        self.assertEqual(self.redis.lrange("list", 0, -1), [2, 3])
+
+        self.redis.ltrim("list", 5, 6)
+        self.assertEqual(self.redis.lists, {})
+
+    def test_sadd(self):
+
+        self.assertEqual(self.redis.sadd("set", 1, 2), 2)
+        self.assertEqual(self.redis.sadd("set", 2, 3), 1)
+        self.assertEqual(self.redis.sets, {"set": {1, 2, 3}})
+
+    def test_srem(self):
+
+        self.redis.sadd("set", 1, 2)
+
+        self.assertEqual(self.redis.srem("set", 1, 3), 1)
+        self.assertEqual(self.redis.srem("set", 2), 1)
+        self.assertEqual(self.redis.sets, {})
+
+    def test_smembers(self):
+
+        self.redis.sadd("set", 1, 2)
+
+        self.assertEqual(self.redis.smembers("set"), {1, 2})
+        self.assertEqual(self.redis.smembers("none"), set())
+
+    def test_sismember(self):
+
+        self.redis.sadd("set", 1)
+
+        self.assertTrue(self.redis.sismember("set", 1))
+        self.assertFalse(self.redis.sismember("set", 2))
+
+    def test_scard(self):
+
+        self.redis.sadd("set", 1, 2)
+
+        self.assertEqual(self.redis.scard("set"), 2)
+
+    def test_zadd(self):
+
+        self.assertEqual(self.redis.zadd("zset", {"a": 2, "b": 1}), 2)
+        self.assertEqual(self.redis.zadd("zset", {"a": 3, "c": 0}), 1)
+        self.assertEqual(self.redis.zadd("zset", {"a": 4, "b": 1}, ch=True), 1)
+        self.assertEqual(self.redis.zadd("zset", {"a": 5, "d": 1}, nx=True), 1)
+        self.assertEqual(self.redis.zadd("zset", {"a": 5, "e": 1}, xx=True), 0)
+        self.assertEqual(self.redis.zadd("zset", {"a": 1}, incr=True), 6)
+        self.assertEqual(self.redis.zrange("zset", 0, -1, withscores=True), [
+            ("c", 0), ("b", 1), ("d", 1), ("a", 6)
+        ])
+
+        self.assertEqual(self.redis.zadd("none", {"a": 1}, xx=True), 0)
+        self.assertEqual(self.redis.zsets.keys(), {"zset"})
+
+    def test_zincrby(self):
+
+        self.assertEqual(self.redis.zincrby("zset", 2, "a"), 2)
+        self.assertEqual(self.redis.zincrby("zset", 3, "a"), 5)
+
+    def test_zrem(self):
+
+        self.redis.zadd("zset", {"a": 1, "b": 2})
+
+        self.assertEqual(self.redis.zrem("zset", "a", "c"), 1)
+        self.assertEqual(self.redis.zrem("zset", "b"), 1)
+        self.assertEqual(self.redis.zsets, {})
+
+    def test_zscore(self):
+
+        self.redis.zadd("zset", {"a": 1})
+
+        self.assertEqual(self.redis.zscore("zset", "a"), 1)
+        self.assertIsNone(self.redis.zscore("zset", "b"))
+
+    def test_zcard(self):
+
+        self.redis.zadd("zset", {"a": 1, "b": 2})
+
+        self.assertEqual(self.redis.zcard("zset"), 2)
+
+    def test_zrank(self):
+
+        self.redis.zadd("zset", {"a": 3, "b": 1, "c": 2})
+
+        self.assertEqual(self.redis.zrank("zset", "a"), 2)
+        self.assertEqual(self.redis.zrank("zset", "b"), 0)
+        self.assertIsNone(self.redis.zrank("zset", "d"))
+
+    def test_zrange(self):
+
+        self.redis.zadd("zset", {"a": 3, "b": 1, "c": 2})
+
+        self.assertEqual(self.redis.zrange("zset", 0, 1), ["b", "c"])
+        self.assertEqual(self.redis.zrange("zset", 0, 0, desc=True, withscores=True), [("a", 3.0)])
+
+    def test_zrangebyscore(self):
+
+        self.redis.zadd("zset", {"a": 3, "b": 1, "c": 2, "d": 5})
+
+        self.assertEqual(self.redis.zrangebyscore("zset", 2, 3), ["c", "a"])
+        self.assertEqual(self.redis.zrangebyscore("zset", 1, 5, start=1, num=2, withscores=True), [
+            ("c", 2.0), ("a", 3.0)
+        ])
+
+    def test_pipeline(self):
+
+        pipeline = self.redis.pipeline(transaction=False)
+
+        self.assertIsInstance(pipeline, klotio_unittest.MockPipeline)
+        self.assertEqual(pipeline.redis, self.redis)
+        self.assertFalse(pipeline.transaction)
+
+        self.assertTrue(self.redis.pipeline().transaction)
 
     def test_publish(self):
 
-        self.redis.publish("unit-test", "test-unit")
+        self.assertEqual(self.redis.publish("unit-test", "test-unit"), 0)
 
         self.assertEqual(self.redis.channel, "unit-test")
         self.assertEqual(self.redis.messages, ["test-unit"])
+        self.assertEqual(self.redis.round_trips, 1)
+
+        first = self.redis.pubsub()
+        first.subscribe("unit-test")
+        first.psubscribe("unit-*")
+
+        second = self.redis.pubsub()
+        second.subscribe("other")
+
+        self.assertEqual(self.redis.publish("unit-test", "again"), 1)
+        self.assertEqual(self.redis.messages, ["test-unit", "again"])
 
     def test_pubsub(self):
 
-        self.assertEqual(self.redis.pubsub(), self.redis)
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+
+        self.assertIsInstance(pubsub, klotio_unittest.MockPubSub)
+        self.assertEqual(pubsub.redis, self.redis)
+        self.assertTrue(pubsub.ignore_subscribe_messages)
+        self.assertIsNot(pubsub.queue, self.redis.pubsub().queue)
+
+
+class TestMockPipeline(unittest.TestCase):
+
+    def setUp(self):
+
+        self.redis = klotio_unittest.MockRedis("unit", 123)
+        self.pipeline = self.redis.pipeline()
+
+    def test___init__(self):
+
+        pipeline = klotio_unittest.MockPipeline(self.redis, False)
+
+        self.assertEqual(pipeline.redis, self.redis)
+        self.assertFalse(pipeline.transaction)
+        self.assertEqual(pipeline.commands, [])
+        self.assertEqual(pipeline.watching, {})
+        self.assertFalse(pipeline.immediate)
+        self.assertFalse(pipeline.explicit)
+
+    def test___len__(self):
+
+        self.pipeline.set("a", 1).set("b", 2)
+
+        self.assertEqual(len(self.pipeline), 2)
+
+    def test___enter__(self):
+
+        with self.pipeline as pipeline:
+            self.assertEqual(pipeline, self.pipeline)
+
+    def test___exit__(self):
+
+        with self.pipeline as pipeline:
+            pipeline.set("a", 1)
+
+        self.assertEqual(len(self.pipeline), 0)
+
+    def test___getattr__(self):
+
+        self.assertEqual(self.pipeline.set("a", 1), self.pipeline)
+        self.assertIsNone(self.redis.get("a"))
+
+        self.pipeline.immediate = True
+
+        self.assertTrue(self.pipeline.set("a", 1))
+        self.assertEqual(self.redis.get("a"), 1)
+
+        with self.assertRaises(AttributeError):
+            self.pipeline.nope
+
+    def test_reset(self):
+
+        self.pipeline.watch("a")
+        self.pipeline.multi()
+        self.pipeline.set("a", 1)
+
+        self.pipeline.reset()
+
+        self.assertEqual(self.pipeline.commands, [])
+        self.assertEqual(self.pipeline.watching, {})
+        self.assertFalse(self.pipeline.immediate)
+        self.assertFalse(self.pipeline.explicit)
+
+    def test_watch(self):
+
+        self.redis.set("a", 1)
+
+        self.assertTrue(self.pipeline.watch("a", "b"))
+        self.assertEqual(self.pipeline.watching, {"a": 1, "b": 0})
+        self.assertTrue(self.pipeline.immediate)
+        self.assertEqual(self.redis.round_trips, 2)
+
+        self.assertEqual(self.pipeline.get("a"), 1)
+        self.assertEqual(self.redis.round_trips, 3)
+
+        self.pipeline.multi()
+
+        with self.assertRaisesRegex(redis.exceptions.RedisError, "Cannot issue a WATCH after a MULTI"):
+            self.pipeline.watch("a")
+
+    def test_unwatch(self):
+
+        self.pipeline.watch("a")
+
+        self.assertTrue(self.pipeline.unwatch())
+        self.assertEqual(self.pipeline.watching, {})
+
+        self.redis.set("a", 1)
+        self.pipeline.multi()
+        self.pipeline.get("a")
+
+        self.assertEqual(self.pipeline.execute(), [1])
+
+    def test_multi(self):
+
+        self.pipeline.watch("a")
+        self.pipeline.multi()
+
+        self.assertFalse(self.pipeline.immediate)
+        self.assertTrue(self.pipeline.explicit)
+
+        with self.assertRaisesRegex(redis.exceptions.RedisError, "Cannot issue nested calls to MULTI"):
+            self.pipeline.multi()
+
+        # without watching first, like redis-py
+
+        pipeline = self.redis.pipeline()
+        pipeline.multi()
+        pipeline.set("a", 1)
+
+        self.assertEqual(pipeline.execute(), [True])
+        self.assertEqual(self.redis.get("a"), 1)
+
+        # but not after commands are queued
+
+        pipeline.set("a", 2)
+
+        with self.assertRaisesRegex(redis.exceptions.RedisError, "Commands without an initial WATCH"):
+            pipeline.multi()
+
+    def test_execute(self):
+
+        self.redis.clock = klotio_unittest.MockClock()
+
+        # Queued commands run together in one round trip
+
+        self.pipeline.set("a", 1, ex=1).incr("a").hset("hash", "b", 2).get("a")
+
+        self.assertEqual(self.redis.round_trips, 0)
+        self.assertEqual(self.pipeline.execute(), [True, 2, 1, 2])
+        self.assertEqual(self.redis.round_trips, 1)
+        self.assertEqual(len(self.pipeline), 0)
+
+        self.assertEqual(self.pipeline.execute(), [])
+
+        # Errors are raised after everything runs unless asked not to
+
+        self.pipeline.incr("hash").set("c", 3)
+
+        with self.assertRaises(redis.exceptions.ResponseError):
+            self.pipeline.execute()
+
+        self.assertEqual(self.redis.get("c"), 3)
+
+        results = self.pipeline.incr("hash").get("c").execute(raise_on_error=False)
+
+        self.assertIsInstance(results[0], redis.exceptions.ResponseError)
+        self.assertEqual(results[1], 3)
+
+        # Watched keys untouched go through
+
+        self.pipeline.watch("a")
+        value = self.pipeline.get("a")
+        self.pipeline.multi()
+        self.pipeline.set("a", value + 1)
+
+        self.assertEqual(self.pipeline.execute(), [True])
+        self.assertEqual(self.redis.get("a"), 3)
+
+        # Watched keys changed, even to the same value, abort
+
+        self.pipeline.watch("a")
+        self.redis.set("a", 3)
+        self.pipeline.multi()
+        self.pipeline.set("a", 4)
+
+        with self.assertRaises(redis.exceptions.WatchError):
+            self.pipeline.execute()
+
+        self.assertEqual(self.redis.get("a"), 3)
+        self.assertEqual(self.pipeline.watching, {})
+
+        # As do watched keys that expire
+
+        self.redis.set("a", 1, ex=1)
+        self.pipeline.watch("a")
+        self.redis.clock.advance(1)
+        self.pipeline.multi()
+        self.pipeline.set("a", 2)
+
+        with self.assertRaises(redis.exceptions.WatchError):
+            self.pipeline.execute()
+
+
+class TestMockPubSub(unittest.TestCase):
+
+    def setUp(self):
+
+        self.redis = klotio_unittest.MockRedis("unit", 123)
+        self.pubsub = self.redis.pubsub()
+
+    def test___init__(self):
+
+        pubsub = klotio_unittest.MockPubSub(self.redis, True)
+
+        self.assertEqual(pubsub.redis, self.redis)
+        self.assertTrue(pubsub.ignore_subscribe_messages)
+        self.assertEqual(pubsub.channels, set())
+        self.assertEqual(pubsub.patterns, set())
+        self.assertEqual(list(pubsub.queue), [])
+
+    def test_subscribed(self):
+
+        self.assertFalse(self.pubsub.subscribed)
+
+        self.pubsub.psubscribe("*")
+
+        self.assertTrue(self.pubsub.subscribed)
+
+    def test_register(self):
+
+        self.pubsub.channels.add("stuff")
+        self.pubsub.register()
+        self.pubsub.register()
+
+        self.assertEqual(self.redis.subscribers, [self.pubsub])
+
+        self.pubsub.channels.clear()
+        self.pubsub.register()
+
+        self.assertEqual(self.redis.subscribers, [])
+
+    def test_confirm(self):
+
+        self.pubsub.channels.add("stuff")
+
+        self.pubsub.confirm("subscribe", None, "stuff")
+
+        self.assertEqual(list(self.pubsub.queue), [
+            {"type": "subscribe", "pattern": None, "channel": "stuff", "data": 1}
+        ])
+
+    def test_push(self):
+
+        self.pubsub.push({"type": "message"})
+
+        self.assertEqual(list(self.pubsub.queue), [{"type": "message"}])
+
+    def test_deliver(self):
+
+        self.pubsub.channels.add("unit.test")
+        self.pubsub.patterns.update(["unit.*", "*.test", "nope.*"])
+
+        self.assertTrue(self.pubsub.deliver("unit.test", "yep"))
+        self.assertFalse(self.pubsub.deliver("other", "nope"))
+
+        self.assertEqual(list(self.pubsub.queue), [
+            {"type": "message", "pattern": None, "channel": "unit.test", "data": "yep"},
+            {"type": "pmessage", "pattern": "*.test", "channel": "unit.test", "data": "yep"},
+            {"type": "pmessage", "pattern": "unit.*", "channel": "unit.test", "data": "yep"}
+        ])
 
     def test_subscribe(self):
 
-        self.redis.subscribe("stuff")
+        self.pubsub.subscribe("stuff", "things")
+
+        self.assertEqual(self.pubsub.channels, {"stuff", "things"})
+        self.assertEqual(self.redis.subscribers, [self.pubsub])
+        self.assertEqual(list(self.pubsub.queue), [
+            {"type": "subscribe", "pattern": None, "channel": "stuff", "data": 1},
+            {"type": "subscribe", "pattern": None, "channel": "things", "data": 2}
+        ])
+
+    def test_unsubscribe(self):
+
+        self.pubsub.subscribe("stuff", "things")
+        self.pubsub.queue.clear()
+
+        self.pubsub.unsubscribe("stuff")
+
+        self.assertEqual(self.pubsub.channels, {"things"})
+        self.assertEqual(self.redis.subscribers, [self.pubsub])
+
+        self.pubsub.unsubscribe()
+
+        self.assertEqual(self.pubsub.channels, set())
+        self.assertEqual(self.redis.subscribers, [])
+        self.assertEqual(list(self.pubsub.queue), [
+            {"type": "unsubscribe", "pattern": None, "channel": "stuff", "data": 1},
+            {"type": "unsubscribe", "pattern": None, "channel": "things", "data": 0}
+        ])
+
+    def test_psubscribe(self):
+
+        self.pubsub.psubscribe("stuff.*")
+
+        self.assertEqual(self.pubsub.patterns, {"stuff.*"})
+        self.assertEqual(self.redis.subscribers, [self.pubsub])
+        self.assertEqual(list(self.pubsub.queue), [
+            {"type": "psubscribe", "pattern": "stuff.*", "channel": None, "data": 1}
+        ])
 
-        self.assertEqual(self.redis.channel, "stuff")
+    def test_punsubscribe(self):
+
+        self.pubsub.psubscribe("stuff.*", "things.*")
+        self.pubsub.queue.clear()
+
+        self.pubsub.punsubscribe()
+
+        self.assertEqual(self.pubsub.patterns, set())
+        self.assertEqual(self.redis.subscribers, [])
+        self.assertEqual(list(self.pubsub.queue), [
+            {"type": "punsubscribe", "pattern": "stuff.*", "channel": None, "data": 1},
+            {"type": "punsubscribe", "pattern": "things.*", "channel": None, "data": 0}
+        ])
+
+    def test_pop(self):
+
+        self.assertIsNone(self.pubsub.pop(None))
+
+        self.pubsub.subscribe("stuff")
+
+        self.assertEqual(self.pubsub.pop(0)["type"], "subscribe")
+        self.assertIsNone(self.pubsub.pop(0.01))
+
+    def test_ignored(self):
+
+        self.assertFalse(self.pubsub.ignored({"type": "subscribe"}))
+        self.assertTrue(self.pubsub.ignored({"type": "subscribe"}, True))
+        self.assertFalse(self.pubsub.ignored({"type": "pmessage"}, True))
+
+        self.pubsub.ignore_subscribe_messages = True
+
+        self.assertTrue(self.pubsub.ignored({"type": "unsubscribe"}))
 
     def test_get_message(self):
 
-        self.redis.messages = ["things"]
+        self.pubsub.subscribe("stuff")
+
+        self.assertEqual(self.pubsub.get_message(), {
+            "type": "subscribe", "pattern": None, "channel": "stuff", "data": 1
+        })
+        self.assertIsNone(self.pubsub.get_message())
+
+        self.redis.publish("stuff", "things")
 
-        self.assertEqual(self.redis.get_message(), "things")
+        self.assertEqual(self.pubsub.get_message(), {
+            "type": "message", "pattern": None, "channel": "stuff", "data": "things"
+        })
+
+        self.pubsub.psubscribe("*")
+        self.redis.publish("other", "things")
+
+        self.assertEqual(self.pubsub.get_message(ignore_subscribe_messages=True), {
+            "type": "pmessage", "pattern": "*", "channel": "other", "data": "things"
+        })
+
+        # Blocks until published from elsewhere
+
+        timer = threading.Timer(0.05, self.redis.publish, ("stuff", "later"))
+        timer.start()
+
+        self.assertEqual(self.pubsub.get_message(timeout=5)["type"], "message")
+        self.assertEqual(self.pubsub.get_message(timeout=5)["type"], "pmessage")
+
+        timer.join()
+
+        # Gives up after the timeout
+
+        start = time.monotonic()
+
+        self.assertIsNone(self.pubsub.get_message(timeout=0.05))
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+    def test_listen(self):
+
+        self.pubsub.subscribe("stuff")
+
+        def publish():
+            self.redis.publish("stuff", 1)
+            self.redis.publish("stuff", 2)
+            self.pubsub.unsubscribe()
+
+        timer = threading.Timer(0.05, publish)
+        timer.start()
+
+        self.assertEqual([message["data"] for message in self.pubsub.listen()], [1, 1, 2, 0])
+
+        timer.join()
+
+        self.pubsub.ignore_subscribe_messages = True
+        self.pubsub.subscribe("stuff")
+        self.redis.publish("stuff", 3)
+        self.pubsub.unsubscribe()
+
+        self.assertEqual([message["data"] for message in self.pubsub.listen()], [3])
+
+    def test_close(self):
+
+        self.pubsub.subscribe("stuff")
+        self.pubsub.psubscribe("*")
+
+        self.pubsub.close()
+
+        self.assertFalse(self.pubsub.subscribed)
+        self.assertEqual(list(self.pubsub.queue), [])
+        self.assertEqual(self.redis.subscribers, [])
+        self.assertEqual(self.redis.publish("stuff", "nope"), 0)
+
+
+class TestMockSortedSet(unittest.TestCase):
+
+    def setUp(self):
+
+        self.zset = klotio_unittest.MockSortedSet()
+
+    def test___init__(self):
+
+        self.assertEqual(self.zset.scores, {})
+        self.assertEqual(self.zset.ordered, [])
+
+    def test___len__(self):
+
+        self.zset.add("a", 1)
+
+        self.assertEqual(len(self.zset), 1)
+
+    def test_add(self):
+
+        self.zset.add("a", 2)
+        self.zset.add("b", 1)
+        self.zset.add("a", 0)
+
+        self.assertEqual(self.zset.scores, {"a": 0, "b": 1})
+        self.assertEqual(self.zset.ordered, [(0, "a"), (1, "b")])
+
+    def test_remove(self):
+
+        self.zset.add("a", 2)
+
+        self.assertTrue(self.zset.remove("a"))
+        self.assertFalse(self.zset.remove("a"))
+        self.assertEqual(self.zset.ordered, [])
+
+
+class TestIndexedList(unittest.TestCase):
+
+    def setUp(self):
+
+        self.items = klotio_unittest.IndexedList([
+            {"level": "info", "message": "a", "extra": [1]},
+            {"level": "error", "message": "b"},
+            "plain"
+        ])
+
+    def test___init__(self):
+
+        self.assertEqual(self.items, [
+            {"level": "info", "message": "a", "extra": [1]},
+            {"level": "error", "message": "b"},
+            "plain"
+        ])
+        self.assertFalse(self.items.stale)
+        self.assertEqual(self.items.buckets, {
+            ("level", "info"): [0],
+            ("message", "a"): [0],
+            ("level", "error"): [1],
+            ("message", "b"): [1]
+        })
+
+    def test_reindex(self):
+
+        self.items.buckets = {}
+        self.items.stale = True
+
+        self.items.reindex()
+
+        self.assertFalse(self.items.stale)
+        self.assertEqual(self.items.buckets[("level", "info")], [0])
+
+    def test_bucket(self):
+
+        self.items.bucket(5, {"level": "info", "nested": {"a": 1}})
+        self.items.bucket(6, "plain")
+
+        self.assertEqual(self.items.buckets[("level", "info")], [0, 5])
+        self.assertNotIn("nested", [key for key, value in self.items.buckets])
+
+    def test_append(self):
+
+        self.items.append({"level": "info", "message": "c"})
+
+        self.assertEqual(self.items.buckets[("level", "info")], [0, 3])
+
+    def test_extend(self):
+
+        self.items.extend([{"level": "info"}, {"level": "info"}])
+
+        self.assertEqual(self.items.buckets[("level", "info")], [0, 3, 4])
+
+    def test_changing(self):
+
+        self.items.insert(0, {"level": "info", "message": "z"})
+
+        self.assertTrue(self.items.stale)
+        self.assertEqual(self.items.candidates({"level": "info"}), [
+            {"level": "info", "message": "z"},
+            {"level": "info", "message": "a", "extra": [1]}
+        ])
+        self.assertFalse(self.items.stale)
+
+        for change in [
+            lambda: self.items.pop(),
+            lambda: self.items.remove({"level": "error", "message": "b"}),
+            lambda: self.items.reverse(),
+            lambda: self.items.__setitem__(0, {}),
+            lambda: self.items.__delitem__(0),
+            lambda: self.items.clear()
+        ]:
+            self.items.stale = False
+            change()
+            self.assertTrue(self.items.stale)
+
+        self.assertEqual(self.items.candidates({"level": "info"}), [])
+
+    def test_candidates(self):
+
+        self.assertEqual(self.items.candidates({"level": "error", "message": "b"}), [{"level": "error", "message": "b"}])
+        self.assertEqual(self.items.candidates({"level": "info", "message": "c"}), [])
+        self.assertEqual(self.items.candidates({"level": "debug"}), [])
+        self.assertIsNone(self.items.candidates({"extra": [1]}))
+        self.assertIsNone(self.items.candidates("plain"))
 
 
 class TestMockLogger(unittest.TestCase):
@@ -84,6 +1272,7 @@ class TestMockLogger(unittest.TestCase):
 
         self.assertEqual(logger.name, "test")
         self.assertEqual(logger.events, [])
+        self.assertIsInstance(logger.events, klotio_unittest.IndexedList)
 
     def test_clear(self):
 
@@ -204,34 +1393,134 @@ class TestUnitTest(klotio_unittest.TestCase):
         self.assertTrue(self.consistent([1, 2], [1, 2, 3]))
         self.assertFalse(self.consistent([1, 2, 4], [2, 1]))
         self.assertFalse(self.consistent([1, 2], [2, 1]))
+        self.assertTrue(self.consistent([1, 1], [1]))
+        self.assertTrue(self.consistent([], [1]))
+        self.assertFalse(self.consistent([1], []))
+        self.assertFalse(self.consistent([2, 1, 2], [0, 0, 2, 1]))
+        self.assertTrue(self.consistent(list(range(0, 10000, 3)), list(range(10000))))
+        self.assertFalse(self.consistent(list(range(10000, 0, -3)), list(range(10000))))
+
+        self.assertTrue(self.consistent([{"a": 1}, {"a": 1}], [{"a": 1, "b": 2}]))
+        self.assertFalse(self.consistent([{"a": 2}, {"a": 1}, {"a": 2}], [{"a": 0}, {"a": 0}, {"a": 2}, {"a": 1}]))
+        self.assertTrue(self.consistent([{"a": 2}, {"a": 1}, {"a": 2}], [{"a": 0}, {"a": 2}, {"a": 1}, {"a": 2}]))
+        self.assertTrue(self.consistent([1, [2]], [0, 1, [2, 3]]))
 
         # else
 
         self.assertTrue(self.consistent("a", "a"))
         self.assertFalse(self.consistent("a", "b"))
 
+    def test_scalar(self):
+
+        self.assertTrue(self.scalar("a"))
+        self.assertTrue(self.scalar(1))
+        self.assertTrue(self.scalar(1.5))
+        self.assertTrue(self.scalar(True))
+        self.assertTrue(self.scalar(None))
+        self.assertFalse(self.scalar(float("nan")))
+        self.assertFalse(self.scalar([1]))
+        self.assertFalse(self.scalar({"a": 1}))
+
+    def test_positions(self):
+
+        self.assertEqual(self.positions(["a", 1, "a", None]), {"a": [0, 2], 1: [1], None: [3]})
+        self.assertIsNone(self.positions(["a", [1]]))
+
+    def test_consistent_positions(self):
+
+        positions = self.positions([1, 2, 3, 1])
+
+        self.assertTrue(self.consistent_positions([1, 2, 1], positions))
+        self.assertTrue(self.consistent_positions([3, 1], positions))
+        self.assertFalse(self.consistent_positions([3, 2], positions))
+        self.assertFalse(self.consistent_positions([4], positions))
+
     def test_contains(self):
 
         self.assertTrue(self.contains({"a": 1}, [{"a": 1, "b": 2}]))
         self.assertFalse(self.contains({"a": 2}, [{"a": 1, "b": 2}]))
 
+        indexed = klotio_unittest.IndexedList([{"a": 1, "b": 2}, {"a": 2, "b": [3, 4]}])
+
+        self.assertTrue(self.contains({"a": 1}, indexed))
+        self.assertTrue(self.contains({"b": [4]}, indexed))
+        self.assertFalse(self.contains({"a": 3}, indexed))
+        self.assertFalse(self.contains({"a": 1, "b": [3]}, indexed))
+
+    def test_inconsistencies(self):
+
+        self.assertEqual(self.inconsistencies({"a": 1}, {"a": 1, "b": 2}), [])
+
+        self.assertEqual(self.inconsistencies({"a": 1, "b": 2}, {"a": 2}), [
+            ("a", "expected 1 got 2")
+        ])
+
+        self.assertEqual(self.inconsistencies({
+            "a": 1,
+            "b": [1, 2],
+            "c": {"d": 2},
+            "fields": [{"name": "x"}, {"name": "y", "integrate": {"node": "z" * 100}}]
+        }, {
+            "a": 2,
+            "b": [1],
+            "c": {},
+            "fields": [{"name": "x"}, {"name": "y", "integrate": {"node": "nope"}}]
+        }, "top", every=True), [
+            ("top.a", "expected 1 got 2"),
+            ("top.b[1]", "missing, expected 2"),
+            ("top.c.d", "missing, expected 2"),
+            ("top.fields[1].integrate.node", f"expected '{'z' * 37}...{'z' * 38}' got 'nope'")
+        ])
+
+        self.assertEqual(self.inconsistencies([1, 3], [1, 2]), [("[1]", "expected 3 got 2")])
+        self.assertEqual(self.inconsistencies([2, 1], [1, 2]), [("[1]", "expected 1 got 2")])
+        self.assertEqual(self.inconsistencies("a", "b"), [("", "expected 'a' got 'b'")])
+
+    @unittest.mock.patch("klotio_unittest.TestCase.PATHS", 2)
+    def test_inconsistent(self):
+
+        self.assertEqual(self.inconsistent("a", "b"), "  <top>: expected 'a' got 'b'")
+
+        self.assertEqual(self.inconsistent({"a": 1, "b": 2, "c": 3}, {}, every=True), "\n".join([
+            "  a: missing, expected 1",
+            "  b: missing, expected 2",
+            "  ...and 1 more"
+        ]))
+
     def test_assertConsistent(self):
 
         self.assertConsistent({"a": 1}, {"a": 1, "b": 2})
 
-        with unittest.mock.patch('klotio_unittest.TestCase.assertEqual') as mock_equal:
-
+        with self.assertRaises(AssertionError) as context:
             self.assertConsistent({"a": 2}, {"a": 1, "b": 2}, "nope")
-            mock_equal.assert_called_once_with({"a": 2}, {"a": 1, "b": 2}, "nope")
+
+        self.assertEqual(str(context.exception), "not consistent:\n  a: expected 2 got 1 : nope")
+
+        with self.assertRaises(AssertionError) as context:
+            self.assertConsistent({"a": 2, "b": 1}, {"a": 1, "b": 2}, path="model", every=True)
+
+        self.assertEqual(str(context.exception), "\n".join([
+            "not consistent:",
+            "  model.a: expected 2 got 1",
+            "  model.b: expected 1 got 2"
+        ]))
 
     def test_assertContains(self):
 
         self.assertContains({"a": 1}, [{"a": 1, "b": 2}])
 
-        with unittest.mock.patch('klotio_unittest.TestCase.assertIn') as mock_in:
+        with self.assertRaises(AssertionError) as context:
+            self.assertContains({"a": 2, "b": 2}, [{"a": 1, "b": 1}, {"a": 1, "b": 2}], "nope")
+
+        self.assertEqual(str(context.exception), "\n".join([
+            "{'a': 2, 'b': 2} not contained in 2 items, closest [1]:",
+            "  [1].a: expected 2 got 1 : nope"
+        ]))
+
+        with self.assertRaises(AssertionError) as context:
+            self.assertContains({"a": 2}, [])
 
-            self.assertContains({"a": 2}, [{"a": 1, "b": 2}], "nope")
-            mock_in.assert_called_once_with({"a": 2}, [{"a": 1, "b": 2}], "nope")
+        self.assertEqual(str(context.exception), "{'a': 2} not contained in empty container")
 
     def test_assertLogged(self):
 
@@ -239,6 +1528,15 @@ class TestUnitTest(klotio_unittest.TestCase):
 
         self.assertLogged(self.logger, "info", "sure", extra={"a": 1})
 
+        for index in range(10000):
+            self.logger.debug(f"noise {index}", extra={"index": index})
+
+        self.logger.warning("needle", extra={"a": {"b": 2}})
+
+        self.assertLogged(self.logger, "warning", "needle", extra={"a": {"b": 2}})
+        self.assertLogged(self.logger, "debug", "noise 5000")
+        self.assertRaises(AssertionError, self.assertLogged, self.logger, "warning", "needle", extra={"a": {"b": 3}})
+
     def test_assertFields(self):
 
         fields = unittest.mock.MagicMock()